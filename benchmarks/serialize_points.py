@@ -0,0 +1,34 @@
+""" Compares serializing search hits through `Point` with the single pass `point_from_hit`
+
+Usage: python benchmarks/serialize_points.py [number of hits]
+"""
+import sys
+import timeit
+
+from wiating_backend.elastic import Point, point_from_hit
+
+
+def make_hits(count):
+    return [{"_id": str(i), "_source": {
+        "name": "point %d" % i, "description": "some description", "directions": "some directions",
+        "location": {"lat": 50.0 + i / 10000, "lon": 16.0 + i / 10000}, "type": "SHED",
+        "water_exists": True, "water_comment": None, "fire_exists": False, "fire_comment": None,
+        "created_timestamp": "1583403492", "created_by": "some id", "last_modified_timestamp": "1583403492",
+        "last_modified_by": "some id", "images": [{"name": "%d.jpg" % i, "created_timestamp": "1583403492",
+                                                   "created_by": "some id"}]}} for i in range(count)]
+
+
+def through_point(hits):
+    return [Point.from_dict(hit).to_dict(with_id=True) for hit in hits]
+
+
+def single_pass(hits):
+    return [point_from_hit(hit, with_id=True) for hit in hits]
+
+
+if __name__ == '__main__':
+    hits = make_hits(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    assert through_point(hits) == single_pass(hits)
+    for function in (through_point, single_pass):
+        best = min(timeit.repeat(lambda: function(hits), number=20, repeat=5)) / 20
+        print('%-14s %8.3f ms per %d hits' % (function.__name__, best * 1000, len(hits)))
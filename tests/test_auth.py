@@ -1,6 +1,19 @@
+import json
+import time
+from unittest.mock import MagicMock
+
 import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from authlib.jose.errors import ExpiredTokenError, MissingClaimError
 
-from wiating_backend.auth import AuthError, get_token_auth_header
+from wiating_backend import tokens
+from wiating_backend import auth
+from wiating_backend.auth import AuthError, InvalidToken, check_permissions, get_token_auth_header
+from wiating_backend.cache import TTLCache
+from wiating_backend.config import DefaultConfig
+from wiating_backend.constants import APP_METADATA_KEY, MODERATOR
 
 
 def test_get_token_auth_header_success(client):
@@ -30,3 +43,123 @@ def test_get_token_auth_header_to_much_tags(client):
     client.get('/get_points', headers={'Authorization': 'Bearer 123abc 321cba'})
     with pytest.raises(AuthError):
         get_token_auth_header()
+
+
+@pytest.fixture
+def auth_config():
+    config = MagicMock()
+    config.AUTH0_DOMAIN = 'some_domain'
+    config.INDEX_NAME = 'wiaty'
+    config.AUTH_CACHE_TTL = 60
+    config.AUTH_LOCAL_CACHE_TTL = 10
+    config.AUTH_LOCAL_JWT = False
+    return config
+
+
+@pytest.fixture
+def users_mock(mocker):
+    mocker.patch('wiating_backend.auth._users', TTLCache())
+    return mocker.patch('wiating_backend.auth.Users', autospec=True)
+
+
+def test_check_permissions_auth0(users_mock, auth_config, mocker):
+    redis = mocker.patch('wiating_backend.auth.redis_client', autospec=True).return_value
+    redis.get.return_value = None
+    users_mock.return_value.userinfo.return_value = {'sub': 'some sub', APP_METADATA_KEY: {
+        'role': MODERATOR, 'services': ['wiaty']}}
+
+    assert check_permissions('some token', config=auth_config) == {'sub': 'some sub', 'is_moderator': True}
+    assert check_permissions('some token', config=auth_config) == {'sub': 'some sub', 'is_moderator': True}
+
+    users_mock.return_value.userinfo.assert_called_once_with('some token')
+    redis.get.assert_called_once()
+    key, value = redis.set.call_args[0]
+    assert 'some token' not in key
+    assert json.loads(value) == {'sub': 'some sub', 'is_moderator': True}
+    assert redis.set.call_args[1] == {'ex': 60}
+
+
+def test_check_permissions_redis(users_mock, auth_config, mocker):
+    redis = mocker.patch('wiating_backend.auth.redis_client', autospec=True).return_value
+    redis.get.return_value = b'{"sub": "some sub", "is_moderator": false}'
+
+    assert check_permissions('some token', config=auth_config) == {'sub': 'some sub', 'is_moderator': False}
+    users_mock.assert_not_called()
+    redis.set.assert_not_called()
+
+
+def test_check_permissions_local_jwt(users_mock, auth_config, mocker):
+    auth_config.AUTH_LOCAL_JWT = True
+    redis = mocker.patch('wiating_backend.auth.redis_client', autospec=True)
+    verify = mocker.patch('wiating_backend.auth.tokens.verify', autospec=True)
+    verify.return_value = {'sub': 'some sub', 'exp': time.time() + 60, APP_METADATA_KEY: {
+        'role': MODERATOR, 'services': ['wiaty']}}
+
+    assert check_permissions('some.jwt.token', config=auth_config) == {'sub': 'some sub', 'is_moderator': True}
+    assert check_permissions('some.jwt.token', config=auth_config) == {'sub': 'some sub', 'is_moderator': True}
+
+    verify.assert_called_once()
+    users_mock.assert_not_called()
+    redis.assert_not_called()
+
+
+def test_check_permissions_local_jwt_invalid(users_mock, auth_config, mocker):
+    auth_config.AUTH_LOCAL_JWT = True
+    mocker.patch('wiating_backend.auth.tokens.verify', autospec=True, side_effect=ExpiredTokenError())
+
+    with pytest.raises(InvalidToken):
+        check_permissions('some.jwt.token', config=auth_config)
+    users_mock.assert_not_called()
+
+
+def test_check_permissions_local_jwt_missing_claim(users_mock, auth_config, mocker):
+    auth_config.AUTH_LOCAL_JWT = True
+    mocker.patch('wiating_backend.auth.tokens.verify', autospec=True, side_effect=MissingClaimError('exp'))
+
+    with pytest.raises(InvalidToken) as error:
+        check_permissions('some.jwt.token', config=auth_config)
+    assert error.value.status_code == 401
+
+
+@pytest.mark.parametrize('dependency', [auth.require_auth, auth.allow_auth])
+def test_local_jwt_invalid_unauthorized(users_mock, auth_config, mocker, dependency):
+    auth_config.AUTH_LOCAL_JWT = True
+    mocker.patch('wiating_backend.auth.tokens.verify', autospec=True, side_effect=ExpiredTokenError())
+    mocker.patch('wiating_backend.auth.check_permissions', lambda token: check_permissions(token, config=auth_config))
+    app = FastAPI()
+
+    @app.get('/')
+    def route(user=Depends(dependency)):
+        return user
+
+    response = TestClient(app).get('/', headers={'Authorization': 'Bearer some.jwt.token'})
+
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+    users_mock.assert_not_called()
+
+
+def test_local_jwt_needs_audience(monkeypatch):
+    monkeypatch.setenv('AUTH0_DOMAIN', 'some_domain')
+    monkeypatch.setenv('AUTH_LOCAL_JWT', 'true')
+    monkeypatch.delenv('AUTH0_AUDIENCE', raising=False)
+
+    with pytest.raises(ValueError):
+        DefaultConfig()
+    monkeypatch.setenv('AUTH0_AUDIENCE', 'some audience')
+    assert DefaultConfig().AUTH_LOCAL_JWT
+
+
+@pytest.mark.parametrize('token, claims, side_effect', [
+    ('opaque token', None, None),
+    ('some.jwt.token', None, tokens.NotVerifiable()),
+    ('some.jwt.token', {'sub': 'some sub', 'exp': time.time() + 60}, None),
+])
+def test_check_permissions_local_jwt_falls_back(users_mock, auth_config, mocker, token, claims, side_effect):
+    auth_config.AUTH_LOCAL_JWT = True
+    mocker.patch('wiating_backend.auth.tokens.verify', autospec=True, return_value=claims, side_effect=side_effect)
+    mocker.patch('wiating_backend.auth.redis_client', autospec=True).return_value.get.return_value = None
+    users_mock.return_value.userinfo.return_value = {'sub': 'some sub'}
+
+    assert check_permissions(token, config=auth_config) == {'sub': 'some sub', 'is_moderator': False}
+    users_mock.return_value.userinfo.assert_called_once_with(token)
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from wiating_backend.cache import SingleFlight, TTLCache
+
+
+def test_ttl_cache_expires():
+    cache = TTLCache(ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=0)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c', 'default') == 'default'
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow, 21)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow, 21))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert calls == [21]
+    assert results == [42, 42, 42, 42]
+
+
+def test_single_flight_propagates_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('some error')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'next call runs again') == 'next call runs again'
@@ -1,7 +1,11 @@
+import asyncio
 import datetime
 import pytest
-from unittest.mock import MagicMock
-from wiating_backend.elastic import Location, Point, NotDefined, Elasticsearch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from elasticsearch import ConflictError
+from wiating_backend.elastic import AsyncElasticsearch, Location, Point, NotDefined, Elasticsearch, cluster_precision, \
+    decode_cursor, encode_cursor, log_index, point_from_hit
 
 
 @pytest.fixture
@@ -9,6 +13,23 @@ def elasticsearch(mocker):
     return mocker.patch('wiating_backend.elastic.ES', autospec=True)
 
 
+@pytest.fixture
+def async_elasticsearch(mocker):
+    return mocker.patch('wiating_backend.elastic.AsyncES', autospec=True)
+
+
+@pytest.fixture(params=['sync', 'async'])
+def backend(request, mocker):
+    """Runs a test against `Elasticsearch` and against `AsyncElasticsearch`, which the routes use
+    """
+    if request.param == 'sync':
+        client = mocker.patch('wiating_backend.elastic.ES', autospec=True).return_value
+        return SimpleNamespace(es=Elasticsearch('some string'), client=client, mock=MagicMock,
+                               run=lambda result: result)
+    client = mocker.patch('wiating_backend.elastic.AsyncES', autospec=True).return_value
+    return SimpleNamespace(es=AsyncElasticsearch('some string'), client=client, mock=AsyncMock, run=asyncio.run)
+
+
 @pytest.fixture
 def datetime_mock(mocker):
     return mocker.patch('wiating_backend.elastic.datetime')
@@ -288,8 +309,8 @@ def test_newPoint():
 
 
 @pytest.fixture
-def point_from_dict():
-    body = {"_id": "7g5qqnABsqio5qhd0cbc", "_index": "wiaty_images1", "_primary_term": 1, "_seq_no": 29626, "_source":
+def point_hit():
+    return {"_id": "7g5qqnABsqio5qhd0cbc", "_index": "wiaty_images1", "_primary_term": 1, "_seq_no": 29626, "_source":
         {"created_timestamp": "1583403492", "created_by": "some id", "description": "EDIT: XII 2018: wiata spalona",
          "directions": "", "fire_comment": None, "fire_exists": None, "images":
              [{"created_timestamp": "1583403492", "name": "f660785da287e72143a5eddf77d37440.jpg",
@@ -299,7 +320,11 @@ def point_from_dict():
          "water_comment": None, "water_exists": None, "last_modified_timestamp": "1583403439",
          "report_reason": "some reason", "last_modified_by": "other id"},
             "_type": "_doc", "_version": 12, "found": True}
-    return Point.from_dict(body=body)
+
+
+@pytest.fixture
+def point_from_dict(point_hit):
+    return Point.from_dict(body=point_hit)
 
 
 def test_pointFromDict(point_from_dict):
@@ -346,6 +371,18 @@ def test_pointToDictWithoutId(point_from_dict):
                       "report_reason": "some reason"}
 
 
+@pytest.mark.parametrize('with_id,moderator', [(False, False), (True, False), (True, True)])
+def test_point_from_hit_matches_to_dict(point_hit, with_id, moderator):
+    assert point_from_hit(point_hit, with_id=with_id, moderator=moderator) == \
+        Point.from_dict(body=point_hit).to_dict(with_id=with_id, moderator=moderator)
+
+
+def test_point_from_hit_numeric_location(point_hit):
+    point_hit['_source']['location'] = {"lat": 50.5, "lon": 16}
+    del point_hit['_source']['images']
+    assert point_from_hit(point_hit) == Point.from_dict(body=point_hit).to_dict()
+
+
 def test_reportReasonAppend():
     point = Point(name='some name', description='some desc', directions='some directions',
                   lat="15", lon="20", point_type="SHED", water_exists=True, water_comment="some water comment",
@@ -366,3 +403,415 @@ def test_reportReasonReplaceNotEmpty(point_from_dict):
 def test_reportReasonReplaceEmpty(point_from_dict):
     point_from_dict.report_reason_replace(None)
     assert point_from_dict.report_reason == None
+
+
+@pytest.fixture
+def es_config():
+    config = MagicMock()
+    config.ES_CONNECTION_STRING = 'some string'
+    config.INDEX_NAME = 'some_index'
+    config.ES_MAX_CONNECTIONS = 50
+    config.ES_TIMEOUT = 5
+    config.ES_SNIFF_ON_START = False
+    config.ES_SNIFF_ON_CONNECTION_FAIL = True
+    config.ES_SNIFFER_TIMEOUT = None
+    return config
+
+
+def test_connection_is_shared(elasticsearch, es_config):
+    opened = Elasticsearch.open(config=es_config)
+    try:
+        assert Elasticsearch.connection() is opened
+        assert Elasticsearch.connection() is opened
+        elasticsearch.assert_called_once_with(['some string'], maxsize=50, timeout=5, sniff_on_start=False,
+                                              sniff_on_connection_fail=True, sniffer_timeout=None,
+                                              retry_on_timeout=True)
+        assert opened.index == 'some_index'
+    finally:
+        Elasticsearch.close()
+
+
+def test_connection_close(elasticsearch, es_config):
+    Elasticsearch.open(config=es_config)
+    Elasticsearch.close()
+
+    elasticsearch.return_value.close.assert_called_once_with()
+    assert Elasticsearch._shared is None
+
+
+def test_async_elasticsearch_get_points(async_elasticsearch):
+    es = AsyncElasticsearch('some string')
+    search_mock = AsyncMock(return_value={"hits": {"hits": []}})
+    async_elasticsearch.return_value.search = search_mock
+
+    result = asyncio.run(es.get_points(top_right=Location(lat=123, lon=321), bottom_left=Location(lat=222, lon=111),
+                                       is_moderator=True))
+
+    search_mock.assert_awaited_once_with(index='wiaty', body=Elasticsearch._get_points_body(
+        Location(lat=123, lon=321), Location(lat=222, lon=111), is_moderator=True))
+    assert result == {'points': []}
+
+
+def test_async_elasticsearch_delete_point_fail(async_elasticsearch):
+    es = AsyncElasticsearch('some string')
+    async_elasticsearch.return_value.delete = AsyncMock(return_value={"result": "not_found"})
+
+    with pytest.raises(Exception):
+        asyncio.run(es.delete_point(point_id='12345'))
+
+
+def test_elasticsearch_get_clusters(backend):
+    search_mock = backend.mock(return_value={"aggregations": {"clusters": {"buckets": [
+        {"key": "6/35/21", "doc_count": 3, "centroid": {"location": {"lat": 50.5, "lon": 16.25}, "count": 3},
+         "types": {"buckets": [{"key": "SHED", "doc_count": 2}, {"key": "CAVE", "doc_count": 1}]}}]}}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.get_clusters(top_right=Location(lat=123, lon=321),
+                                                 bottom_left=Location(lat=222, lon=111), precision=6))
+
+    body = search_mock.call_args[1]['body']
+    assert body['size'] == 0
+    assert body['query']['bool']['must_not'] == [{"term": {"unpublished": True}}]
+    assert body['aggs']['clusters']['geotile_grid'] == {"field": "location", "precision": 6, "size": 10000}
+    assert result == {'clusters': [{"key": "6/35/21", "count": 3, "location": {"lat": "50.5", "lon": "16.25"},
+                                    "types": {"SHED": 2, "CAVE": 1}}]}
+
+
+def test_cluster_precision():
+    assert cluster_precision() is None
+    assert cluster_precision(zoom=12, max_zoom=9) is None
+    assert cluster_precision(zoom=5, max_zoom=9, offset=2) == 7
+    assert cluster_precision(zoom=12, precision=4, max_zoom=9) == 4
+    assert cluster_precision(precision=40) == 29
+
+
+def test_elasticsearch_get_tile(backend):
+    search_mock = backend.mock(return_value={"hits": {"hits": [{"_id": "abc", "_source": {
+        "location": {"lat": "50.76", "lon": "16.18"}, "type": "SHED", "name": "some name", "water_exists": True,
+        "fire_exists": None}}]}})
+    backend.client.search = search_mock
+
+    tile = backend.run(backend.es.get_tile(0, 0, 0))
+
+    body = search_mock.call_args[1]['body']
+    assert body['_source'] == ["location", "type", "name", "water_exists", "fire_exists"]
+    assert body['query']['bool']['must_not'] == [{"term": {"unpublished": True}}]
+    assert body['query']['bool']['filter'][0]['geo_bounding_box']['location']['top_left']['lon'] == '-180.0'
+    assert b'points' in tile and b'abc' in tile
+
+
+def test_elasticsearch_delete_point_notifies_listeners(backend, mocker):
+    listener = MagicMock()
+    mocker.patch.object(Elasticsearch, 'listeners', [listener])
+    backend.client.get = backend.mock(return_value={"_source": {"location": {"lat": "50.1", "lon": "19.9"}}})
+    backend.client.delete = backend.mock(return_value={"result": "deleted"})
+
+    backend.run(backend.es.delete_point(point_id='12345'))
+
+    listener.assert_called_once_with(['12345'], (("50.1", "19.9"),))
+
+
+def test_elasticsearch_add_point_survives_failing_listener(backend, mocker):
+    listener = MagicMock(side_effect=ConnectionError('redis is down'))
+    mocker.patch.object(Elasticsearch, 'listeners', [listener])
+    backend.client.index = backend.mock(return_value={"result": "created", "_id": "12345"})
+    save_log = mocker.patch.object(backend.es, 'save_log', backend.mock())
+
+    result = backend.run(backend.es.add_point(name='name', description='', directions='', lat='50.1', lon='19.9',
+                                              type='SHED', user_sub='some sub'))
+
+    assert result['id'] == '12345'
+    backend.client.index.assert_called_once()
+    save_log.assert_called_once()
+    listener.assert_called_once()
+
+
+def test_elasticsearch_get_points_tile_cache(backend, mocker):
+    lookup = mocker.patch('wiating_backend.elastic.tile_cache.lookup', autospec=True)
+    store = mocker.patch('wiating_backend.elastic.tile_cache.store', autospec=True)
+    cached_point = {"id": "a", "location": {"lat": "50.5", "lon": "16.5"}}
+    lookup.return_value = ({(8, 5): [cached_point]}, [(9, 5)], {(8, 5): 3, (9, 5): 0})
+    search_mock = backend.mock(return_value={"hits": {"hits": []}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.get_points(top_right=Location(lat=51, lon=25), bottom_left=Location(lat=50, lon=16),
+                                               tile_zoom=4))
+
+    assert lookup.call_args[0][:2] == ([(8, 5), (9, 5)], 4)
+    bbox = search_mock.call_args[1]['body']['query']['bool']['filter'][0]['geo_bounding_box']['location']
+    assert bbox['top_left']['lon'] == '22.5' and bbox['bottom_right']['lon'] == '45.0'
+    store.assert_called_once_with({(9, 5): []}, {(8, 5): 3, (9, 5): 0}, 4, None, False, view=None)
+    assert result == {'points': [cached_point]}
+
+
+def test_elasticsearch_get_points_world_bbox_skips_tile_cache(backend, mocker):
+    lookup = mocker.patch('wiating_backend.elastic.tile_cache.lookup', autospec=True)
+    backend.client.search = backend.mock(return_value={"hits": {"hits": []}})
+
+    result = backend.run(backend.es.get_points(top_right=Location(lat=85, lon=180),
+                                               bottom_left=Location(lat=-85, lon=-180), tile_zoom=11, max_tiles=64))
+
+    assert result == {'points': []}
+    lookup.assert_not_called()
+    backend.client.search.assert_called_once()
+
+
+def test_elasticsearch_get_points_marker_view(backend):
+    search_mock = backend.mock(return_value={"hits": {"hits": [{"_id": "abc", "_source": {
+        "location": {"lat": "50.76", "lon": "16.18"}, "type": "SHED", "name": "some name", "water_exists": True,
+        "fire_exists": None, "unpublished": True}}]}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.get_points(top_right=Location(lat=123, lon=321),
+                                               bottom_left=Location(lat=222, lon=111), is_moderator=True,
+                                               view='marker'))
+
+    assert search_mock.call_args[1]['body']['_source'] == ["name", "location", "type", "water_exists", "fire_exists",
+                                                           "is_disabled", "unpublished"]
+    assert result == {'points': [{"id": "abc", "name": "some name", "location": {"lat": "50.76", "lon": "16.18"},
+                                  "type": "SHED", "water_exists": True, "fire_exists": None, "is_disabled": False,
+                                  "unpublished": True}]}
+
+
+def test_elasticsearch_search_points_marker_view(backend):
+    search_mock = backend.mock(return_value={"hits": {"hits": []}})
+    backend.client.search = search_mock
+
+    backend.run(backend.es.search_points(water=True, view='marker'))
+
+    search_mock.assert_called_with(index='wiaty',
+                                   body={'query': {
+                                       'bool': {"must_not": [{"term": {"unpublished": True}}],
+                                                'filter': [{"term": {"water_exists": True}}]}},
+                                         '_source': ["name", "location", "type", "water_exists", "fire_exists",
+                                                     "is_disabled", "unpublished"]})
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor('some pit', [12, 'abc'])) == ('some pit', [12, 'abc'])
+
+
+@pytest.mark.parametrize('cursor', ['not base64 at all!', encode_cursor('pit', [1])[:-4], 'e30='])
+def test_decode_cursor_malformed(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _hit(doc_id, sort):
+    return {"_id": doc_id, "sort": sort, "_source": {
+        "name": "name", "description": "", "directions": "", "location": {"lat": "50.1", "lon": "19.9"},
+        "type": "SHED", "water_exists": None, "water_comment": None, "fire_exists": None, "fire_comment": None,
+        "created_timestamp": "1583403492", "last_modified_timestamp": "1583403492"}}
+
+
+def test_elasticsearch_get_points_first_page(backend):
+    backend.client.open_point_in_time = backend.mock(return_value={"id": "pit 1"})
+    backend.client.close_point_in_time = backend.mock()
+    search_mock = backend.mock(return_value={"pit_id": "pit 2", "hits": {"hits": [_hit("a", [1]), _hit("b", [2])]}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.get_points(top_right=Location(lat=51, lon=20), bottom_left=Location(lat=50, lon=19),
+                                               page_size=2, keep_alive='30s'))
+
+    backend.client.open_point_in_time.assert_called_once_with(index='wiaty', keep_alive='30s')
+    body = search_mock.call_args[1]['body']
+    assert 'index' not in search_mock.call_args[1]
+    assert body['size'] == 2 and body['pit'] == {"id": "pit 1", "keep_alive": "30s"}
+    assert body['sort'] == [{"_shard_doc": "asc"}] and 'search_after' not in body
+    assert [point['id'] for point in result['points']] == ['a', 'b']
+    assert decode_cursor(result['cursor']) == ('pit 2', [2])
+    backend.client.close_point_in_time.assert_not_called()
+
+
+def test_elasticsearch_search_points_last_page(backend):
+    backend.client.open_point_in_time = backend.mock()
+    backend.client.close_point_in_time = backend.mock()
+    search_mock = backend.mock(return_value={"pit_id": "pit 3", "hits": {"hits": [_hit("c", [3])]}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.search_points(water=True, page_size=2, cursor=encode_cursor('pit 2', [2])))
+
+    backend.client.open_point_in_time.assert_not_called()
+    body = search_mock.call_args[1]['body']
+    assert body['search_after'] == [2] and body['pit']['id'] == 'pit 2'
+    assert body['query']['bool']['filter'] == [{"term": {"water_exists": True}}]
+    assert result['cursor'] is None
+    backend.client.close_point_in_time.assert_called_once_with(body={"id": "pit 3"})
+
+
+def test_elasticsearch_search_points_paged_phrase_by_relevance(backend):
+    backend.client.open_point_in_time = backend.mock(return_value={"id": "pit 1"})
+    search_mock = backend.mock(return_value={"pit_id": "pit 2", "hits": {"hits": [
+        _hit("best", [9.5, 40]), _hit("good", [7.25, 3]), _hit("weak", [1.0, 12])]}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.search_points(phrase='schronisko', page_size=3))
+
+    body = search_mock.call_args[1]['body']
+    assert body['sort'] == [{"_score": "desc"}, {"_shard_doc": "asc"}]
+    assert [point['id'] for point in result['points']] == ['best', 'good', 'weak']
+    assert decode_cursor(result['cursor']) == ('pit 2', [1.0, 12])
+
+
+def test_elasticsearch_get_logs_cursor(backend):
+    backend.client.open_point_in_time = backend.mock(return_value={"id": "pit 1"})
+    search_mock = backend.mock(return_value={"pit_id": "pit 2", "hits": {"total": {"value": 30}, "hits": [
+        {"_id": "log 1", "sort": ["2021/05/01 10:00:00", 7], "_source": {}}]}})
+    backend.client.search = search_mock
+
+    result = backend.run(backend.es.get_logs(size=1, offset=50, reviewed_at=False, cursor=''))
+
+    backend.client.open_point_in_time.assert_called_once_with(index='wiaty_*', keep_alive='1m')
+    body = search_mock.call_args[1]['body']
+    assert 'from' not in body and body['size'] == 1
+    assert body['sort'] == [{"timestamp": {"order": "desc"}}, {"_shard_doc": "asc"}]
+    assert result['total'] == 30 and [log['_id'] for log in result['logs']] == ['log 1']
+    assert decode_cursor(result['cursor']) == ('pit 2', ["2021/05/01 10:00:00", 7])
+
+
+def test_log_index():
+    assert log_index('wiaty', '05_2021-' + 'a' * 32) == 'wiaty_05_2021'
+    assert log_index('wiaty', 'AXlq3kQ1sE5mTa0Yx2cd') is None
+
+
+def test_elasticsearch_save_log_id_encodes_index(backend):
+    index_mock = backend.mock()
+    backend.client.index = index_mock
+
+    backend.run(backend.es.save_log(user_sub='some sub', doc_id='12345', name='some name',
+                                    changed={"action": "created"}))
+
+    kwargs = index_mock.call_args[1]
+    assert log_index('wiaty', kwargs['id']) == kwargs['index']
+    assert kwargs['index'] == datetime.datetime.today().strftime('wiaty_%m_%Y')
+
+
+def test_elasticsearch_get_log_direct(backend):
+    get_mock = backend.mock(return_value={"_source": {"some": "source"}})
+    backend.client.get = get_mock
+    search_mock = backend.mock()
+    backend.client.search = search_mock
+    log_id = '05_2021-' + 'b' * 32
+
+    assert backend.run(backend.es.get_log(log_id)) == {"some": "source"}
+
+    get_mock.assert_called_once_with(index='wiaty_05_2021', id=log_id)
+    search_mock.assert_not_called()
+
+
+def test_elasticsearch_log_reviewed_direct(backend, datetime_mock):
+    search_mock = backend.mock()
+    backend.client.search = search_mock
+    update_mock = backend.mock(return_value={"result": "updated", "get": {"_source": {"some": "source"}}})
+    backend.client.update = update_mock
+    datetime_mock.utcnow.return_value = datetime.datetime(2018, 6, 12, 14, 50, 00)
+    log_id = '05_2021-' + 'c' * 32
+
+    assert backend.run(backend.es.log_reviewed(log_id=log_id, user='54321')) == {"some": "source"}
+
+    search_mock.assert_not_called()
+    assert update_mock.call_args[1]['index'] == 'wiaty_05_2021'
+
+
+def test_elasticsearch_report_regular_scripted(backend):
+    update_mock = backend.mock(return_value={"result": "updated", "get": {"_source": {"location": {
+        "lat": "50.1", "lon": "19.9"}}}})
+    backend.client.update = update_mock
+    backend.client.get = backend.mock()
+    backend.client.index = backend.mock()
+
+    assert backend.run(backend.es.report_regular('12345', 'some reason')) is True
+
+    kwargs = update_mock.call_args[1]
+    assert kwargs['id'] == '12345' and kwargs['retry_on_conflict'] == 3
+    assert kwargs['body']['script']['params'] == {"reason": "some reason"}
+    assert '.add(params.reason)' in kwargs['body']['script']['source']
+    backend.client.get.assert_not_called()
+    backend.client.index.assert_not_called()
+
+
+def test_elasticsearch_report_moderator_unchanged(backend):
+    backend.client.update = backend.mock(return_value={"result": "noop", "get": {"_source": {
+        "location": {"lat": "50.1", "lon": "19.9"}}}})
+
+    assert backend.run(backend.es.report_moderator('12345', None)) is True
+
+
+def test_elasticsearch_add_image_scripted(backend, point_hit, mocker):
+    update_mock = backend.mock(return_value={"result": "updated", "get": {"_source": point_hit['_source']}})
+    backend.client.update = update_mock
+    backend.client.get = backend.mock()
+    save_log = mocker.patch.object(backend.es, 'save_log', backend.mock())
+
+    result = backend.run(backend.es.add_image('12345', 'image.jpg', 'some sub'))
+
+    assert result == point_from_hit(dict(point_hit, _id='12345'), with_id=True)
+    backend.client.get.assert_not_called()
+    image = update_mock.call_args[1]['body']['script']['params']['image']
+    assert image['name'] == 'image.jpg' and image['created_by'] == 'some sub'
+    save_log.assert_called_once_with(user_sub='some sub', doc_id='12345',
+                                     name='Góry Wałbrzyskie, masyw Chełmca',
+                                     changed={"images": {"old_value": None, "new_value": 'image.jpg'}})
+
+
+def test_elasticsearch_add_image_already_attached(backend, point_hit, mocker):
+    backend.client.update = backend.mock(return_value={"result": "noop", "get": {"_source": point_hit['_source']}})
+    save_log = mocker.patch.object(backend.es, 'save_log', backend.mock())
+
+    result = backend.run(backend.es.add_image('12345', 'image.jpg', 'some sub'))
+
+    assert result == point_from_hit(dict(point_hit, _id='12345'), with_id=True)
+    save_log.assert_not_called()
+
+
+def _modify_name(es, **kwargs):
+    return es.modify_point(point_id='7g5qqnABsqio5qhd0cbc', user_sub='sub', name='new name', description=NotDefined(),
+                           directions=NotDefined(), lat=NotDefined(), lon=NotDefined(), point_type=NotDefined(),
+                           water_exists=NotDefined(), fire_exists=NotDefined(), water_comment=NotDefined(),
+                           fire_comment=NotDefined(), is_disabled=NotDefined(), unpublished=NotDefined(), **kwargs)
+
+
+def test_elasticsearch_modify_point_retries_conflict(backend, point_hit, mocker):
+    point_hit['_seq_no'], point_hit['_primary_term'] = 5, 1
+    backend.client.get = backend.mock(return_value=point_hit)
+    index_mock = backend.mock(side_effect=[ConflictError(409, 'version_conflict_engine_exception', {}),
+                                           {"result": "updated", "_seq_no": 6, "_primary_term": 1}])
+    backend.client.index = index_mock
+    mocker.patch.object(backend.es, 'save_log', backend.mock())
+
+    result = backend.run(_modify_name(backend.es, is_moderator=True))
+
+    assert backend.client.get.call_count == 2
+    assert index_mock.call_args[1]['if_seq_no'] == 5 and index_mock.call_args[1]['if_primary_term'] == 1
+    assert index_mock.call_args[1]['body']['name'] == 'new name'
+    assert result['name'] == 'new name' and result['id'] == '7g5qqnABsqio5qhd0cbc' and result['unpublished'] is None
+
+
+def test_elasticsearch_modify_point_checks_seq_no(backend, point_hit, mocker):
+    backend.client.get = backend.mock(return_value=point_hit)
+    res = {"result": "updated", "_seq_no": point_hit['_seq_no'], "_primary_term": 1}
+    backend.client.index = backend.mock(return_value=res)
+    save_log = mocker.patch.object(backend.es, 'save_log', backend.mock())
+
+    result = backend.run(_modify_name(backend.es))
+
+    assert result == res
+    save_log.assert_not_called()
+
+
+def test_elasticsearch_get_points_by_ids(backend, point_hit):
+    mget_mock = backend.mock(return_value={"docs": [dict(point_hit, found=True),
+                                                    {"_index": "wiaty", "_id": "gone", "found": False}]})
+    backend.client.mget = mget_mock
+
+    result = backend.run(backend.es.get_points_by_ids(['7g5qqnABsqio5qhd0cbc', 'gone'], is_moderator=True))
+
+    mget_mock.assert_called_once_with(index='wiaty', body={"ids": ['7g5qqnABsqio5qhd0cbc', 'gone']})
+    assert result == {"points": [point_from_hit(point_hit, with_id=True, moderator=True)], "missing": ['gone']}
+
+
+def test_elasticsearch_get_points_by_ids_empty(backend):
+    backend.client.mget = backend.mock()
+
+    assert backend.run(backend.es.get_points_by_ids([])) == {"points": [], "missing": []}
+    backend.client.mget.assert_not_called()
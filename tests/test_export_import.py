@@ -0,0 +1,239 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from elasticsearch.serializer import JSONSerializer
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wiating_backend import points
+from wiating_backend.auth import require_moderator
+from wiating_backend.elastic import AsyncElasticsearch, Elasticsearch
+
+
+class FakeElasticsearch:
+    """In-memory stand-in for the few APIs export and import use
+    """
+    def __init__(self, docs=None, reject=(), throttle=()):
+        self.docs = dict(docs or {})
+        self.reject = set(reject)
+        # ids answered with 429 the first time they are sent
+        self.throttle = set(throttle)
+        self.open_pits = set()
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def open_point_in_time(self, index, keep_alive):
+        pit_id = 'pit %d' % len(self.open_pits)
+        self.open_pits.add(pit_id)
+        return {"id": pit_id}
+
+    def close_point_in_time(self, body):
+        self.open_pits.remove(body['id'])
+        return {"succeeded": True}
+
+    def search(self, body, **kwargs):
+        assert body['pit']['id'] in self.open_pits and 'index' not in kwargs
+        start = body.get('search_after', [-1])[0] + 1
+        hits = [{"_id": doc_id, "_source": source, "sort": [position]}
+                for position, (doc_id, source) in enumerate(self.docs.items())][start:start + body['size']]
+        return {"pit_id": body['pit']['id'], "hits": {"hits": hits}}
+
+    def bulk(self, body, **kwargs):
+        lines = body.strip().split('\n')
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            meta = json.loads(action)['index']
+            doc_id = meta.get('_id', 'generated %d' % len(self.docs))
+            if doc_id in self.throttle:
+                self.throttle.remove(doc_id)
+                items.append({"index": {"_id": doc_id, "status": 429, "error": {"type": "es_rejected_execution"}}})
+            elif doc_id in self.reject:
+                items.append({"index": {"_id": doc_id, "status": 400, "error": {"type": "mapper_parsing_exception"}}})
+            else:
+                self.docs[doc_id] = json.loads(source)
+                items.append({"index": {"_id": doc_id, "status": 201, "result": "created"}})
+        return {"errors": any('error' in item['index'] for item in items), "items": items}
+
+    def mget(self, index, body, _source_includes=None):
+        return {"docs": [{"_id": doc_id, "found": True, "_source": self.docs[doc_id]} if doc_id in self.docs
+                         else {"_id": doc_id, "found": False} for doc_id in body['ids']]}
+
+
+class AsyncFakeElasticsearch(FakeElasticsearch):
+    async def open_point_in_time(self, index, keep_alive):
+        return FakeElasticsearch.open_point_in_time(self, index, keep_alive)
+
+    async def close_point_in_time(self, body):
+        return FakeElasticsearch.close_point_in_time(self, body)
+
+    async def search(self, body, **kwargs):
+        return FakeElasticsearch.search(self, body, **kwargs)
+
+    async def bulk(self, body, **kwargs):
+        return FakeElasticsearch.bulk(self, body, **kwargs)
+
+    async def mget(self, index, body, _source_includes=None):
+        return FakeElasticsearch.mget(self, index, body, _source_includes=_source_includes)
+
+
+def make_point(name, **fields):
+    point = {"name": name, "description": "", "directions": "", "location": {"lat": "50.1", "lon": "19.9"},
+             "type": "SHED", "water_exists": None, "water_comment": None, "fire_exists": None, "fire_comment": None,
+             "is_disabled": False, "report_reason": None, "created_timestamp": "1583403492",
+             "last_modified_timestamp": "1583403492", "created_by": "some id", "last_modified_by": "some id",
+             "unpublished": None}
+    point.update(fields)
+    return point
+
+
+@pytest.fixture
+def fake_es(mocker):
+    fake = FakeElasticsearch({"a": make_point("a"), "b": make_point("b", unpublished=True), "c": make_point("c")})
+    mocker.patch('wiating_backend.elastic.ES', return_value=fake)
+    return fake
+
+
+def test_export_points(fake_es):
+    es = Elasticsearch('some string')
+
+    lines = list(es.export_points(page_size=2))
+
+    assert [json.loads(line)['id'] for line in lines] == ['a', 'b', 'c']
+    assert json.loads(lines[1]) == dict(make_point("b", unpublished=True), id='b')
+    assert all(line.endswith(b'\n') for line in lines)
+    assert fake_es.open_pits == set()
+
+
+def test_export_import_round_trip(fake_es, mocker):
+    lines = list(Elasticsearch('some string').export_points())
+    target = FakeElasticsearch()
+    mocker.patch('wiating_backend.elastic.ES', return_value=target)
+
+    reports = list(Elasticsearch('some string').import_points(lines))
+
+    assert reports == [{"indexed": 3, "errors": []}]
+    assert target.docs == fake_es.docs
+
+
+def test_import_points_reports_errors_per_chunk(mocker):
+    target = FakeElasticsearch(reject={'bad'})
+    mocker.patch('wiating_backend.elastic.ES', return_value=target)
+    lines = [json.dumps(make_point("x")), 'not json', '', json.dumps(dict(make_point("y"), id='bad')),
+             json.dumps({"name": "missing fields"}), json.dumps(dict(make_point("z"), id='z'))]
+
+    reports = list(Elasticsearch('some string').import_points(lines, chunk_size=2))
+
+    assert sum(report['indexed'] for report in reports) == 2
+    errors = [error for report in reports for error in report['errors']]
+    assert sorted(error['line'] for error in errors) == [2, 4, 5]
+    assert target.docs['z']['name'] == 'z'
+    assert len(reports) > 1
+
+
+def test_import_points_notifies_listeners_per_chunk(mocker):
+    mocker.patch('wiating_backend.elastic.ES', return_value=FakeElasticsearch())
+    listener = MagicMock()
+    mocker.patch.object(Elasticsearch, 'listeners', [listener])
+    lines = [json.dumps(dict(make_point(name), id=name)) for name in 'abc']
+
+    list(Elasticsearch('some string').import_points(lines, chunk_size=2))
+
+    assert [call.args[0] for call in listener.call_args_list] == [['a', 'b'], ['c']]
+    assert len(listener.call_args_list[0].args[1]) == 2
+
+
+def test_import_points_matches_retried_results(mocker):
+    mocker.patch('elasticsearch.helpers.actions.time.sleep')
+    target = FakeElasticsearch(reject={'b'}, throttle={'a'})
+    mocker.patch('wiating_backend.elastic.ES', return_value=target)
+    listener = MagicMock()
+    mocker.patch.object(Elasticsearch, 'listeners', [listener])
+    a = dict(make_point("a"), id='a')
+    b = dict(make_point("b"), id='b', location={"lat": "49.1", "lon": "20.9"})
+
+    reports = list(Elasticsearch('some string').import_points([json.dumps(a), json.dumps(b)]))
+
+    assert [error['line'] for report in reports for error in report['errors']] == [2]
+    assert 'a' in target.docs
+    listener.assert_called_once_with(['a'], (("50.1", "19.9"),))
+
+
+def test_import_points_notifies_old_locations(mocker):
+    old = dict(make_point("a"), location={"lat": "49.1", "lon": "20.9"})
+    mocker.patch('wiating_backend.elastic.ES', return_value=FakeElasticsearch(docs={'a': old}))
+    listener = MagicMock()
+    mocker.patch.object(Elasticsearch, 'listeners', [listener])
+
+    list(Elasticsearch('some string').import_points([json.dumps(dict(make_point("a"), id='a'))]))
+
+    listener.assert_called_once_with(['a'], (("49.1", "20.9"), ("50.1", "19.9")))
+
+
+def test_async_import_points(mocker):
+    target = AsyncFakeElasticsearch()
+    mocker.patch('wiating_backend.elastic.AsyncES', return_value=target)
+    es = AsyncElasticsearch('some string')
+
+    async def lines():
+        yield json.dumps(dict(make_point("x"), id='x')).encode()
+        yield b'{'
+
+    async def run():
+        return [report async for report in es.import_points(lines())]
+
+    reports = asyncio.run(run())
+
+    assert reports == [{"indexed": 1, "errors": [{"line": 2, "error": reports[0]['errors'][0]['error']}]}]
+    assert target.docs['x']['name'] == 'x'
+
+
+def test_async_export_points(mocker):
+    source = AsyncFakeElasticsearch({"a": make_point("a"), "b": make_point("b")})
+    mocker.patch('wiating_backend.elastic.AsyncES', return_value=source)
+    es = AsyncElasticsearch('some string')
+
+    async def run():
+        return [line async for line in es.export_points(page_size=1)]
+
+    lines = asyncio.run(run())
+
+    assert [json.loads(line)['id'] for line in lines] == ['a', 'b']
+    assert source.open_pits == set()
+
+
+def test_import_route_caps_errors(mocker):
+    mocker.patch('wiating_backend.elastic.AsyncES', return_value=AsyncFakeElasticsearch())
+    mocker.patch.object(points, 'IMPORT_MAX_ERRORS', 3)
+    app = FastAPI()
+    app.include_router(points.points)
+    app.dependency_overrides[require_moderator] = lambda: {"sub": "some sub", "is_moderator": True}
+    app.dependency_overrides[AsyncElasticsearch.connection] = lambda: AsyncElasticsearch('some string')
+    body = '\n'.join(['{'] * 5 + [json.dumps(dict(make_point("x"), id='x'))])
+
+    response = TestClient(app).post('/import/points', data=body)
+
+    result = response.json()
+    assert response.status_code == 200
+    assert (result['indexed'], result['failed'], result['chunks']) == (1, 5, 1)
+    assert [error['line'] for error in result['errors']] == [1, 2, 3]
+    assert result['errors_truncated']
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/get_points', {"top_right": {"lat": 51, "lon": 20}, "bottom_left": {"lat": 50, "lon": 19}}),
+    ('/search_points', {"water": True}),
+])
+def test_point_routes_check_view(mocker, path, body):
+    es = MagicMock()
+    es.get_points = es.search_points = mocker.AsyncMock(return_value={"points": []})
+    app = FastAPI()
+    app.include_router(points.points)
+    app.dependency_overrides[AsyncElasticsearch.connection] = lambda: es
+    client = TestClient(app)
+
+    assert client.post(path, json=dict(body, view='markers')).status_code == 422
+    es.get_points.assert_not_called()
+    assert client.post(path, json=dict(body, view='marker')).status_code == 200
+    assert es.get_points.call_args[1]['view'] == 'marker'
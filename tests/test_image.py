@@ -0,0 +1,162 @@
+import hashlib
+from unittest.mock import AsyncMock
+
+import pytest
+from elasticsearch import NotFoundError
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wiating_backend import image, storage
+from wiating_backend.auth import require_auth
+from wiating_backend.elastic import AsyncElasticsearch
+from tests.test_storage import FakeS3
+
+
+@pytest.fixture
+def s3(mocker):
+    fake = FakeS3()
+    mocker.patch('wiating_backend.storage._s3', fake)
+    mocker.patch.object(storage.config, 'STORE_PROPERTY', 's3://bucket')
+    mocker.patch.object(image.config, 'STORE_PROPERTY', 's3://bucket')
+    return fake
+
+
+@pytest.fixture
+def es():
+    es = AsyncMock()
+    es.add_image.return_value = {"id": "point", "images": []}
+    return es
+
+
+@pytest.fixture
+def image_client(es, mocker):
+    app = FastAPI()
+    app.include_router(image.images)
+    app.dependency_overrides[require_auth] = lambda: {"sub": "some sub", "is_moderator": False}
+    app.dependency_overrides[AsyncElasticsearch.connection] = lambda: es
+    redis = mocker.patch('wiating_backend.storage.redis_client', autospec=True).return_value
+    redis.sadd.return_value = 1
+    redis.sismember.return_value = 0
+    mocker.patch('wiating_backend.image.resize.submit', autospec=True, return_value='pending')
+    return TestClient(app)
+
+
+def test_add_image(image_client, s3, es):
+    response = image_client.post('/add_image/point', files={"file": ('IMG.JPG', b'x' * 10, 'image/jpeg')})
+
+    name = hashlib.sha256(b'x' * 10).hexdigest() + '.jpg'
+    assert response.status_code == 200
+    assert sorted(key for _, key in s3.objects) == ['point/', 'point/' + name]
+    es.add_image.assert_awaited_once_with('point', name, 'some sub')
+    image.resize.submit.assert_called_once_with('point/' + name)
+
+
+def test_add_image_stored_already(image_client, s3, es, mocker):
+    storage.redis_client.return_value.sismember.return_value = 1
+    mocker.patch('wiating_backend.image.resize.status', autospec=True, return_value='done')
+
+    response = image_client.post('/add_image/point', files={"file": ('IMG.JPG', b'x' * 10, 'image/jpeg')})
+
+    assert response.status_code == 200
+    assert response.headers['x-resize-status'] == 'done'
+    assert s3.objects == {}
+    image.resize.submit.assert_not_called()
+
+
+def test_add_image_too_large(image_client, s3, es, mocker):
+    mocker.patch.object(image.config, 'MAX_CONTENT_LENGTH', 5)
+
+    response = image_client.post('/add_image/point', files={"file": ('IMG.JPG', b'x' * 10, 'image/jpeg')})
+
+    assert response.status_code == 413
+    assert s3.objects == {}
+
+
+def test_add_image_claims_after_storing(image_client, s3, es, mocker):
+    stored_when_claimed = []
+
+    def sadd(key, name):
+        stored_when_claimed.append(('bucket', 'point/' + name) in s3.objects)
+        # a concurrent upload of the same bytes claimed the name between our check and our claim
+        return 0
+
+    storage.redis_client.return_value.sadd.side_effect = sadd
+    mocker.patch('wiating_backend.image.resize.status', autospec=True, return_value='pending')
+
+    response = image_client.post('/add_image/point', files={"file": ('IMG.JPG', b'x' * 10, 'image/jpeg')})
+
+    assert response.status_code == 200
+    name = hashlib.sha256(b'x' * 10).hexdigest() + '.jpg'
+    assert stored_when_claimed == [True]
+    image.resize.submit.assert_not_called()
+    es.add_image.assert_awaited_once_with('point', name, 'some sub')
+
+
+def test_add_image_failed_store_claims_nothing(image_client, s3, es, mocker):
+    mocker.patch.object(s3, 'upload_fileobj', side_effect=RuntimeError('S3 is down'))
+
+    with pytest.raises(RuntimeError):
+        image_client.post('/add_image/point', files={"file": ('IMG.JPG', b'x' * 10, 'image/jpeg')})
+
+    storage.redis_client.return_value.sadd.assert_not_called()
+    assert [key for _, key in s3.objects] == ['point/']
+    es.add_image.assert_not_awaited()
+
+
+def test_upload_url(image_client, s3):
+    response = image_client.post('/images/upload_url/point', json={"filename": "IMG_0001.JPG"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert image.UPLOAD_NAME.match(body['image_name']) and body['image_name'].endswith('.jpg')
+    assert body['fields']['key'] == 'point/' + body['image_name']
+    assert body['fields']['Content-Type'] == 'image/jpeg'
+
+
+def test_upload_url_unknown_point(image_client, s3, es):
+    es.get_point.side_effect = NotFoundError(404, 'not_found', {})
+
+    response = image_client.post('/images/upload_url/point', json={"filename": "a.jpg"})
+
+    assert response.status_code == 404
+    es.get_point.assert_awaited_once_with('point')
+
+
+def test_upload_url_rejects_other_files(image_client, s3):
+    assert image_client.post('/images/upload_url/point', json={"filename": "notes.txt"}).status_code == 400
+
+
+def test_upload_url_needs_s3(image_client, mocker):
+    mocker.patch.object(image.config, 'STORE_PROPERTY', 'file:///images')
+
+    assert image_client.post('/images/upload_url/point', json={"filename": "a.jpg"}).status_code == 400
+
+
+def test_complete_upload(image_client, s3, es):
+    name = image_client.post('/images/upload_url/point', json={"filename": "a.jpg"}).json()['image_name']
+    s3.put_object(Bucket='bucket', Key='point/' + name, Body=b'x' * 10, ContentType='image/jpeg')
+
+    response = image_client.post('/images/complete_upload/point/' + name)
+
+    assert response.status_code == 200
+    assert response.headers['x-resize-status'] == 'pending'
+    es.add_image.assert_awaited_once_with('point', name, 'some sub')
+    image.resize.submit.assert_called_once_with('point/' + name)
+
+
+def test_complete_upload_missing(image_client, s3, es):
+    response = image_client.post('/images/complete_upload/point/' + '0' * 32 + '.jpg')
+
+    assert response.status_code == 404
+    es.add_image.assert_not_awaited()
+
+
+@pytest.mark.parametrize('name, content_type', [('0' * 32 + '.jpg', 'text/html'), ('../other.jpg', 'image/jpeg'),
+                                                ('0' * 32 + '.exe', 'image/jpeg')])
+def test_complete_upload_rejects_mismatches(image_client, s3, es, name, content_type):
+    s3.put_object(Bucket='bucket', Key='point/' + name, Body=b'x', ContentType=content_type)
+
+    response = image_client.post('/images/complete_upload/point/' + name)
+
+    assert response.status_code in (400, 404)
+    es.add_image.assert_not_awaited()
@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from wiating_backend import log_sink
+from wiating_backend.elastic import Elasticsearch
+from wiating_backend.log_sink import LogSink
+
+
+@pytest.fixture
+def bulk(mocker):
+    return mocker.patch('wiating_backend.log_sink.helpers.bulk', autospec=True, return_value=(0, []))
+
+
+def test_log_sink_flushes_on_stop(bulk):
+    es = MagicMock()
+    sink = LogSink(es, flush_interval=60)
+    sink.start()
+    sink.put('wiaty_05_2021', 'id 1', {"some": "log"})
+    sink.put('wiaty_05_2021', 'id 2', {"other": "log"})
+    sink.stop()
+
+    bulk.assert_called_once_with(es, [{"_index": "wiaty_05_2021", "_id": "id 1", "_source": {"some": "log"}},
+                                      {"_index": "wiaty_05_2021", "_id": "id 2", "_source": {"other": "log"}}],
+                                 raise_on_error=False)
+
+
+def test_log_sink_flushes_by_size(bulk):
+    sink = LogSink(MagicMock(), flush_size=2, flush_interval=60)
+    for i in range(5):
+        sink.put('index', str(i), {})
+    sink.start()
+    sink.stop()
+
+    assert [len(call[0][1]) for call in bulk.call_args_list] == [2, 2, 1]
+
+
+def test_log_sink_retries_transient_errors(bulk):
+    bulk.side_effect = [(1, [{"index": {"_id": "1", "status": 429}}, {"index": {"_id": "2", "status": 400}}]),
+                        (1, [])]
+    sink = LogSink(MagicMock(), flush_interval=0.01)
+    sink.put('index', '0', {})
+    sink.put('index', '1', {})
+    sink.put('index', '2', {})
+    sink.start()
+    sink.stop()
+
+    assert [action['_id'] for action in bulk.call_args_list[1][0][1]] == ['1']
+
+
+def test_log_sink_keeps_transient_failures(bulk):
+    bulk.side_effect = ConnectionError('down')
+    sink = LogSink(MagicMock())
+
+    entries = [{"_index": "index", "_id": "0", "_source": {}}]
+    for _ in range(10):
+        entries = sink.flush(entries)
+
+    assert [action['_id'] for action in entries] == ['0']
+
+
+def test_log_sink_backs_off_until_written(bulk, mocker):
+    bulk.side_effect = [ConnectionError('down'), ConnectionError('down'), ConnectionError('down'), (1, [])]
+    delays = []
+    sink = LogSink(MagicMock(), flush_interval=0.01, max_backoff=0.03)
+    take = sink._take
+    mocker.patch.object(sink, '_take', side_effect=lambda: delays.append(sink._delay) or take())
+    sink.put('index', '0', {})
+    sink.start()
+    sink.stop()
+
+    assert delays == [0, 0.01, 0.02, 0.03]
+    assert bulk.call_count == 4 and sink._delay == 0
+
+
+def test_log_sink_drops_oldest_when_full(bulk, mocker):
+    error = mocker.patch('wiating_backend.log_sink.logger.error')
+    sink = LogSink(MagicMock(), max_queued=2)
+    for i in range(3):
+        sink.put('index', str(i), {})
+
+    assert [action['_id'] for action in sink._entries] == ['1', '2']
+    error.assert_called_once_with('log queue full, dropping log entry %s of %s', '0', 'index')
+
+
+def test_save_log_uses_running_sink(mocker, bulk):
+    elasticsearch = mocker.patch('wiating_backend.elastic.ES', autospec=True)
+    es = Elasticsearch('some string')
+    log_sink.start(es.es, flush_interval=60)
+    try:
+        es.save_log(user_sub='some sub', doc_id='12345', name='some name', changed={"action": "created"})
+    finally:
+        log_sink.stop()
+
+    elasticsearch.return_value.index.assert_not_called()
+    assert bulk.call_args[0][1][0]['_source']['doc_id'] == '12345'
@@ -0,0 +1,71 @@
+import pytest
+
+from wiating_backend.mvt import encode_layer, tile_bounds, tile_pixel
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_message(data):
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field, value))
+    return fields
+
+
+def read_packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def test_tile_bounds_world():
+    west, south, east, north = tile_bounds(0, 0, 0)
+    assert (west, east) == (-180.0, 180.0)
+    assert north == pytest.approx(85.0511287798)
+    assert south == pytest.approx(-85.0511287798)
+
+
+def test_tile_pixel_center():
+    assert tile_pixel(0, 0, 0, 0, 0) == (2048, 2048)
+    assert tile_pixel(0, 0, 1, 1, 1) == (0, 0)
+
+
+def test_encode_layer():
+    tile = encode_layer('points', [("0", "0", {"id": "abc", "type": "SHED", "water_exists": True,
+                                               "fire_exists": None})], 0, 0, 0)
+
+    (field, layer), = read_message(tile)
+    assert field == 3
+    layer = read_message(layer)
+    assert (15, 2) in layer
+    assert (1, b'points') in layer
+    assert (5, 4096) in layer
+    keys = [value for field, value in layer if field == 3]
+    assert keys == [b'id', b'type', b'water_exists']
+    values = [read_message(value)[0] for field, value in layer if field == 4]
+    assert values == [(1, b'abc'), (1, b'SHED'), (7, 1)]
+    feature, = [read_message(value) for field, value in layer if field == 2]
+    assert read_packed(dict(feature)[2]) == [0, 0, 1, 1, 2, 2]
+    assert dict(feature)[3] == 1
+    assert read_packed(dict(feature)[4]) == [9, 4096, 4096]
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+
+from wiating_backend import resize
+
+
+@pytest.fixture
+def redis(mocker):
+    return mocker.patch('wiating_backend.resize.redis_client', autospec=True).return_value
+
+
+@pytest.fixture
+def image_store(tmpdir):
+    tmpdir.mkdir('point')
+    Image.new('RGB', (1600, 1200), 'green').save(str(tmpdir.join('point', 'abc.jpg')), format='JPEG')
+    return 'file://' + str(tmpdir)
+
+
+def test_variant_name():
+    assert resize.variant_name('point/abc.jpg', 'm') == 'point/abc_m.jpg'
+
+
+def test_resize_file(image_store, tmpdir):
+    resize.resize_file(image_store, 'point/abc.jpg', {'m': 800, 's': 100})
+
+    with Image.open(str(tmpdir.join('point', 'abc_m.jpg'))) as medium:
+        assert medium.size == (800, 600) and medium.format == 'JPEG'
+    with Image.open(str(tmpdir.join('point', 'abc_s.jpg'))) as small:
+        assert small.size == (100, 75)
+
+
+def test_local_resizer(image_store, tmpdir, redis):
+    resizer = resize.LocalResizer(image_store, {'m': 800}, workers=1)
+    done = threading.Event()
+    redis.set.side_effect = lambda key, value, ex: value == resize.DONE and done.set()
+
+    try:
+        assert resizer.submit('point/abc.jpg') == resize.PENDING
+        assert done.wait(60)
+    finally:
+        resizer.stop()
+
+    assert tmpdir.join('point', 'abc_m.jpg').check()
+    assert [call[0][1] for call in redis.set.call_args_list] == [resize.PENDING, resize.DONE]
+    redis.set.assert_called_with('images:resize:point/abc.jpg', resize.DONE, ex=resize.STATUS_TTL)
+
+
+def test_local_resizer_back_pressure(redis, mocker):
+    resizer = resize.LocalResizer('file:///images', {'m': 800}, workers=1, queue_size=1, submit_timeout=0)
+    pending = Future()
+    mocker.patch.object(resizer.executor, 'submit', return_value=pending)
+
+    try:
+        resizer.submit('point/a.jpg')
+        with pytest.raises(resize.ResizerBusy):
+            resizer.submit('point/b.jpg')
+        pending.set_exception(OSError('cannot identify image file'))
+        assert resizer.submit('point/b.jpg') == resize.PENDING
+    finally:
+        resizer.stop()
+
+    redis.set.assert_any_call('images:resize:point/a.jpg', resize.FAILED, ex=resize.STATUS_TTL)
+
+
+def test_status(redis):
+    redis.get.side_effect = [b'done', None]
+
+    assert resize.status('point/abc.jpg') == resize.DONE
+    assert resize.status('point/other.jpg') is None
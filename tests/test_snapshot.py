@@ -0,0 +1,71 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from wiating_backend.elastic import Location
+from wiating_backend.snapshot import FIRE, WATER, Snapshot, refresh, write_snapshot
+
+
+def make_hit(doc_id, lat, lon, point_type='SHED', **source):
+    body = {"name": doc_id, "description": "", "directions": "", "location": {"lat": str(lat), "lon": str(lon)},
+            "type": point_type, "water_exists": None, "water_comment": None, "fire_exists": None,
+            "fire_comment": None, "created_timestamp": "1583403492", "created_by": "some id",
+            "last_modified_timestamp": "1583403492", "last_modified_by": "some id"}
+    body.update(source)
+    return {"_id": doc_id, "_source": body}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    rows = [("a", 50.76, 16.18, "SHED", WATER, b'{"id":"a"}'),
+            ("b", 50.10, 19.90, "CAVE", 0, b'{"id":"b"}'),
+            ("c", -33.9, 151.2, "SHED", FIRE, b'{"id":"c"}'),
+            ("d", 64.1, -179.5, None, 0, b'{"id":"d"}')]
+    write_snapshot(str(tmp_path), rows, generation=7)
+    return str(tmp_path)
+
+
+def test_snapshot_select_bounding_box(snapshot_path):
+    snapshot = Snapshot.open(snapshot_path)
+
+    result = snapshot.points_json(top_right=Location(lat=51, lon=20), bottom_left=Location(lat=50, lon=16))
+
+    assert snapshot.generation == 7
+    assert sorted(point['id'] for point in json.loads(result)['points']) == ['a', 'b']
+
+
+def test_snapshot_select_point_type_and_antimeridian(snapshot_path):
+    snapshot = Snapshot.open(snapshot_path)
+
+    shed = snapshot.points_json(top_right=Location(lat=90, lon=180), bottom_left=Location(lat=-90, lon=-180),
+                                point_type=["SHED"])
+    wrapped = snapshot.points_json(top_right=Location(lat=70, lon=-170), bottom_left=Location(lat=60, lon=170))
+
+    assert sorted(point['id'] for point in json.loads(shed)['points']) == ['a', 'c']
+    assert json.loads(wrapped) == {'points': [{'id': 'd'}]}
+
+
+def test_snapshot_refresh_incremental(snapshot_path):
+    redis = MagicMock()
+    redis.get.return_value = b'8'
+    redis.smembers.return_value = {b'b', b'e'}
+    es = MagicMock()
+    es.es.mget.return_value = {"docs": [dict(make_hit('b', 50.2, 19.9), found=True),
+                                        dict(make_hit('e', 10, 10, unpublished=True), found=True)]}
+
+    assert refresh(es, snapshot_path, redis=redis) is True
+
+    snapshot = Snapshot.open(snapshot_path)
+    assert snapshot.generation == 8
+    assert sorted(row[0] for row in snapshot.rows()) == ['a', 'b', 'c', 'd']
+    point_b, = [json.loads(row[5]) for row in snapshot.rows() if row[0] == 'b']
+    assert point_b['location'] == {"lat": "50.2", "lon": "19.9"}
+    redis.delete.assert_called_with('points:snapshot:processing')
+
+
+def test_snapshot_refresh_up_to_date(snapshot_path):
+    redis = MagicMock()
+    redis.get.return_value = b'7'
+
+    assert refresh(MagicMock(), snapshot_path, redis=redis) is False
@@ -0,0 +1,130 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from wiating_backend.static import CACHE_CONTROL, GZipMiddleware, ImageFiles, ImageResponse, RangeNotSatisfiable, \
+    parse_range
+
+
+IMAGE = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def image_client(tmpdir):
+    tmpdir.mkdir('point').join('abc.jpg').write_binary(IMAGE)
+    app = FastAPI()
+    app.mount('/images', ImageFiles(directory=str(tmpdir)), name='images')
+
+    @app.get('/text')
+    def text():
+        return {"text": "x" * 1000}
+
+    app.add_middleware(GZipMiddleware, exclude_paths=('/images/',))
+    return TestClient(app)
+
+
+def test_image_headers(image_client):
+    response = image_client.get('/images/point/abc.jpg')
+
+    assert response.status_code == 200
+    assert response.content == IMAGE
+    assert response.headers['cache-control'] == CACHE_CONTROL
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['etag'].startswith('"')
+    assert 'content-encoding' not in response.headers
+
+
+def test_image_etag_stable(image_client):
+    etags = {image_client.get('/images/point/abc.jpg').headers['etag'] for _ in range(2)}
+
+    assert len(etags) == 1
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", {etag}', '*'])
+def test_image_not_modified(image_client, if_none_match):
+    etag = image_client.get('/images/point/abc.jpg').headers['etag']
+
+    response = image_client.get('/images/point/abc.jpg', headers={"if-none-match": if_none_match.format(etag=etag)})
+
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag and response.headers['cache-control'] == CACHE_CONTROL
+
+
+def test_image_modified(image_client):
+    response = image_client.get('/images/point/abc.jpg', headers={"if-none-match": '"other"'})
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('header, start, end', [('bytes=0-99', 0, 99), ('bytes=10000-', 10000, 10239),
+                                                ('bytes=-40', 10200, 10239), ('bytes=10200-99999', 10200, 10239)])
+def test_image_range(image_client, header, start, end):
+    response = image_client.get('/images/point/abc.jpg', headers={"range": header})
+
+    assert response.status_code == 206
+    assert response.content == IMAGE[start:end + 1]
+    assert response.headers['content-range'] == 'bytes {}-{}/{}'.format(start, end, len(IMAGE))
+    assert response.headers['content-length'] == str(end - start + 1)
+
+
+def test_image_range_not_satisfiable(image_client):
+    response = image_client.get('/images/point/abc.jpg', headers={"range": "bytes=20000-"})
+
+    assert response.status_code == 416
+    assert response.headers['content-range'] == 'bytes */{}'.format(len(IMAGE))
+
+
+def test_image_range_ignored_for_stale_if_range(image_client):
+    response = image_client.get('/images/point/abc.jpg', headers={"range": "bytes=0-9", "if-range": '"other"'})
+
+    assert response.status_code == 200 and response.content == IMAGE
+
+
+def test_image_head(image_client):
+    response = image_client.head('/images/point/abc.jpg')
+
+    assert response.status_code == 200
+    assert response.content == b''
+    assert response.headers['content-length'] == str(len(IMAGE))
+
+
+def test_gzip_other_paths(image_client):
+    response = image_client.get('/text', headers={"accept-encoding": "gzip"})
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.json() == {"text": "x" * 1000}
+
+
+@pytest.mark.parametrize('header, expected', [('bytes=5-', (5, 99)), ('bytes=0-0', (0, 0)), ('items=0-5', None),
+                                              ('bytes=0-5,10-20', None), ('bytes=5-1', None), ('bytes=x-', None),
+                                              ('bytes=-500', (0, 99))])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=-0'])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 100)
+
+
+def test_image_zerocopy(tmpdir):
+    path = tmpdir.join('abc.jpg')
+    path.write_binary(IMAGE)
+    response = ImageResponse(str(path), os.stat(str(path)), 'GET', '"tag"', byte_range=(10, 19))
+    messages = []
+
+    async def send(message):
+        if message['type'] == 'http.response.zerocopy':
+            message = dict(message, file=message['file'].name)
+        messages.append(message)
+
+    asyncio.run(response({"type": "http", "extensions": {"http.response.zerocopy": {}}}, None, send))
+
+    assert messages[0]['status'] == 206
+    assert messages[1] == {"type": "http.response.zerocopy", "file": str(path), "offset": 10, "count": 10,
+                           "more_body": False}
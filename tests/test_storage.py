@@ -0,0 +1,191 @@
+import asyncio
+import io
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from wiating_backend import storage
+from wiating_backend.uploads import FileTooLarge
+
+
+class FakeS3:
+    """In-memory stand-in for the few S3 APIs the store uses
+    """
+    def __init__(self, page_size=1000):
+        self.objects = {}
+        self.content_types = {}
+        self.page_size = page_size
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType='binary/octet-stream'):
+        self.objects[(Bucket, Key)] = Body
+        self.content_types[(Bucket, Key)] = ContentType
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, 'HeadObject')
+        return {"ContentLength": len(self.objects[(Bucket, Key)]),
+                "ContentType": self.content_types.get((Bucket, Key), 'binary/octet-stream')}
+
+    def generate_presigned_post(self, Bucket, Key, Fields, Conditions, ExpiresIn):
+        return {"url": "https://%s.s3.amazonaws.com/" % Bucket,
+                "fields": dict(Fields, key=Key, policy=json.dumps(Conditions), expires=str(ExpiresIn))}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        body = b''
+        while True:
+            chunk = fileobj.read(8 * 1024)
+            if not chunk:
+                break
+            body += chunk
+        self.objects[(bucket, key)] = body
+        self.content_types[(bucket, key)] = (ExtraArgs or {}).get('ContentType', 'binary/octet-stream')
+
+    def delete_objects(self, Bucket, Delete):
+        assert len(Delete['Objects']) <= 1000
+        self.calls.append(('delete_objects', len(Delete['Objects'])))
+        for item in Delete['Objects']:
+            self.objects.pop((Bucket, item['Key']), None)
+        return {}
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return SimpleNamespace(paginate=self._paginate)
+
+    def _paginate(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        for start in range(0, len(keys), self.page_size):
+            self.calls.append(('list_objects_v2', start))
+            yield {"Contents": [{"Key": key} for key in keys[start:start + self.page_size]]}
+
+
+@pytest.fixture
+def redis(mocker):
+    return mocker.patch('wiating_backend.storage.redis_client', autospec=True).return_value
+
+
+@pytest.fixture
+def s3(mocker, redis):
+    fake = FakeS3()
+    mocker.patch('wiating_backend.storage._s3', fake)
+    mocker.patch.object(storage.config, 'STORE_PROPERTY', 's3://bucket')
+    return fake
+
+
+def test_s3_client_shared(mocker):
+    mocker.patch('wiating_backend.storage._s3', None)
+    session = mocker.patch('wiating_backend.storage.boto3.session.Session', autospec=True)
+
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(storage.s3_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
+    session.return_value.client.assert_called_once()
+
+
+def test_delete_image_directory_s3(s3):
+    for i in range(2500):
+        s3.put_object(Bucket='bucket', Key='point/%04d.jpg' % i)
+    s3.put_object(Bucket='bucket', Key='point/')
+    s3.put_object(Bucket='bucket', Key='pointless/a.jpg')
+
+    storage.delete_image_directory('point')
+
+    assert list(s3.objects) == [('bucket', 'pointless/a.jpg')]
+    assert [call for call in s3.calls if call[0] == 'delete_objects'] == [
+        ('delete_objects', 1000), ('delete_objects', 1000), ('delete_objects', 501)]
+
+
+def test_delete_objects_batches(s3):
+    for i in range(1500):
+        s3.put_object(Bucket='bucket', Key=str(i))
+
+    storage.delete_objects('bucket', [str(i) for i in range(1500)])
+
+    assert s3.objects == {}
+    assert s3.calls == [('delete_objects', 1000), ('delete_objects', 500)]
+
+
+def test_delete_image_file_s3(s3):
+    for key in ('point/a.jpg', 'point/a_m.jpg', 'point/b.jpg'):
+        s3.put_object(Bucket='bucket', Key=key)
+
+    storage.delete_image_file('point', 'a.jpg')
+
+    assert list(s3.objects) == [('bucket', 'point/b.jpg')]
+    assert s3.calls == [('delete_objects', 2)]
+
+
+def test_upload_file_s3(s3, mocker):
+    mocker.patch.object(storage.config, 'MAX_CONTENT_LENGTH', 100)
+    upload = SimpleNamespace(file=io.BytesIO(b'x' * 50), content_type='image/jpeg')
+
+    storage.upload_file(upload, 'point/a.jpg')
+
+    assert s3.objects[('bucket', 'point/a.jpg')] == b'x' * 50
+
+
+def test_upload_file_too_large(tmpdir, mocker):
+    mocker.patch.object(storage.config, 'STORE_PROPERTY', 'file://' + str(tmpdir))
+    mocker.patch.object(storage.config, 'MAX_CONTENT_LENGTH', 100)
+    upload = SimpleNamespace(file=io.BytesIO(b'x' * 150), content_type='image/jpeg')
+
+    with pytest.raises(FileTooLarge):
+        storage.upload_file(upload, 'a.jpg')
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_run_uses_storage_executor(mocker):
+    mocker.patch('wiating_backend.storage._executor', None)
+
+    name = asyncio.run(storage.run(lambda: threading.current_thread().name))
+
+    assert name.startswith('storage')
+    storage.stop()
+
+
+def test_claim_image(redis):
+    redis.sadd.side_effect = [1, 0]
+
+    assert storage.claim_image('point', 'a.jpg') is True
+    assert storage.claim_image('point', 'a.jpg') is False
+    redis.sadd.assert_called_with('images:stored:point', 'a.jpg')
+
+
+def test_image_stored(redis):
+    redis.sismember.return_value = 1
+
+    assert storage.image_stored('point', 'a.jpg') is True
+    redis.sismember.assert_called_once_with('images:stored:point', 'a.jpg')
+
+
+def test_deletes_release_stored_images(s3, redis):
+    storage.delete_image_file('point', 'a.jpg')
+    storage.delete_image_directory('point')
+
+    redis.srem.assert_called_once_with('images:stored:point', 'a.jpg')
+    redis.delete.assert_called_once_with('images:stored:point')
+
+
+def test_stored_object(s3):
+    s3.put_object(Bucket='bucket', Key='point/a.jpg', Body=b'x' * 10, ContentType='image/jpeg')
+
+    assert storage.stored_object('point/a.jpg') == {"ContentLength": 10, "ContentType": 'image/jpeg'}
+    assert storage.stored_object('point/b.jpg') is None
+
+
+def test_presigned_upload(s3, mocker):
+    mocker.patch.object(storage.config, 'MAX_CONTENT_LENGTH', 100)
+
+    post = storage.presigned_upload('point/a.jpg', 'image/jpeg', 600)
+
+    assert post['fields']['key'] == 'point/a.jpg' and post['fields']['Content-Type'] == 'image/jpeg'
+    assert ["content-length-range", 1, 100] in json.loads(post['fields']['policy'])
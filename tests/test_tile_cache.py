@@ -0,0 +1,72 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from wiating_backend import tile_cache
+from wiating_backend.elastic import Location
+
+
+def test_tiles_for_bbox():
+    tiles = tile_cache.tiles_for_bbox(Location(lat=51, lon=19), Location(lat=50, lon=16), 6)
+
+    assert tiles == [(34, 21), (35, 21)]
+
+
+def test_tiles_for_bbox_too_many():
+    world = (Location(lat=85, lon=180), Location(lat=-85, lon=-180))
+
+    assert tile_cache.tiles_for_bbox(*world, 11, max_tiles=64) == []
+    assert len(tile_cache.tiles_for_bbox(*world, 2, max_tiles=64)) == 16
+
+
+def test_clip():
+    inside = {"location": {"lat": "50.5", "lon": "16.5"}}
+    outside = {"location": {"lat": "52.5", "lon": "16.5"}}
+
+    result = tile_cache.clip([[inside, outside], []], Location(lat=51, lon=19), Location(lat=50, lon=16))
+
+    assert result == [inside]
+
+
+def test_lookup():
+    redis = MagicMock()
+    redis.mget.side_effect = [[b'2', None], [b'[{"id": "a"}]', None]]
+
+    cached, missing, versions = tile_cache.lookup([(1, 2), (1, 3)], 6, point_type=["SHED"], redis=redis)
+
+    assert redis.mget.call_args_list[1][0][0] == ['points:tiles:6:1:2:2:0:full:SHED',
+                                                  'points:tiles:6:1:3:0:0:full:SHED']
+    assert cached == {(1, 2): [{"id": "a"}]}
+    assert missing == [(1, 3)]
+    assert versions == {(1, 2): 2, (1, 3): 0}
+
+
+def test_invalidate(mocker):
+    mocker.patch.object(tile_cache, '_zoom', 6)
+    delayed = mocker.patch.object(tile_cache, '_delayed')
+    redis = MagicMock()
+
+    tile_cache.invalidate(['some id'], [("50.5", "16.5"), ("50.6", "16.6")], redis=redis)
+
+    redis.pipeline.return_value.incr.assert_called_once_with('points:tiles:version:6:34:21')
+    delayed.add.assert_called_once_with({(34, 21)})
+
+
+def test_delayed_bumps_merge_tiles():
+    bumped = []
+    done = threading.Event()
+
+    def bump(tiles):
+        bumped.append(sorted(tiles))
+        done.set()
+
+    delayed = tile_cache.DelayedBumps(0.05, bump)
+    for _ in range(1000):
+        delayed.add({(1, 2), (1, 3)})
+    assert delayed.pending() == 2
+
+    assert done.wait(5)
+    time.sleep(0.1)
+
+    assert bumped == [[(1, 2), (1, 3)]]
+    assert delayed.pending() == 0
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+import requests
+from authlib.jose import JsonWebKey, jwt
+from authlib.jose.errors import JoseError
+
+from wiating_backend import tokens
+
+
+ISSUER = 'https://some_domain/'
+AUDIENCE = 'some audience'
+
+
+def make_key(kid):
+    key = JsonWebKey.generate_key('RSA', 2048, is_private=True)
+    public = {name: value for name, value in key.as_dict().items() if name in ('kty', 'n', 'e')}
+    return key, dict(public, kid=kid)
+
+
+@pytest.fixture(scope='module')
+def keys():
+    return make_key('first'), make_key('second')
+
+
+def sign(key, kid, **claims):
+    payload = {"iss": ISSUER, "aud": AUDIENCE, "sub": "some sub", "exp": int(time.time()) + 60}
+    payload.update(claims)
+    payload = {name: value for name, value in payload.items() if value is not None}
+    return jwt.encode({"alg": "RS256", "kid": kid}, payload, key).decode()
+
+
+@pytest.fixture
+def jwks_get(mocker, keys):
+    (_, first), _ = keys
+    get = mocker.patch('wiating_backend.tokens.requests.get', autospec=True)
+    get.return_value.json.return_value = {"keys": [first]}
+    return get
+
+
+def test_verify(jwks_get, keys):
+    (private, _), _ = keys
+    key_set = tokens.KeySet('https://some_domain/.well-known/jwks.json')
+
+    claims = tokens.verify(sign(private, 'first'), key_set, ISSUER, AUDIENCE)
+    tokens.verify(sign(private, 'first', sub='other sub'), key_set, ISSUER, AUDIENCE)
+
+    assert claims['sub'] == 'some sub'
+    jwks_get.assert_called_once_with('https://some_domain/.well-known/jwks.json', timeout=5)
+
+
+@pytest.mark.parametrize('claims', [{"exp": int(time.time()) - 10}, {"aud": "other audience"},
+                                    {"iss": "https://other_domain/"}, {"exp": None}, {"sub": None}])
+def test_verify_rejects_invalid_claims(jwks_get, keys, claims):
+    (private, _), _ = keys
+
+    with pytest.raises(JoseError):
+        tokens.verify(sign(private, 'first', **claims), tokens.KeySet('some url'), ISSUER, AUDIENCE)
+
+
+def test_verify_rejects_forged_signature(jwks_get, keys):
+    _, (other_private, _) = keys
+
+    with pytest.raises(JoseError):
+        tokens.verify(sign(other_private, 'first'), tokens.KeySet('some url'), ISSUER, AUDIENCE)
+
+
+def test_verify_refreshes_on_unknown_key(jwks_get, keys):
+    (_, first), (private, second) = keys
+    key_set = tokens.KeySet('some url', min_refresh_interval=0)
+    key_set.get()
+    jwks_get.return_value.json.return_value = {"keys": [first, second]}
+
+    claims = tokens.verify(sign(private, 'second'), key_set, ISSUER, AUDIENCE)
+
+    assert claims['sub'] == 'some sub'
+    assert jwks_get.call_count == 2
+
+
+def test_verify_rate_limits_unknown_key_refreshes(jwks_get, keys):
+    _, (private, _) = keys
+    key_set = tokens.KeySet('some url')
+
+    for _ in range(3):
+        with pytest.raises(JoseError):
+            tokens.verify(sign(private, 'second'), key_set, ISSUER, AUDIENCE)
+
+    jwks_get.assert_called_once()
+
+
+def test_verify_not_a_jwt(jwks_get):
+    with pytest.raises(tokens.NotVerifiable):
+        tokens.verify('some.opaque.token', tokens.KeySet('some url'), ISSUER, AUDIENCE)
+
+
+def test_verify_key_set_unavailable(jwks_get, keys):
+    (private, _), _ = keys
+    jwks_get.side_effect = requests.ConnectionError()
+
+    with pytest.raises(tokens.NotVerifiable):
+        tokens.verify(sign(private, 'first'), tokens.KeySet('some url'), ISSUER, AUDIENCE)
+
+
+def test_key_set_refreshes_stale_keys_in_background(jwks_get, mocker):
+    key_set = tokens.KeySet('some url', refresh_interval=0)
+    thread = mocker.patch('wiating_backend.tokens.threading.Thread', autospec=True)
+    key_set.get()
+
+    keys = key_set.get()
+
+    assert keys is key_set._keys
+    thread.return_value.start.assert_called_once()
+    jwks_get.assert_called_once()
@@ -0,0 +1,108 @@
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.testclient import TestClient
+
+from wiating_backend.uploads import ContentSizeLimitMiddleware, FileTooLarge, LimitedReader, content_hash
+
+
+def test_limited_reader_hashes_in_chunks():
+    data = b'x' * 2500
+    reader = LimitedReader(io.BytesIO(data), limit=2500)
+    out = io.BytesIO()
+
+    while True:
+        chunk = reader.read(1000)
+        if not chunk:
+            break
+        assert len(chunk) <= 1000
+        out.write(chunk)
+
+    assert out.getvalue() == data
+    assert reader.size == 2500
+    assert reader.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_limited_reader_stops_past_limit():
+    reader = LimitedReader(io.BytesIO(b'x' * 2500), limit=1500)
+
+    reader.read(1000)
+    with pytest.raises(FileTooLarge):
+        reader.read(1000)
+
+
+def test_content_hash():
+    upload = io.BytesIO(b'x' * 50)
+    upload.seek(20)
+
+    assert content_hash(upload, 100) == hashlib.sha256(b'x' * 50).hexdigest()
+    assert upload.tell() == 0
+
+
+def test_content_hash_too_large():
+    with pytest.raises(FileTooLarge):
+        content_hash(io.BytesIO(b'x' * 150), 100)
+
+
+@pytest.fixture
+def upload_client():
+    app = FastAPI()
+    app.add_middleware(ContentSizeLimitMiddleware, max_size=1024, paths=('/upload',))
+
+    @app.post('/upload')
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    @app.post('/upload/raw')
+    async def upload_raw(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.post('/other')
+    async def other(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return TestClient(app)
+
+
+def test_content_size_limit_passes_small_bodies(upload_client):
+    response = upload_client.post('/upload', files={"file": ('a.jpg', b'x' * 100, 'image/jpeg')})
+
+    assert response.status_code == 200 and response.json() == {"size": 100}
+
+
+def test_content_size_limit_content_length(upload_client):
+    response = upload_client.post('/upload', files={"file": ('a.jpg', b'x' * 2000, 'image/jpeg')})
+
+    assert response.status_code == 413
+
+
+def test_content_size_limit_streamed_body(upload_client):
+    def body():
+        for _ in range(4):
+            yield b'x' * 512
+
+    response = upload_client.post('/upload/raw', data=body())
+
+    assert response.status_code == 413
+
+
+def test_content_size_limit_streamed_multipart(upload_client):
+    def body():
+        yield (b'--boundary\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n')
+        for _ in range(4):
+            yield b'x' * 512
+        yield b'\r\n--boundary--\r\n'
+
+    response = upload_client.post('/upload', data=body(),
+                                  headers={"content-type": "multipart/form-data; boundary=boundary"})
+
+    assert response.status_code == 413
+
+
+def test_content_size_limit_other_paths(upload_client):
+    response = upload_client.post('/other', files={"file": ('a.jpg', b'x' * 2000, 'image/jpeg')})
+
+    assert response.status_code == 200
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from auth0.v3 import Auth0Error
+from fastapi import HTTPException
+
+from wiating_backend import user_management
+from wiating_backend.user_management import UserIds, ban_users, block_user, management_client
+
+
+@pytest.fixture
+def auth0_mock(mocker):
+    mocker.patch('wiating_backend.user_management._client', None)
+    get_token = mocker.patch('wiating_backend.user_management.GetToken', autospec=True)
+    get_token.return_value.client_credentials.side_effect = [
+        {'access_token': 'token %d' % i, 'expires_in': 86400} for i in range(5)]
+    return get_token, mocker.patch('wiating_backend.user_management.Auth0')
+
+
+def test_management_client_is_shared(auth0_mock):
+    get_token, auth0 = auth0_mock
+
+    assert management_client() is management_client()
+    get_token.return_value.client_credentials.assert_called_once()
+    auth0.assert_called_once_with(user_management.config.AUTH0_DOMAIN, 'token 0')
+
+
+def test_management_client_renews_expiring_token(auth0_mock):
+    get_token, auth0 = auth0_mock
+    get_token.return_value.client_credentials.side_effect = [{'access_token': 'token 0', 'expires_in': 30},
+                                                             {'access_token': 'token 1', 'expires_in': 86400}]
+
+    management_client()
+    management_client()
+
+    assert [call[0][1] for call in auth0.call_args_list] == ['token 0', 'token 1']
+
+
+def test_block_user_retries_with_new_token(auth0_mock):
+    get_token, auth0 = auth0_mock
+    expired, renewed = MagicMock(), MagicMock()
+    auth0.side_effect = [expired, renewed]
+    expired.users.update.side_effect = Auth0Error(401, 'invalid_token', 'Expired token')
+
+    block_user('some user')
+
+    assert get_token.return_value.client_credentials.call_count == 2
+    renewed.users.update.assert_called_once_with('some user', {"blocked": True})
+    assert management_client() is renewed
+
+
+def test_block_user_raises_other_errors(auth0_mock):
+    _, auth0 = auth0_mock
+    auth0.return_value.users.update.side_effect = Auth0Error(404, 'inexistent_user', 'User not found')
+
+    with pytest.raises(Auth0Error):
+        block_user('some user')
+    auth0.return_value.users.update.assert_called_once()
+
+
+def test_ban_users_bounded(mocker):
+    mocker.patch.object(user_management.config, 'BAN_CONCURRENCY', 2)
+    running, peak, lock = [0], [0], threading.Lock()
+    release = threading.Event()
+
+    def block(user_id):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            if peak[0] == 2:
+                release.set()
+        release.wait(1)
+        with lock:
+            running[0] -= 1
+        if user_id == 'missing':
+            raise Auth0Error(404, 'inexistent_user', 'User not found')
+
+    mocker.patch('wiating_backend.user_management.block_user', side_effect=block)
+
+    result = asyncio.run(ban_users(UserIds(ids=['a', 'b', 'missing', 'a', 'c'])))
+
+    assert result == {"banned": ['a', 'b', 'c'], "failed": [{"id": 'missing', "error": 'User not found'}]}
+    assert peak[0] == 2
+
+
+def test_ban_users_too_many(mocker):
+    mocker.patch.object(user_management.config, 'MAX_BAN_USERS', 2)
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(ban_users(UserIds(ids=['a', 'b', 'c'])))
+    assert e.value.status_code == 400
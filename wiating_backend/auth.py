@@ -1,13 +1,23 @@
+import hashlib
+import json
+import time
 from functools import wraps
 
 from auth0.v3 import Auth0Error
 from auth0.v3.authentication import Users
+from authlib.jose.errors import JoseError
 from fastapi import Header, HTTPException
-from redis import Redis
 
+from wiating_backend import tokens
+
+from wiating_backend.cache import SingleFlight, TTLCache, redis_client
 from wiating_backend.config import DefaultConfig
 from wiating_backend.constants import APP_METADATA_KEY, MODERATOR
 
+_users = TTLCache(maxsize=4096)
+_userinfo_calls = SingleFlight()
+
+
 # Error handler
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -15,6 +25,13 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class InvalidToken(AuthError):
+    """A token that failed local verification, answered with 401 instead of falling back to Auth0
+    """
+    def __init__(self, code, description):
+        super().__init__({"code": code, "description": description}, 401)
+
+
 def get_token_auth_header(authorization):
     """Obtains the Access Token from the Authorization Header
     """
@@ -43,35 +60,75 @@ def get_token_auth_header(authorization):
     return token
 
 
-def check_permissions(token, config: DefaultConfig = DefaultConfig()):
-    sub_key = f'{token}:sub'
-    moderator_key = f'{token}:moderator'
+def _token_key(token):
+    # tokens are credentials, keep only their digest in Redis
+    return 'auth:user:' + hashlib.sha256(token.encode()).hexdigest()
+
+
+def _is_moderator(app_metadata, config):
+    if not app_metadata:
+        return False
+    return app_metadata.get('role') == MODERATOR and config.INDEX_NAME in (app_metadata.get('services') or [])
+
+
+def _userinfo(token, key, config):
+    a0_users = Users(config.AUTH0_DOMAIN)
+    a0_user = a0_users.userinfo(token)
 
-    redis = Redis(host=config.REDIS_HOST, port=int(config.REDIS_PORT), db=0)
+    user = {'sub': a0_user.get('sub'), 'is_moderator': _is_moderator(a0_user.get(APP_METADATA_KEY), config)}
+    redis_client(config).set(key, json.dumps(user), ex=config.AUTH_CACHE_TTL)
+    return user
 
-    sub = redis.get(sub_key)
-    is_moderator = redis.get(moderator_key)
 
-    if not sub or not is_moderator:
-        a0_users = Users(config.AUTH0_DOMAIN)
-        a0_user = a0_users.userinfo(token)
+def _verified_user(token, config):
+    """The user a locally verified token belongs to and seconds until it expires, or None to ask Auth0
+    """
+    if token.count('.') != 2:
+        return None
+    try:
+        claims = tokens.verify(token, tokens.key_set(config), issuer=config.AUTH0_BASE_URL + '/',
+                               audience=config.AUTH0_AUDIENCE)
+    except tokens.NotVerifiable:
+        return None
+    except JoseError as e:
+        raise InvalidToken(e.error or 'invalid_token', e.description or 'Invalid token')
+    # without the role claim in the access token only userinfo knows whether the user moderates
+    if APP_METADATA_KEY not in claims:
+        return None
+    user = {'sub': claims['sub'], 'is_moderator': _is_moderator(claims[APP_METADATA_KEY], config)}
+    return user, claims['exp'] - time.time()
+
+
+def check_permissions(token, config: DefaultConfig = DefaultConfig()):
+    """Resolves the token to the user's sub and moderator flag
+
+    Looks in the in-process cache first, then in Redis, and asks Auth0 only when both miss. Concurrent misses for
+    the same token share a single Auth0 call. With `AUTH_LOCAL_JWT` a JWT carrying the app metadata claim is verified
+    against the tenant's keys instead, touching neither Redis nor Auth0.
+    """
+    key = _token_key(token)
+    user = _users.get(key)
+    if user is not None:
+        return dict(user)
 
-        sub = a0_user.get('sub')
-        is_moderator = 0
+    verified = _verified_user(token, config) if config.AUTH_LOCAL_JWT else None
+    if verified is not None:
+        user, expires_in = verified
+        _users.set(key, user, ttl=max(min(config.AUTH_LOCAL_CACHE_TTL, expires_in), 0))
+        return dict(user)
 
-        if a0_user.get(APP_METADATA_KEY):
-            role = a0_user.get(APP_METADATA_KEY).get('role')
-            if role == MODERATOR and \
-                config.INDEX_NAME in a0_user.get(APP_METADATA_KEY).get('services'):
-                is_moderator = 1
+    cached = redis_client(config).get(key)
+    if cached is not None:
+        user = json.loads(cached)
+    else:
+        user = _userinfo_calls.do(key, _userinfo, token, key, config)
+    _users.set(key, user, ttl=config.AUTH_LOCAL_CACHE_TTL)
+    return dict(user)
 
-        redis.set(sub_key, sub)
-        redis.expire(sub_key, 60)
-        redis.set(moderator_key, is_moderator)
-        redis.expire(moderator_key, 60)
 
-    return {'sub': sub.decode() if isinstance(sub, bytes) else sub,
-        'is_moderator': True if int(is_moderator) == 1 else False}
+def _unauthorized(error):
+    return HTTPException(status_code=401, detail=error.error['description'],
+                         headers={"WWW-Authenticate": 'Bearer error="invalid_token"'})
 
 
 def require_auth(authorization: str = Header(None)):
@@ -79,6 +136,8 @@ def require_auth(authorization: str = Header(None)):
         token = get_token_auth_header(authorization=authorization)
         user = check_permissions(token)
         return user
+    except InvalidToken as e:
+        raise _unauthorized(e)
     except Auth0Error:
         raise HTTPException(status_code=403, detail="Forbidden")
     except AuthError:
@@ -100,5 +159,7 @@ def allow_auth(authorization: str = Header(None)):
         token = get_token_auth_header(authorization=authorization)
         user = check_permissions(token)
         return user
+    except InvalidToken as e:
+        raise _unauthorized(e)
     except:
         return None
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from redis import ConnectionPool, Redis
+
+from .config import DefaultConfig
+
+
+_pool = None
+
+
+def redis_client(config=None):
+    """Returns a client on the connection pool shared by the whole process
+    """
+    global _pool
+    if _pool is None:
+        config = DefaultConfig() if config is None else config
+        _pool = ConnectionPool(host=config.REDIS_HOST, port=int(config.REDIS_PORT), db=0)
+    return Redis(connection_pool=_pool)
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire `ttl` seconds after they were set
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: one caller runs the function, the others wait for its result
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+        future.set_result(result)
+        return result
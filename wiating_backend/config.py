@@ -8,6 +8,13 @@ if ENV_FILE:
     load_dotenv(ENV_FILE)
 
 
+def env_bool(name, default=False):
+    value = env.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
 class BaseConfig:
     def __init__(self):
         self.DEBUG = False
@@ -25,9 +32,38 @@ class BaseConfig:
         self.STORE_PROPERTY = env.get(constants.S3_BUCKET)
         self.ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
         self.MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+        self.STORAGE_WORKERS = int(env.get(constants.STORAGE_WORKERS, 16))
+        self.UPLOAD_URL_EXPIRES = int(env.get(constants.UPLOAD_URL_EXPIRES, 600))
+        self.RESIZE_BACKEND = env.get(constants.RESIZE_BACKEND, 'celery')
+        self.RESIZE_SIZES = {suffix.strip(): int(size) for suffix, size in
+                             (item.split(':') for item in env.get(constants.RESIZE_SIZES, 'm:800').split(','))}
+        self.RESIZE_WORKERS = int(env.get(constants.RESIZE_WORKERS, 0)) or None
+        self.RESIZE_QUEUE_SIZE = int(env.get(constants.RESIZE_QUEUE_SIZE, 64))
+        self.RESIZE_SUBMIT_TIMEOUT = float(env.get(constants.RESIZE_SUBMIT_TIMEOUT, 5))
 
         self.SECRET_KEY = env.get(constants.SECRET_KEY)
         self.ES_CONNECTION_STRING = env.get(constants.ES_CONNECTION_STRING)
+        self.ES_MAX_CONNECTIONS = int(env.get(constants.ES_MAX_CONNECTIONS, 25))
+        self.ES_TIMEOUT = int(env.get(constants.ES_TIMEOUT, 10))
+        self.ES_SNIFF_ON_START = env_bool(constants.ES_SNIFF_ON_START)
+        self.ES_SNIFF_ON_CONNECTION_FAIL = env_bool(constants.ES_SNIFF_ON_CONNECTION_FAIL)
+        self.ES_SNIFFER_TIMEOUT = int(env.get(constants.ES_SNIFFER_TIMEOUT, 0)) or None
+        self.CLUSTER_MAX_ZOOM = int(env.get(constants.CLUSTER_MAX_ZOOM, 9))
+        self.CLUSTER_PRECISION_OFFSET = int(env.get(constants.CLUSTER_PRECISION_OFFSET, 2))
+        self.TILE_MAX_POINTS = int(env.get(constants.TILE_MAX_POINTS, 9000))
+        self.TILE_MAX_AGE = int(env.get(constants.TILE_MAX_AGE, 300))
+        self.SNAPSHOT_PATH = env.get(constants.SNAPSHOT_PATH)
+        self.SNAPSHOT_INTERVAL = int(env.get(constants.SNAPSHOT_INTERVAL, 5))
+        self.SNAPSHOT_FULL_INTERVAL = int(env.get(constants.SNAPSHOT_FULL_INTERVAL, 3600))
+        self.TILE_CACHE_ZOOM = int(env[constants.TILE_CACHE_ZOOM]) if env.get(constants.TILE_CACHE_ZOOM) else None
+        self.TILE_CACHE_TTL = int(env.get(constants.TILE_CACHE_TTL, 3600))
+        self.TILE_CACHE_MAX_TILES = int(env.get(constants.TILE_CACHE_MAX_TILES, 64))
+        self.PAGE_MAX_SIZE = int(env.get(constants.PAGE_MAX_SIZE, 1000))
+        self.PIT_KEEP_ALIVE = env.get(constants.PIT_KEEP_ALIVE, '1m')
+        self.MAX_POINT_IDS = int(env.get(constants.MAX_POINT_IDS, 500))
+        self.LOG_FLUSH_INTERVAL = float(env.get(constants.LOG_FLUSH_INTERVAL, 1.0))
+        self.LOG_FLUSH_SIZE = int(env.get(constants.LOG_FLUSH_SIZE, 500))
+        self.LOG_QUEUE_SIZE = int(env.get(constants.LOG_QUEUE_SIZE, 10000))
         self.INDEX_NAME = env.get(constants.INDEX_NAME)
         self.QUEUE_NAME = env.get(constants.IMAGE_RESIZER_QUEUE)
 
@@ -36,6 +72,15 @@ class BaseConfig:
 
         self.REDIS_HOST = env.get(constants.REDIS_HOST)
         self.REDIS_PORT = env.get(constants.REDIS_PORT)
+        self.AUTH_CACHE_TTL = int(env.get(constants.AUTH_CACHE_TTL, 60))
+        self.AUTH_LOCAL_CACHE_TTL = int(env.get(constants.AUTH_LOCAL_CACHE_TTL, 10))
+        self.AUTH_LOCAL_JWT = env_bool(constants.AUTH_LOCAL_JWT)
+        if self.AUTH_LOCAL_JWT and not self.AUTH0_AUDIENCE:
+            # authlib skips the audience check without one, accepting tokens issued for any API of the tenant
+            raise ValueError('{} needs {}'.format(constants.AUTH_LOCAL_JWT, constants.AUTH0_AUDIENCE))
+        self.AUTH_JWKS_REFRESH_INTERVAL = int(env.get(constants.AUTH_JWKS_REFRESH_INTERVAL, 3600))
+        self.BAN_CONCURRENCY = int(env.get(constants.BAN_CONCURRENCY, 8))
+        self.MAX_BAN_USERS = int(env.get(constants.MAX_BAN_USERS, 100))
 
 
 class DefaultConfig(BaseConfig):
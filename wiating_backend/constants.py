@@ -17,3 +17,37 @@ FLASK_STATIC_PATH = 'FLASK_STATIC_PATH'
 FLASK_STATIC_FOLDER = 'FLASK_STATIC_FOLDER'
 REDIS_HOST = 'REDIS_HOST'
 REDIS_PORT = 'REDIS_PORT'
+ES_MAX_CONNECTIONS = 'ES_MAX_CONNECTIONS'
+ES_TIMEOUT = 'ES_TIMEOUT'
+ES_SNIFF_ON_START = 'ES_SNIFF_ON_START'
+ES_SNIFF_ON_CONNECTION_FAIL = 'ES_SNIFF_ON_CONNECTION_FAIL'
+ES_SNIFFER_TIMEOUT = 'ES_SNIFFER_TIMEOUT'
+CLUSTER_MAX_ZOOM = 'CLUSTER_MAX_ZOOM'
+CLUSTER_PRECISION_OFFSET = 'CLUSTER_PRECISION_OFFSET'
+TILE_MAX_POINTS = 'TILE_MAX_POINTS'
+TILE_MAX_AGE = 'TILE_MAX_AGE'
+SNAPSHOT_PATH = 'SNAPSHOT_PATH'
+SNAPSHOT_INTERVAL = 'SNAPSHOT_INTERVAL'
+SNAPSHOT_FULL_INTERVAL = 'SNAPSHOT_FULL_INTERVAL'
+TILE_CACHE_ZOOM = 'TILE_CACHE_ZOOM'
+TILE_CACHE_TTL = 'TILE_CACHE_TTL'
+TILE_CACHE_MAX_TILES = 'TILE_CACHE_MAX_TILES'
+PAGE_MAX_SIZE = 'PAGE_MAX_SIZE'
+PIT_KEEP_ALIVE = 'PIT_KEEP_ALIVE'
+LOG_FLUSH_INTERVAL = 'LOG_FLUSH_INTERVAL'
+LOG_FLUSH_SIZE = 'LOG_FLUSH_SIZE'
+LOG_QUEUE_SIZE = 'LOG_QUEUE_SIZE'
+MAX_POINT_IDS = 'MAX_POINT_IDS'
+AUTH_CACHE_TTL = 'AUTH_CACHE_TTL'
+AUTH_LOCAL_CACHE_TTL = 'AUTH_LOCAL_CACHE_TTL'
+AUTH_LOCAL_JWT = 'AUTH_LOCAL_JWT'
+AUTH_JWKS_REFRESH_INTERVAL = 'AUTH_JWKS_REFRESH_INTERVAL'
+BAN_CONCURRENCY = 'BAN_CONCURRENCY'
+MAX_BAN_USERS = 'MAX_BAN_USERS'
+STORAGE_WORKERS = 'STORAGE_WORKERS'
+RESIZE_BACKEND = 'RESIZE_BACKEND'
+RESIZE_SIZES = 'RESIZE_SIZES'
+RESIZE_WORKERS = 'RESIZE_WORKERS'
+RESIZE_QUEUE_SIZE = 'RESIZE_QUEUE_SIZE'
+RESIZE_SUBMIT_TIMEOUT = 'RESIZE_SUBMIT_TIMEOUT'
+UPLOAD_URL_EXPIRES = 'UPLOAD_URL_EXPIRES'
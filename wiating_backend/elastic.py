@@ -1,10 +1,19 @@
+import asyncio
+import base64
+import json
+import re
+from collections import deque
 from datetime import datetime
+from functools import partial
 from typing import List, Optional
+from uuid import uuid4
 
-from elasticsearch import Elasticsearch as ES
+from elasticsearch import AsyncElasticsearch as AsyncES, ConflictError, Elasticsearch as ES, helpers
 from pydantic import BaseModel
 
+from . import log_sink, mvt, tile_cache
 from .config import DefaultConfig
+from .logger import logger
 
 
 class Location(BaseModel):
@@ -38,54 +47,16 @@ class BasePoint(BaseModel):
     report_reason: Optional[str]
     unpublished: Optional[bool] = None
 
-    @classmethod
-    def from_dict(cls, body):
-        source = body['_source']
-        return cls(name=source['name'], description=source['description'], directions=source['directions'],
-                   location=Location(lat=source['location']['lat'], lon=source['location']['lon']), type=source['type'],
-                   water_exists=source['water_exists'], water_comment=source['water_comment'],
-                   fire_exists=source['fire_exists'], fire_comment=source['fire_comment'],
-                   created_timestamp=source['created_timestamp'], created_by=source['created_by'],
-                   last_modified_timestamp=source['last_modified_timestamp'],
-                   last_modified_by=source['last_modified_by'], images=source.get('images'),
-                   is_disabled=source.get('is_disabled', False), report_reason=source.get('report_reason'),
-                   unpublished=source.get('unpublished'), doc_id=body['_id'])
-
-    def to_dict(self, with_id=False, moderator=False):
-        body = {
-            "name": self.name,
-            "description": self.description,
-            "directions": self.directions,
-            "location": {
-                "lat": self.location.lat,
-                "lon": self.location.lon
-            },
-            "type": self.type,
-            "water_exists": self.water_exists,
-            "water_comment": self.water_comment,
-            "fire_exists": self.fire_exists,
-            "fire_comment": self.fire_comment,
-            "is_disabled": self.is_disabled,
-            "report_reason": self.report_reason,
-            "created_timestamp": self.created_timestamp,
-            "last_modified_timestamp": self.last_modified_timestamp,
-        }
-        if with_id is True:
-            body["id"] = self.doc_id
-        if moderator is True:
-            body["unpublished"] = self.unpublished
-        if self.images is not None:
-            body['images'] = list()
-            for image in self.images:
-                body["images"].append({"name": image.name, "created_timestamp": image.created_timestamp})
-        return body
-
 
 class NotDefined:
     pass
 
 
 class Point:
+    __slots__ = ('name', 'description', 'directions', 'lat', 'lon', 'point_type', 'water_exists', 'fire_exists',
+                 'water_comment', 'fire_comment', 'created_timestamp', 'created_by', 'doc_id',
+                 'last_modified_timestamp', 'last_modified_by', 'images', 'is_disabled', 'report_reason', 'unpublished')
+
     def __init__(self, name, description, directions, lat, lon, point_type, created_by, last_modified_by,
                  water_exists=None, fire_exists=None, water_comment=None, fire_comment=None, doc_id=None,
                  created_timestamp=None, last_modified_timestamp=None, images=None, is_disabled=False,
@@ -205,6 +176,39 @@ class Point:
             self.report_reason = [report_reason]
 
 
+def point_from_hit(hit, with_id=False, moderator=False):
+    """Single pass equivalent of `Point.from_dict(hit).to_dict(with_id, moderator)` for read paths
+    """
+    source = hit['_source']
+    location = source['location']
+    body = {
+        "name": source['name'],
+        "description": source['description'],
+        "directions": source['directions'],
+        "location": {
+            "lat": str(location['lat']),
+            "lon": str(location['lon'])
+        },
+        "type": source['type'],
+        "water_exists": source['water_exists'],
+        "water_comment": source['water_comment'],
+        "fire_exists": source['fire_exists'],
+        "fire_comment": source['fire_comment'],
+        "is_disabled": source.get('is_disabled', False),
+        "report_reason": source.get('report_reason'),
+        "created_timestamp": source['created_timestamp'],
+        "last_modified_timestamp": source['last_modified_timestamp'],
+    }
+    if with_id is True:
+        body["id"] = hit['_id']
+    if moderator is True:
+        body["unpublished"] = source.get('unpublished')
+    images = source.get('images')
+    if images is not None:
+        body['images'] = [{"name": image['name'], "created_timestamp": image['created_timestamp']} for image in images]
+    return body
+
+
 def add_to_or_create_list(location, name, query):
     try:
         location[name]
@@ -213,18 +217,115 @@ def add_to_or_create_list(location, name, query):
     location[name].append(query)
 
 
+MARKER_VIEW = 'marker'
+MARKER_FIELDS = ["name", "location", "type", "water_exists", "fire_exists", "is_disabled", "unpublished"]
+
+
+def marker_from_hit(hit, moderator=False):
+    """Map marker with only the fields needed to draw and filter it, see `MARKER_FIELDS`
+    """
+    source = hit['_source']
+    marker = {
+        "id": hit['_id'],
+        "name": source.get('name'),
+        "location": {
+            "lat": str(source['location']['lat']),
+            "lon": str(source['location']['lon'])
+        },
+        "type": source.get('type'),
+        "water_exists": source.get('water_exists'),
+        "fire_exists": source.get('fire_exists'),
+        "is_disabled": source.get('is_disabled', False),
+    }
+    if moderator is True:
+        marker["unpublished"] = source.get('unpublished')
+    return marker
+
+
+def cluster_precision(zoom=None, precision=None, max_zoom=9, offset=2):
+    """Returns the geotile precision to cluster at, or None when full points should be returned
+    """
+    if precision is not None:
+        return max(0, min(precision, 29))
+    if zoom is not None and zoom <= max_zoom:
+        return max(0, min(zoom + offset, 29))
+    return None
+
+
+DEFAULT_PAGE_SIZE = 1000
+# attempts of a read-modify-write before a concurrent change of the same point is reported as a conflict
+CONFLICT_RETRIES = 3
+# log ids start with the month of the index they are saved to, e.g. 05_2021-<32 hex digits>
+LOG_ID = re.compile(r'^(\d{2}_\d{4})-[0-9a-f]{32}$')
+
+
+def encode_cursor(pit_id, search_after):
+    """Opaque continuation token of a paged search
+    """
+    data = json.dumps({"pit": pit_id, "after": search_after}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (pit_id, search_after) of a token made by `encode_cursor`, raises ValueError if it is malformed
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data['pit'], data['after']
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError('Malformed cursor') from e
+
+
+def log_index(index, log_id):
+    """Monthly log index of `index` holding the log, None for ids saved before they encoded it
+    """
+    match = LOG_ID.match(log_id)
+    return None if match is None else '_'.join((index, match.group(1)))
+
+
+def client_options(config):
+    """Transport options shared by every client built from the application config
+    """
+    return {"maxsize": config.ES_MAX_CONNECTIONS, "timeout": config.ES_TIMEOUT,
+            "sniff_on_start": config.ES_SNIFF_ON_START,
+            "sniff_on_connection_fail": config.ES_SNIFF_ON_CONNECTION_FAIL,
+            "sniffer_timeout": config.ES_SNIFFER_TIMEOUT, "retry_on_timeout": True}
+
+
 class Elasticsearch:
-    def __init__(self, connection_string, index='wiaty'):
-        self.es = ES([connection_string])
+    _shared = None
+    # callables notified with (point_ids, locations) after points were written, locations are (lat, lon) pairs
+    listeners = []
+
+    def __init__(self, connection_string, index='wiaty', **options):
+        self.es = ES([connection_string], **options)
         self.index = index
 
+    @classmethod
+    def open(cls, config=None):
+        """Creates the client shared by all requests handled by this worker
+        """
+        config = DefaultConfig() if config is None else config
+        cls._shared = cls(config.ES_CONNECTION_STRING, index=config.INDEX_NAME, **client_options(config))
+        return cls._shared
+
+    @classmethod
+    def close(cls):
+        if cls._shared is not None:
+            cls._shared.es.close()
+            cls._shared = None
+
     @classmethod
     def connection(cls):
-        config = DefaultConfig()
-        return cls(config.ES_CONNECTION_STRING, index=config.INDEX_NAME)
+        """FastAPI dependency handing out the shared client, opened lazily if startup did not run
+        """
+        if cls._shared is None:
+            cls.open()
+        return cls._shared
 
-    def search_points(self, phrase=None, point_type=None, top_right=None, bottom_left=None, water=None, fire=None,
-                      is_disabled=None, report_reason=None):
+    @staticmethod
+    def _search_points_body(phrase=None, point_type=None, top_right=None, bottom_left=None, water=None, fire=None,
+                            is_disabled=None, report_reason=None, view=None):
         body = {
             "query": {
                 "bool": {
@@ -284,12 +385,13 @@ class Elasticsearch:
             else:
                 add_to_or_create_list(location=body['query']['bool'], name='must_not',
                                       query={"exists": {"field": "report_reason"}})
-        response = self.es.search(index=self.index, body=body)
-        read_points = list(map(Point.from_dict, response['hits']['hits']))
-        out_points = [point.to_dict(with_id=True) for point in read_points]
-        return {'points': out_points}
+        if view == MARKER_VIEW:
+            body['_source'] = MARKER_FIELDS
+        return body
 
-    def get_points(self, top_right: Location, bottom_left: Location, point_type: str=None, is_moderator: bool=False):
+    @staticmethod
+    def _get_points_body(top_right: Location, bottom_left: Location, point_type: str = None, is_moderator: bool = False,
+                         view: str = None):
         body = {
             "query": {
                 "bool": {
@@ -320,18 +422,108 @@ class Elasticsearch:
             for ptype in point_type:
                 add_to_or_create_list(location=body['query']['bool'], name='should',
                                       query={"term": {"type": {"value": ptype}}})
-        response = self.es.search(index=self.index, body=body)
-        read_points = list(map(Point.from_dict, response['hits']['hits']))
-        out_points = [point.to_dict(with_id=True, moderator=is_moderator) for point in read_points]
-        return {'points': out_points}
+        if view == MARKER_VIEW:
+            body['_source'] = MARKER_FIELDS
+        return body
 
-    def get_point(self, point_id, is_moderator=False):
-        response = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=response)
-        return point.to_dict(with_id=True, moderator=is_moderator)
+    @staticmethod
+    def _tiles_body(tiles, zoom, point_type=None, is_moderator=False, view=None):
+        west, south, east, north = tile_cache.bbox_of_tiles(tiles, zoom)
+        return Elasticsearch._get_points_body(Location(lat=str(north), lon=str(east)),
+                                              Location(lat=str(south), lon=str(west)), point_type, is_moderator,
+                                              view=view)
 
-    def get_unpublished(self, size=25, offset=0):
-        body = {
+    @staticmethod
+    def _clusters_body(top_right: Location, bottom_left: Location, precision: int, point_type: str = None,
+                       is_moderator: bool = False):
+        body = Elasticsearch._get_points_body(top_right, bottom_left, point_type, is_moderator)
+        body['size'] = 0
+        body['aggs'] = {
+            "clusters": {
+                "geotile_grid": {
+                    "field": "location",
+                    "precision": precision,
+                    "size": 10000
+                },
+                "aggs": {
+                    "centroid": {"geo_centroid": {"field": "location"}},
+                    "types": {"terms": {"field": "type", "size": 50}}
+                }
+            }
+        }
+        return body
+
+    @staticmethod
+    def _clusters_result(response):
+        clusters = []
+        for bucket in response['aggregations']['clusters']['buckets']:
+            centroid = bucket['centroid']['location']
+            clusters.append({"key": bucket['key'], "count": bucket['doc_count'],
+                             "location": {"lat": str(centroid['lat']), "lon": str(centroid['lon'])},
+                             "types": {ptype['key']: ptype['doc_count'] for ptype in bucket['types']['buckets']}})
+        return {'clusters': clusters}
+
+    @staticmethod
+    def _tile_body(z, x, y, size=9000):
+        west, south, east, north = mvt.tile_bounds(z, x, y)
+        body = Elasticsearch._get_points_body(top_right=Location(lat=str(north), lon=str(east)),
+                                              bottom_left=Location(lat=str(south), lon=str(west)))
+        body['size'] = size
+        body['_source'] = ["location", "type", "name", "water_exists", "fire_exists"]
+        return body
+
+    @staticmethod
+    def _tile_result(response, z, x, y):
+        features = []
+        for hit in response['hits']['hits']:
+            source = hit['_source']
+            features.append((source['location']['lat'], source['location']['lon'],
+                             {"id": hit['_id'], "type": source.get('type'), "name": source.get('name'),
+                              "water_exists": source.get('water_exists'), "fire_exists": source.get('fire_exists')}))
+        return mvt.encode_layer('points', features, z, x, y)
+
+    @staticmethod
+    def _points_result(response, is_moderator=False, view=None):
+        if view == MARKER_VIEW:
+            return {'points': [marker_from_hit(hit, moderator=is_moderator) for hit in response['hits']['hits']]}
+        return {'points': [point_from_hit(hit, with_id=True, moderator=is_moderator)
+                           for hit in response['hits']['hits']]}
+
+    @staticmethod
+    def _page_body(body, pit_id, page_size, search_after=None, keep_alive='1m'):
+        # a search over a point in time must not name the index, _shard_doc is the cheapest unique tiebreaker
+        sort = body.get('sort')
+        if sort is None:
+            # without an explicit sort a scored query keeps its relevance order, the tiebreaker only orders ties
+            query = body.get('query', {}).get('bool', {})
+            sort = [{"_score": "desc"}] if query.get('must') or query.get('should') else []
+        body = dict(body, size=page_size, pit={"id": pit_id, "keep_alive": keep_alive},
+                    sort=sort + [{"_shard_doc": "asc"}])
+        body.pop('from', None)
+        if search_after is not None:
+            body['search_after'] = search_after
+        return body
+
+    @staticmethod
+    def _page_cursor(response, page_size):
+        hits = response['hits']['hits']
+        if len(hits) < page_size:
+            return None
+        return encode_cursor(response['pit_id'], hits[-1]['sort'])
+
+    @staticmethod
+    def _mget_result(response, is_moderator=False):
+        points, missing = [], []
+        for doc in response['docs']:
+            if doc.get('found'):
+                points.append(point_from_hit(doc, with_id=True, moderator=is_moderator))
+            else:
+                missing.append(doc['_id'])
+        return {"points": points, "missing": missing}
+
+    @staticmethod
+    def _unpublished_body(size=25, offset=0):
+        return {
             "query": {
                 "term": {
                     "unpublished": True
@@ -342,13 +534,10 @@ class Elasticsearch:
             "from": offset,
             "size": size
         }
-        response = self.es.search(index=self.index, body=body)
-        read_points = list(map(Point.from_dict, response['hits']['hits']))
-        out_points = [point.to_dict(with_id=True) for point in read_points]
-        return {'points': out_points}
 
-    def get_user_logs(self, user, size=25, offset=0):
-        body = {
+    @staticmethod
+    def _user_logs_body(user, size=25, offset=0):
+        return {
             "query": {
                 'term': {
                     'modified_by.keyword':
@@ -360,10 +549,9 @@ class Elasticsearch:
             "from": offset,
             "size": size
         }
-        response = self.es.search(index=self.index + '_*', body=body)
-        return {"logs": response['hits']['hits'], "total": response['hits']['total']['value']}
 
-    def get_logs(self, point_id=None, size=25, offset=0, reviewed_at=None):
+    @staticmethod
+    def _logs_body(point_id=None, size=25, offset=0, reviewed_at=None):
         body = {"query": {"bool": {}}, "sort": [{"timestamp": {"order": "desc"}}], "from": offset, "size": size}
         if point_id is not None:
             add_to_or_create_list(location=body['query']['bool'], name='filter',
@@ -375,13 +563,15 @@ class Elasticsearch:
             else:
                 add_to_or_create_list(location=body['query']['bool'], name='must_not',
                                       query={"exists": {"field": "reviewed_at"}})
-        response = self.es.search(index=self.index + '_*', body=body)
+        return body
+
+    @staticmethod
+    def _logs_result(response):
         return {"logs": response['hits']['hits'], "total": response['hits']['total']['value']}
-    
-    def get_user_wrapped(self, user):
-        year = str(datetime.today().year-1)
-        index = self.index + '_*_' + year
-        body = {
+
+    @staticmethod
+    def _wrapped_body():
+        return {
             "aggs":{
                 "all_modifications":{
                     "terms":{
@@ -429,7 +619,9 @@ class Elasticsearch:
             },
             "size": 0
         }
-        response = self.es.search(index=index, body=body)
+
+    @staticmethod
+    def _wrapped_result(response, user, year):
         try:
             user_total = response["aggregations"]["user"]["doc_count"]
             user_created = response["aggregations"]["user"]["created"]["doc_count"]
@@ -451,21 +643,240 @@ class Elasticsearch:
         except KeyError:
             return None
 
+    @staticmethod
+    def _report_body(report_reason, append=False):
+        if append:
+            source = "if (ctx._source.report_reason instanceof List) { ctx._source.report_reason.add(params.reason) }" \
+                     " else { ctx._source.report_reason = [params.reason] }"
+        else:
+            source = "ctx._source.report_reason = params.reason == null ? null : [params.reason]"
+        return {"script": {"source": source, "lang": "painless", "params": {"reason": report_reason}}}
+
+    @staticmethod
+    def _add_image_body(path, sub):
+        image = {"name": path, "created_timestamp": datetime.utcnow().strftime("%s"), "created_by": sub}
+        # names are content hashes, attaching the same image again leaves the point alone
+        return {"script": {"source": "if (ctx._source.images == null) { ctx._source.images = [params.image] }"
+                                     " else if (ctx._source.images.any(image -> image.name == params.image.name))"
+                                     " { ctx.op = 'none' }"
+                                     " else { ctx._source.images.add(params.image) }",
+                           "lang": "painless", "params": {"image": image}}}
+
+    @staticmethod
+    def _delete_image_body(image_name):
+        return {"script": {"source": "if (ctx._source.images == null"
+                                     " || !ctx._source.images.removeIf(image -> image.name == params.name))"
+                                     " { ctx.op = 'none' }",
+                           "lang": "painless", "params": {"name": image_name}}}
+
+    @staticmethod
+    def _export_line(hit):
+        return (json.dumps(dict(hit['_source'], id=hit['_id']), ensure_ascii=False) + '\n').encode()
+
+    @staticmethod
+    def _import_action(index, line):
+        document = json.loads(line)
+        # bulk results are matched to their lines by id, as retried items come back after the rest of their chunk
+        point_id = document.pop('id', None) or uuid4().hex
+        point = Point.from_dict(body={"_id": point_id, "_source": document})
+        return {"_index": index, "_id": point_id, "_source": point.to_index()}, (point.lat, point.lon)
+
+    @staticmethod
+    def _import_pending(pending, response, batch):
+        """Records the line number and the old and new locations of every action in `batch`
+
+        `response` is the mget of the batch ids, a replaced point has to leave the tiles of its old location too.
+        """
+        old = {doc['_id']: Elasticsearch._location(doc['_source']) for doc in response['docs'] if doc.get('found')}
+        for action, number, location in batch:
+            old_location = (old[action['_id']],) if action['_id'] in old else ()
+            pending.setdefault(action['_id'], deque()).append((number, old_location + (location,)))
+            yield action
+
+    @staticmethod
+    def _import_result(pending, point_id):
+        entries = pending[point_id]
+        number, locations = entries.popleft()
+        if not entries:
+            del pending[point_id]
+        return number, locations
+
+    @staticmethod
+    def _location(source):
+        return source['location']['lat'], source['location']['lon']
+
+    @staticmethod
+    def _reviewed_body(user):
+        return {"doc": {"reviewed_at": datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S"),
+                        "reviewed_by": user}}
+
+    @staticmethod
+    def _written(res, read):
+        """Whether a write conditional on the `_seq_no` of the `read` document went through
+        """
+        # ES gives every operation on a shard a higher sequence number, an applied write moves the document past it
+        return res['result'] == 'updated' and res['_seq_no'] > read['_seq_no']
+
+    def _changed(self, point_id, *locations):
+        self._changed_many([point_id], locations)
+
+    def _changed_many(self, point_ids, locations):
+        # the points are written already, a failing listener must not fail the request
+        for listener in self.listeners:
+            try:
+                listener(point_ids, tuple(locations))
+            except Exception:
+                logger.exception('listener %r failed for %d points', listener, len(point_ids))
+
+    def _log_entry(self, user_sub, doc_id, name, changed):
+        document = {"modified_by": user_sub, "doc_id": doc_id, "changes": changed,
+                    "timestamp": datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S"), "name": name}
+        month = datetime.today().strftime('%m_%Y')
+        return '_'.join((self.index, month)), '-'.join((month, uuid4().hex)), document
+
+    def _search_after(self, index, body, page_size, cursor=None, keep_alive='1m'):
+        """Searches one page of `body` over a point in time of `index`, opened when there is no `cursor` yet
+
+        Returns the response and the cursor of the next page, None on the last one, whose point in time is closed.
+        Point in time searches and the `_shard_doc` sort need an Elasticsearch 7.12 or newer server.
+        """
+        if cursor is None:
+            pit_id, search_after = self.es.open_point_in_time(index=index, keep_alive=keep_alive)['id'], None
+        else:
+            pit_id, search_after = decode_cursor(cursor)
+        response = self.es.search(body=self._page_body(body, pit_id, page_size, search_after, keep_alive))
+        next_cursor = self._page_cursor(response, page_size)
+        if next_cursor is None:
+            self.es.close_point_in_time(body={"id": response.get('pit_id', pit_id)})
+        return response, next_cursor
+
+    def _search_page(self, body, page_size, cursor=None, keep_alive='1m', is_moderator=False, view=None):
+        response, next_cursor = self._search_after(self.index, body, page_size, cursor=cursor, keep_alive=keep_alive)
+        return dict(self._points_result(response, is_moderator=is_moderator, view=view), cursor=next_cursor)
+
+    def search_points(self, phrase=None, point_type=None, top_right=None, bottom_left=None, water=None, fire=None,
+                      is_disabled=None, report_reason=None, view=None, page_size=None, cursor=None, keep_alive='1m'):
+        """
+        With `page_size` or `cursor` set, results are paged, see `_search_page`.
+        """
+        body = self._search_points_body(phrase=phrase, point_type=point_type, top_right=top_right,
+                                        bottom_left=bottom_left, water=water, fire=fire, is_disabled=is_disabled,
+                                        report_reason=report_reason, view=view)
+        if page_size is not None or cursor is not None:
+            return self._search_page(body, page_size or DEFAULT_PAGE_SIZE, cursor=cursor, keep_alive=keep_alive,
+                                     view=view)
+        response = self.es.search(index=self.index, body=body)
+        return self._points_result(response, view=view)
+
+    def get_points(self, top_right: Location, bottom_left: Location, point_type: str = None, is_moderator: bool = False,
+                   tile_zoom: int = None, max_tiles: int = 64, view: str = None, page_size: int = None,
+                   cursor: str = None, keep_alive: str = '1m'):
+        """
+        With `view` set to `MARKER_VIEW` only the fields needed to draw markers are fetched and returned.
+        With `page_size` or `cursor` set, results are paged straight from Elasticsearch, see `_search_page`.
+        Otherwise, if `tile_zoom` is set and the viewport spans at most `max_tiles` tiles of that zoom, the result is
+        stitched from `tile_cache`, and only the tiles missing there are fetched from Elasticsearch.
+        """
+        if page_size is not None or cursor is not None:
+            body = self._get_points_body(top_right, bottom_left, point_type, is_moderator, view=view)
+            return self._search_page(body, page_size or DEFAULT_PAGE_SIZE, cursor=cursor, keep_alive=keep_alive,
+                                     is_moderator=is_moderator, view=view)
+        tiles = [] if tile_zoom is None else tile_cache.tiles_for_bbox(top_right, bottom_left, tile_zoom,
+                                                                       max_tiles=max_tiles)
+        if not tiles:
+            body = self._get_points_body(top_right, bottom_left, point_type, is_moderator, view=view)
+            response = self.es.search(index=self.index, body=body)
+            return self._points_result(response, is_moderator=is_moderator, view=view)
+        cached, missing, versions = tile_cache.lookup(tiles, tile_zoom, point_type, is_moderator, view=view)
+        if missing:
+            body = self._tiles_body(missing, tile_zoom, point_type, is_moderator, view=view)
+            response = self.es.search(index=self.index, body=body)
+            fetched = tile_cache.bucket(self._points_result(response, is_moderator, view=view)['points'], missing,
+                                        tile_zoom)
+            if len(response['hits']['hits']) < body['size']:
+                tile_cache.store(fetched, versions, tile_zoom, point_type, is_moderator, view=view)
+            cached.update(fetched)
+        return {'points': tile_cache.clip(cached.values(), top_right, bottom_left)}
+
+    def get_clusters(self, top_right: Location, bottom_left: Location, precision: int, point_type: str = None,
+                     is_moderator: bool = False):
+        body = self._clusters_body(top_right, bottom_left, precision, point_type, is_moderator)
+        response = self.es.search(index=self.index, body=body)
+        return self._clusters_result(response)
+
+    def get_tile(self, z, x, y, size=9000):
+        """Returns published points of web mercator tile z/x/y encoded as a Mapbox Vector Tile
+        """
+        response = self.es.search(index=self.index, body=self._tile_body(z, x, y, size=size))
+        return self._tile_result(response, z, x, y)
+
+    def get_point(self, point_id, is_moderator=False):
+        response = self.es.get(index=self.index, id=point_id)
+        return point_from_hit(response, with_id=True, moderator=is_moderator)
+
+    def get_points_by_ids(self, point_ids, is_moderator=False):
+        """Serializes the points like `get_point`, in the order of `point_ids`, and lists the ids not found
+        """
+        if not point_ids:
+            return {"points": [], "missing": []}
+        response = self.es.mget(index=self.index, body={"ids": point_ids})
+        return self._mget_result(response, is_moderator=is_moderator)
+
+    def get_unpublished(self, size=25, offset=0):
+        response = self.es.search(index=self.index, body=self._unpublished_body(size=size, offset=offset))
+        return self._points_result(response)
+
+    def _logs_page(self, body, size, cursor, keep_alive):
+        response, next_cursor = self._search_after(self.index + '_*', body, size, cursor=cursor or None,
+                                                   keep_alive=keep_alive)
+        return dict(self._logs_result(response), cursor=next_cursor)
+
+    def get_user_logs(self, user, size=25, offset=0, cursor=None, keep_alive='1m'):
+        """
+        With `cursor` set, `offset` is ignored and logs are paged over a point in time, an empty `cursor` starts from
+        the newest log. The result carries the `cursor` of the next page, None on the last one.
+        """
+        body = self._user_logs_body(user, size=size, offset=offset)
+        if cursor is not None:
+            return self._logs_page(body, size, cursor, keep_alive)
+        response = self.es.search(index=self.index + '_*', body=body)
+        return self._logs_result(response)
+
+    def get_logs(self, point_id=None, size=25, offset=0, reviewed_at=None, cursor=None, keep_alive='1m'):
+        """
+        `cursor` pages like in `get_user_logs`.
+        """
+        body = self._logs_body(point_id=point_id, size=size, offset=offset, reviewed_at=reviewed_at)
+        if cursor is not None:
+            return self._logs_page(body, size, cursor, keep_alive)
+        response = self.es.search(index=self.index + '_*', body=body)
+        return self._logs_result(response)
+
+    def get_user_wrapped(self, user):
+        year = str(datetime.today().year-1)
+        index = self.index + '_*_' + year
+        response = self.es.search(index=index, body=self._wrapped_body())
+        return self._wrapped_result(response, user, year)
+
     def _get_raw_log(self, log_id):
+        # searches every monthly log index, only needed for ids which do not encode theirs
         body = {"query": {"term": {"_id": log_id}}}
         response = self.es.search(index=self.index + '_*', body=body)
         return response
 
     def get_log(self, log_id):
+        index = log_index(self.index, log_id)
+        if index is not None:
+            return self.es.get(index=index, id=log_id)['_source']
         response = self._get_raw_log(log_id)
         return response['hits']['hits'][0]['_source']
 
     def log_reviewed(self, log_id, user):
-        raw_log = self._get_raw_log(log_id=log_id)
-        log_index = raw_log['hits']['hits'][0]['_index']
-        body = {"doc": {"reviewed_at": datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S"),
-                        "reviewed_by": user}}
-        response = self.es.update(index=log_index, id=log_id, body=body, _source=True)
+        index = log_index(self.index, log_id)
+        if index is None:
+            raw_log = self._get_raw_log(log_id=log_id)
+            index = raw_log['hits']['hits'][0]['_index']
+        response = self.es.update(index=index, id=log_id, body=self._reviewed_body(user), _source=True)
         if response['result'] == 'updated':
             return response['get']['_source']
         return False
@@ -473,34 +884,46 @@ class Elasticsearch:
     def modify_point(self, point_id, user_sub, name, description, directions, lat, lon,
                      point_type, water_exists, fire_exists, water_comment, fire_comment, is_disabled, unpublished,
                      is_moderator=False):
-        body = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=body)
-        changes = point.modify(name=name, description=description, directions=directions, lat=lat, lon=lon,
-                               point_type=point_type, water_exists=water_exists, water_comment=water_comment,
-                               fire_exists=fire_exists, fire_comment=fire_comment, is_disabled=is_disabled,
-                               unpublished=unpublished, user_sub=user_sub)
-        res = self.es.index(index=self.index, id=point_id, body=point.to_index())
-        if res['result'] == 'updated':
+        """
+        The point is written back only if nobody changed it since it was read, otherwise the changes are applied
+        again to the fresh document, at most `CONFLICT_RETRIES` times.
+        """
+        for attempt in range(CONFLICT_RETRIES):
+            body = self.es.get(index=self.index, id=point_id)
+            point = Point.from_dict(body=body)
+            old_location = (point.lat, point.lon)
+            changes = point.modify(name=name, description=description, directions=directions, lat=lat, lon=lon,
+                                   point_type=point_type, water_exists=water_exists, water_comment=water_comment,
+                                   fire_exists=fire_exists, fire_comment=fire_comment, is_disabled=is_disabled,
+                                   unpublished=unpublished, user_sub=user_sub)
+            try:
+                res = self.es.index(index=self.index, id=point_id, body=point.to_index(), if_seq_no=body['_seq_no'],
+                                    if_primary_term=body['_primary_term'])
+                break
+            except ConflictError:
+                if attempt == CONFLICT_RETRIES - 1:
+                    raise
+        if self._written(res, body):
             if changes != {}:
                 self.save_log(user_sub=user_sub, doc_id=point_id, name=point.name, changed=changes)
-            return self.get_point(point_id=point_id, is_moderator=is_moderator)
+            self._changed(point_id, old_location, (point.lat, point.lon))
+            return point.to_dict(with_id=True, moderator=is_moderator)
         return res
 
-    def report_moderator(self, point_id, report_reason):
-        body = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=body)
-        point.report_reason_replace(report_reason=report_reason)
-        res = self.es.index(index=self.index, id=point_id, body=point.to_index())
-        if res['result'] == 'updated':
+    def _report(self, point_id, report_reason, append):
+        res = self.es.update(index=self.index, id=point_id, body=self._report_body(report_reason, append=append),
+                             retry_on_conflict=CONFLICT_RETRIES, _source_includes=['location'])
+        if res['result'] in ('updated', 'noop'):
+            self._changed(point_id, self._location(res['get']['_source']))
             return True
 
+    def report_moderator(self, point_id, report_reason):
+        """Replaces the report reasons of the point with `report_reason`, None clears them
+        """
+        return self._report(point_id, report_reason, append=False)
+
     def report_regular(self, point_id, report_reason):
-        body = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=body)
-        point.report_reason_append(report_reason=report_reason)
-        res = self.es.index(index=self.index, id=point_id, body=point.to_index())
-        if res['result'] == 'updated':
-            return True
+        return self._report(point_id, report_reason, append=True)
 
     def add_point(self, name, description, directions, lat, lon, type, user_sub, water_exists=None,
                   fire_exists=None, water_comment=None, fire_comment=None, is_disabled=False, is_moderator=False):
@@ -511,42 +934,421 @@ class Elasticsearch:
         res = self.es.index(index=self.index, body=point.to_index())
         if res['result'] == 'created':
             self.save_log(user_sub=user_sub, doc_id=res['_id'], name=point.name, changed={"action": "created"})
-            return self.get_point(point_id=res['_id'], is_moderator=is_moderator)
+            self._changed(res['_id'], (point.lat, point.lon))
+            point.doc_id = res['_id']
+            return point.to_dict(with_id=True, moderator=is_moderator)
         return res
 
     def delete_point(self, point_id):
+        locations = []
+        if self.listeners:
+            source = self.es.get(index=self.index, id=point_id, _source_includes=['location'])['_source']
+            locations.append((source['location']['lat'], source['location']['lon']))
         res = self.es.delete(index=self.index, id=point_id)
         if res['result'] == 'deleted':
+            self._changed(point_id, *locations)
             return
         raise Exception("Can't delete point")
 
     def add_image(self, point_id, path, sub):
-        body = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=body)
-        images = point.images
-        if images is None:
-            images = []
-        new_image = {"name": path, "created_timestamp": datetime.utcnow().strftime("%s"), "created_by": sub}
-        images.append(new_image)
-        res = self.es.update(index=self.index, id=point_id, body={"doc": {"images": images}})
+        res = self.es.update(index=self.index, id=point_id, body=self._add_image_body(path, sub),
+                             retry_on_conflict=CONFLICT_RETRIES, _source=True)
+        if res['result'] == 'noop':
+            return point_from_hit({"_id": point_id, "_source": res['get']['_source']}, with_id=True)
         if res['result'] == 'updated':
-            self.save_log(user_sub=sub, doc_id=point_id, name=point.name, changed={"images": {"old_value": None,
-                                                                                              "new_value": path}})
-            return self.get_point(point_id=point_id)
+            source = res['get']['_source']
+            self.save_log(user_sub=sub, doc_id=point_id, name=source['name'], changed={"images": {"old_value": None,
+                                                                                                  "new_value": path}})
+            self._changed(point_id, self._location(source))
+            return point_from_hit({"_id": point_id, "_source": source}, with_id=True)
         return res
 
     def delete_image(self, point_id, image_name, sub):
-        body = self.es.get(index=self.index, id=point_id)
-        point = Point.from_dict(body=body)
-        new_images = [image for image in point.images if image['name'] != image_name]
-        res = self.es.update(index=self.index, id=point_id, body={"doc": {"images": new_images}})
+        res = self.es.update(index=self.index, id=point_id, body=self._delete_image_body(image_name),
+                             retry_on_conflict=CONFLICT_RETRIES, _source=True)
         if res['result'] == 'updated':
-            self.save_log(user_sub=sub, doc_id=point_id, name=point.name, changed={"images": {"old_value": image_name,
-                                                                                              "new_value": None}})
-            return self.get_point(point_id=point_id)
+            source = res['get']['_source']
+            self.save_log(user_sub=sub, doc_id=point_id, name=source['name'],
+                          changed={"images": {"old_value": image_name, "new_value": None}})
+            self._changed(point_id, self._location(source))
+            return point_from_hit({"_id": point_id, "_source": source}, with_id=True)
         return res
 
+    def export_points(self, page_size=DEFAULT_PAGE_SIZE, keep_alive='1m'):
+        """Yields every point, published or not, as a NDJSON line in the shape `import_points` reads
+        """
+        cursor = None
+        while True:
+            response, cursor = self._search_after(self.index, {"query": {"match_all": {}}}, page_size, cursor=cursor,
+                                                  keep_alive=keep_alive)
+            for hit in response['hits']['hits']:
+                yield self._export_line(hit)
+            if cursor is None:
+                return
+
+    def import_points(self, lines, chunk_size=500):
+        """Indexes points read from NDJSON `lines`, each one in the `Point.to_index` shape with an optional `id`
+
+        Yields a report for every `chunk_size` lines: the number of points indexed and the errors by line number.
+        """
+        pending = {}
+        report = {"indexed": 0, "errors": []}
+
+        def with_old_locations(batch):
+            response = self.es.mget(index=self.index, body={"ids": [action['_id'] for action, _, _ in batch]},
+                                    _source_includes=['location'])
+            return self._import_pending(pending, response, batch)
+
+        def actions():
+            batch = []
+            for number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    action, location = self._import_action(self.index, line)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    report['errors'].append({"line": number, "error": repr(e)})
+                    continue
+                batch.append((action, number, location))
+                if len(batch) == chunk_size:
+                    yield from with_old_locations(batch)
+                    batch = []
+            if batch:
+                yield from with_old_locations(batch)
+
+        changed_ids, changed_locations = [], []
+        for ok, item in helpers.streaming_bulk(self.es, actions(), chunk_size=chunk_size, max_retries=2,
+                                               raise_on_error=False, raise_on_exception=False):
+            result = next(iter(item.values()))
+            number, locations = self._import_result(pending, result['_id'])
+            if ok:
+                report['indexed'] += 1
+                changed_ids.append(result['_id'])
+                changed_locations.extend(locations)
+            else:
+                report['errors'].append({"line": number, "error": result.get('error')})
+            if report['indexed'] + len(report['errors']) >= chunk_size:
+                # listeners hear about the chunk at once rather than once per point
+                self._changed_many(changed_ids, changed_locations)
+                changed_ids, changed_locations = [], []
+                yield report
+                report = {"indexed": 0, "errors": []}
+        if changed_ids:
+            self._changed_many(changed_ids, changed_locations)
+        if report['indexed'] or report['errors']:
+            yield report
+
     def save_log(self, user_sub, doc_id, name, changed):
-        document = {"modified_by": user_sub, "doc_id": doc_id, "changes": changed,
-                    "timestamp": datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S"), "name": name}
-        self.es.index(index=''.join((self.index, datetime.today().strftime('_%m_%Y'))), body=document)
+        index, log_id, document = self._log_entry(user_sub=user_sub, doc_id=doc_id, name=name, changed=changed)
+        if not log_sink.put(index, log_id, document):
+            self.es.index(index=index, id=log_id, body=document)
+
+
+class AsyncElasticsearch(Elasticsearch):
+    """Same interface as `Elasticsearch`, backed by the asyncio transport so routers can await every call
+    """
+    _shared = None
+
+    def __init__(self, connection_string, index='wiaty', **options):
+        self.es = AsyncES([connection_string], **options)
+        self.index = index
+
+    @classmethod
+    async def close(cls):
+        if cls._shared is not None:
+            await cls._shared.es.close()
+            cls._shared = None
+
+    @staticmethod
+    async def _in_executor(func, *args, **kwargs):
+        # Redis and listener calls are blocking, keep them off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def _changed(self, point_id, *locations):
+        await self._changed_many([point_id], locations)
+
+    async def _changed_many(self, point_ids, locations):
+        if self.listeners:
+            await self._in_executor(Elasticsearch._changed_many, self, point_ids, locations)
+
+    async def _search_after(self, index, body, page_size, cursor=None, keep_alive='1m'):
+        if cursor is None:
+            pit = await self.es.open_point_in_time(index=index, keep_alive=keep_alive)
+            pit_id, search_after = pit['id'], None
+        else:
+            pit_id, search_after = decode_cursor(cursor)
+        response = await self.es.search(body=self._page_body(body, pit_id, page_size, search_after, keep_alive))
+        next_cursor = self._page_cursor(response, page_size)
+        if next_cursor is None:
+            await self.es.close_point_in_time(body={"id": response.get('pit_id', pit_id)})
+        return response, next_cursor
+
+    async def _search_page(self, body, page_size, cursor=None, keep_alive='1m', is_moderator=False, view=None):
+        response, next_cursor = await self._search_after(self.index, body, page_size, cursor=cursor,
+                                                         keep_alive=keep_alive)
+        return dict(self._points_result(response, is_moderator=is_moderator, view=view), cursor=next_cursor)
+
+    async def search_points(self, phrase=None, point_type=None, top_right=None, bottom_left=None, water=None,
+                            fire=None, is_disabled=None, report_reason=None, view=None, page_size=None, cursor=None,
+                            keep_alive='1m'):
+        body = self._search_points_body(phrase=phrase, point_type=point_type, top_right=top_right,
+                                        bottom_left=bottom_left, water=water, fire=fire, is_disabled=is_disabled,
+                                        report_reason=report_reason, view=view)
+        if page_size is not None or cursor is not None:
+            return await self._search_page(body, page_size or DEFAULT_PAGE_SIZE, cursor=cursor, keep_alive=keep_alive,
+                                           view=view)
+        response = await self.es.search(index=self.index, body=body)
+        return self._points_result(response, view=view)
+
+    async def get_points(self, top_right: Location, bottom_left: Location, point_type: str = None,
+                         is_moderator: bool = False, tile_zoom: int = None, max_tiles: int = 64, view: str = None,
+                         page_size: int = None, cursor: str = None, keep_alive: str = '1m'):
+        if page_size is not None or cursor is not None:
+            body = self._get_points_body(top_right, bottom_left, point_type, is_moderator, view=view)
+            return await self._search_page(body, page_size or DEFAULT_PAGE_SIZE, cursor=cursor,
+                                           keep_alive=keep_alive, is_moderator=is_moderator, view=view)
+        tiles = [] if tile_zoom is None else tile_cache.tiles_for_bbox(top_right, bottom_left, tile_zoom,
+                                                                       max_tiles=max_tiles)
+        if not tiles:
+            body = self._get_points_body(top_right, bottom_left, point_type, is_moderator, view=view)
+            response = await self.es.search(index=self.index, body=body)
+            return self._points_result(response, is_moderator=is_moderator, view=view)
+        cached, missing, versions = await self._in_executor(tile_cache.lookup, tiles, tile_zoom, point_type,
+                                                            is_moderator, view=view)
+        if missing:
+            body = self._tiles_body(missing, tile_zoom, point_type, is_moderator, view=view)
+            response = await self.es.search(index=self.index, body=body)
+            fetched = tile_cache.bucket(self._points_result(response, is_moderator, view=view)['points'], missing,
+                                        tile_zoom)
+            if len(response['hits']['hits']) < body['size']:
+                await self._in_executor(tile_cache.store, fetched, versions, tile_zoom, point_type, is_moderator,
+                                        view=view)
+            cached.update(fetched)
+        return {'points': tile_cache.clip(cached.values(), top_right, bottom_left)}
+
+    async def get_clusters(self, top_right: Location, bottom_left: Location, precision: int, point_type: str = None,
+                           is_moderator: bool = False):
+        body = self._clusters_body(top_right, bottom_left, precision, point_type, is_moderator)
+        response = await self.es.search(index=self.index, body=body)
+        return self._clusters_result(response)
+
+    async def get_tile(self, z, x, y, size=9000):
+        response = await self.es.search(index=self.index, body=self._tile_body(z, x, y, size=size))
+        return self._tile_result(response, z, x, y)
+
+    async def get_point(self, point_id, is_moderator=False):
+        response = await self.es.get(index=self.index, id=point_id)
+        return point_from_hit(response, with_id=True, moderator=is_moderator)
+
+    async def get_points_by_ids(self, point_ids, is_moderator=False):
+        if not point_ids:
+            return {"points": [], "missing": []}
+        response = await self.es.mget(index=self.index, body={"ids": point_ids})
+        return self._mget_result(response, is_moderator=is_moderator)
+
+    async def get_unpublished(self, size=25, offset=0):
+        response = await self.es.search(index=self.index, body=self._unpublished_body(size=size, offset=offset))
+        return self._points_result(response)
+
+    async def _logs_page(self, body, size, cursor, keep_alive):
+        response, next_cursor = await self._search_after(self.index + '_*', body, size, cursor=cursor or None,
+                                                         keep_alive=keep_alive)
+        return dict(self._logs_result(response), cursor=next_cursor)
+
+    async def get_user_logs(self, user, size=25, offset=0, cursor=None, keep_alive='1m'):
+        body = self._user_logs_body(user, size=size, offset=offset)
+        if cursor is not None:
+            return await self._logs_page(body, size, cursor, keep_alive)
+        response = await self.es.search(index=self.index + '_*', body=body)
+        return self._logs_result(response)
+
+    async def get_logs(self, point_id=None, size=25, offset=0, reviewed_at=None, cursor=None, keep_alive='1m'):
+        body = self._logs_body(point_id=point_id, size=size, offset=offset, reviewed_at=reviewed_at)
+        if cursor is not None:
+            return await self._logs_page(body, size, cursor, keep_alive)
+        response = await self.es.search(index=self.index + '_*', body=body)
+        return self._logs_result(response)
+
+    async def get_user_wrapped(self, user):
+        year = str(datetime.today().year-1)
+        index = self.index + '_*_' + year
+        response = await self.es.search(index=index, body=self._wrapped_body())
+        return self._wrapped_result(response, user, year)
+
+    async def _get_raw_log(self, log_id):
+        body = {"query": {"term": {"_id": log_id}}}
+        return await self.es.search(index=self.index + '_*', body=body)
+
+    async def get_log(self, log_id):
+        index = log_index(self.index, log_id)
+        if index is not None:
+            return (await self.es.get(index=index, id=log_id))['_source']
+        response = await self._get_raw_log(log_id)
+        return response['hits']['hits'][0]['_source']
+
+    async def log_reviewed(self, log_id, user):
+        index = log_index(self.index, log_id)
+        if index is None:
+            raw_log = await self._get_raw_log(log_id=log_id)
+            index = raw_log['hits']['hits'][0]['_index']
+        response = await self.es.update(index=index, id=log_id, body=self._reviewed_body(user), _source=True)
+        if response['result'] == 'updated':
+            return response['get']['_source']
+        return False
+
+    async def modify_point(self, point_id, user_sub, name, description, directions, lat, lon,
+                           point_type, water_exists, fire_exists, water_comment, fire_comment, is_disabled,
+                           unpublished, is_moderator=False):
+        for attempt in range(CONFLICT_RETRIES):
+            body = await self.es.get(index=self.index, id=point_id)
+            point = Point.from_dict(body=body)
+            old_location = (point.lat, point.lon)
+            changes = point.modify(name=name, description=description, directions=directions, lat=lat, lon=lon,
+                                   point_type=point_type, water_exists=water_exists, water_comment=water_comment,
+                                   fire_exists=fire_exists, fire_comment=fire_comment, is_disabled=is_disabled,
+                                   unpublished=unpublished, user_sub=user_sub)
+            try:
+                res = await self.es.index(index=self.index, id=point_id, body=point.to_index(),
+                                          if_seq_no=body['_seq_no'], if_primary_term=body['_primary_term'])
+                break
+            except ConflictError:
+                if attempt == CONFLICT_RETRIES - 1:
+                    raise
+        if self._written(res, body):
+            if changes != {}:
+                await self.save_log(user_sub=user_sub, doc_id=point_id, name=point.name, changed=changes)
+            await self._changed(point_id, old_location, (point.lat, point.lon))
+            return point.to_dict(with_id=True, moderator=is_moderator)
+        return res
+
+    async def _report(self, point_id, report_reason, append):
+        res = await self.es.update(index=self.index, id=point_id,
+                                   body=self._report_body(report_reason, append=append),
+                                   retry_on_conflict=CONFLICT_RETRIES, _source_includes=['location'])
+        if res['result'] in ('updated', 'noop'):
+            await self._changed(point_id, self._location(res['get']['_source']))
+            return True
+
+    async def report_moderator(self, point_id, report_reason):
+        return await self._report(point_id, report_reason, append=False)
+
+    async def report_regular(self, point_id, report_reason):
+        return await self._report(point_id, report_reason, append=True)
+
+    async def add_point(self, name, description, directions, lat, lon, type, user_sub, water_exists=None,
+                        fire_exists=None, water_comment=None, fire_comment=None, is_disabled=False,
+                        is_moderator=False):
+        point = Point.new_point(name=name, description=description, directions=directions, lat=lat,
+                                lon=lon, point_type=type, water_exists=water_exists, water_comment=water_comment,
+                                fire_exists=fire_exists, fire_comment=fire_comment, is_disabled=is_disabled,
+                                user_sub=user_sub)
+        res = await self.es.index(index=self.index, body=point.to_index())
+        if res['result'] == 'created':
+            await self.save_log(user_sub=user_sub, doc_id=res['_id'], name=point.name, changed={"action": "created"})
+            await self._changed(res['_id'], (point.lat, point.lon))
+            point.doc_id = res['_id']
+            return point.to_dict(with_id=True, moderator=is_moderator)
+        return res
+
+    async def delete_point(self, point_id):
+        locations = []
+        if self.listeners:
+            response = await self.es.get(index=self.index, id=point_id, _source_includes=['location'])
+            locations.append((response['_source']['location']['lat'], response['_source']['location']['lon']))
+        res = await self.es.delete(index=self.index, id=point_id)
+        if res['result'] == 'deleted':
+            await self._changed(point_id, *locations)
+            return
+        raise Exception("Can't delete point")
+
+    async def add_image(self, point_id, path, sub):
+        res = await self.es.update(index=self.index, id=point_id, body=self._add_image_body(path, sub),
+                                   retry_on_conflict=CONFLICT_RETRIES, _source=True)
+        if res['result'] == 'noop':
+            return point_from_hit({"_id": point_id, "_source": res['get']['_source']}, with_id=True)
+        if res['result'] == 'updated':
+            source = res['get']['_source']
+            await self.save_log(user_sub=sub, doc_id=point_id, name=source['name'],
+                                changed={"images": {"old_value": None, "new_value": path}})
+            await self._changed(point_id, self._location(source))
+            return point_from_hit({"_id": point_id, "_source": source}, with_id=True)
+        return res
+
+    async def delete_image(self, point_id, image_name, sub):
+        res = await self.es.update(index=self.index, id=point_id, body=self._delete_image_body(image_name),
+                                   retry_on_conflict=CONFLICT_RETRIES, _source=True)
+        if res['result'] == 'updated':
+            source = res['get']['_source']
+            await self.save_log(user_sub=sub, doc_id=point_id, name=source['name'],
+                                changed={"images": {"old_value": image_name, "new_value": None}})
+            await self._changed(point_id, self._location(source))
+            return point_from_hit({"_id": point_id, "_source": source}, with_id=True)
+        return res
+
+    async def export_points(self, page_size=DEFAULT_PAGE_SIZE, keep_alive='1m'):
+        cursor = None
+        while True:
+            response, cursor = await self._search_after(self.index, {"query": {"match_all": {}}}, page_size,
+                                                        cursor=cursor, keep_alive=keep_alive)
+            for hit in response['hits']['hits']:
+                yield self._export_line(hit)
+            if cursor is None:
+                return
+
+    async def import_points(self, lines, chunk_size=500):
+        """Same as `Elasticsearch.import_points`, `lines` is an async iterable
+        """
+        pending = {}
+        report = {"indexed": 0, "errors": []}
+
+        async def with_old_locations(batch):
+            response = await self.es.mget(index=self.index, body={"ids": [action['_id'] for action, _, _ in batch]},
+                                          _source_includes=['location'])
+            return self._import_pending(pending, response, batch)
+
+        async def actions():
+            number = 0
+            batch = []
+            async for line in lines:
+                number += 1
+                if not line.strip():
+                    continue
+                try:
+                    action, location = self._import_action(self.index, line)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    report['errors'].append({"line": number, "error": repr(e)})
+                    continue
+                batch.append((action, number, location))
+                if len(batch) == chunk_size:
+                    for action in await with_old_locations(batch):
+                        yield action
+                    batch = []
+            if batch:
+                for action in await with_old_locations(batch):
+                    yield action
+
+        changed_ids, changed_locations = [], []
+        async for ok, item in helpers.async_streaming_bulk(self.es, actions(), chunk_size=chunk_size, max_retries=2,
+                                                           raise_on_error=False, raise_on_exception=False):
+            result = next(iter(item.values()))
+            number, locations = self._import_result(pending, result['_id'])
+            if ok:
+                report['indexed'] += 1
+                changed_ids.append(result['_id'])
+                changed_locations.extend(locations)
+            else:
+                report['errors'].append({"line": number, "error": result.get('error')})
+            if report['indexed'] + len(report['errors']) >= chunk_size:
+                await self._changed_many(changed_ids, changed_locations)
+                changed_ids, changed_locations = [], []
+                yield report
+                report = {"indexed": 0, "errors": []}
+        if changed_ids:
+            await self._changed_many(changed_ids, changed_locations)
+        if report['indexed'] or report['errors']:
+            yield report
+
+    async def save_log(self, user_sub, doc_id, name, changed):
+        index, log_id, document = self._log_entry(user_sub=user_sub, doc_id=doc_id, name=name, changed=changed)
+        if not log_sink.put(index, log_id, document):
+            await self.es.index(index=index, id=log_id, body=document)
@@ -1,26 +1,37 @@
-import datetime
-import hashlib
+import mimetypes
 import os
-import shutil
+import re
+from uuid import uuid4
 
-import boto3
-from botocore.exceptions import ClientError
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from image_resizer import resize_image
+from elasticsearch import NotFoundError
+from fastapi import APIRouter, Depends, File, HTTPException, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
 from werkzeug.utils import secure_filename
 
+from . import resize
 from .auth import require_auth, require_moderator
 from .config import DefaultConfig
-from .elastic import Elasticsearch
+from .elastic import AsyncElasticsearch
+from .storage import claim_image, create_image_directory, delete_image_file, image_stored, presigned_upload, \
+    release_image, run, stored_object, upload_file
+from .uploads import FileTooLarge, content_hash
 
 
 images = APIRouter()
 config = DefaultConfig()
 
+# direct uploads can not be hashed by us, they get random names instead
+UPLOAD_NAME = re.compile(r'^[0-9a-f]{32}\.[a-z]+$')
+
+
+class UploadRequest(BaseModel):
+    filename: str
+
 
 @images.post('/add_image/{point_id}')
-def add_image(point_id: str, file: UploadFile = File(...), es: dict = Depends(Elasticsearch.connection),
-              user: dict = Depends(require_auth)):
+async def add_image(point_id: str, response: Response, file: UploadFile = File(...),
+                    es: dict = Depends(AsyncElasticsearch.connection), user: dict = Depends(require_auth)):
     sub = user['sub']
     # check if the post request has the file part
     # if user does not select file, browser also
@@ -28,88 +39,116 @@ def add_image(point_id: str, file: UploadFile = File(...), es: dict = Depends(El
     if file.filename == '':
         raise HTTPException(status_code=400)
     if file and allowed_file(file.filename):
-        filename = get_new_file_name(file)
-        create_image_directory(point_id)
-        upload_file(file, os.path.join(point_id, filename))
-        resize_image.delay(os.path.join(point_id, filename))
         try:
-            res = es.add_image(point_id, filename, sub)
+            # one local read of the spooled upload, the store is only written for bytes it does not hold yet
+            filename = get_new_file_name(file, await run_in_threadpool(content_hash, file.file,
+                                                                       config.MAX_CONTENT_LENGTH))
+        except FileTooLarge:
+            raise HTTPException(status_code=413, detail="Image larger than {} bytes".format(config.MAX_CONTENT_LENGTH))
+        path = os.path.join(point_id, filename)
+        # a re-upload of stored bytes only needs the reference on the point
+        if await run_in_threadpool(image_stored, point_id, filename):
+            resize_status = await run_in_threadpool(resize.status, path)
+        else:
+            await run(create_image_directory, point_id)
+            await run(upload_file, file, path)
+            # claiming only now, a concurrent upload of the same bytes can not reference a file that is not there yet
+            if await run_in_threadpool(claim_image, point_id, filename):
+                try:
+                    resize_status = await run_in_threadpool(resize.submit, path)
+                except resize.ResizerBusy:
+                    await run_in_threadpool(release_image, point_id, filename)
+                    raise HTTPException(status_code=503, detail="Too many images waiting to be resized",
+                                        headers={"Retry-After": "5"})
+            else:
+                resize_status = await run_in_threadpool(resize.status, path)
+        if resize_status is not None:
+            response.headers['X-Resize-Status'] = resize_status
+        try:
+            res = await es.add_image(point_id, filename, sub)
             return res
         except KeyError:
             raise HTTPException(status_code=400)
 
 
 @images.delete('/delete_image/{point_id}/{image_name}')
-def delete_image(point_id: str, image_name: str, es: dict = Depends(Elasticsearch.connection),
-                 user: dict = Depends(require_moderator)):
+async def delete_image(point_id: str, image_name: str, es: dict = Depends(AsyncElasticsearch.connection),
+                       user: dict = Depends(require_moderator)):
     sub = user['sub']
-    es.delete_image(point_id=point_id, image_name=image_name, sub=sub)
-    delete_image_file(point_id=point_id, image_name=image_name)
+    await es.delete_image(point_id=point_id, image_name=image_name, sub=sub)
+    await run(delete_image_file, point_id=point_id, image_name=image_name)
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
+def require_s3():
+    if not (config.STORE_PROPERTY or '').startswith('s3://'):
+        raise HTTPException(status_code=400, detail="Direct uploads need an S3 store")
 
 
-def delete_image_directory(path):
-    store_property = config.STORE_PROPERTY.split('//', 1)[1]
+@images.post('/images/upload_url/{point_id}', dependencies=[Depends(require_s3), Depends(require_auth)])
+async def upload_url(point_id: str, upload: UploadRequest, es: dict = Depends(AsyncElasticsearch.connection)):
+    """Presigned POST storing one image for the point straight in S3
 
-    if config.STORE_PROPERTY.startswith('file://'):
+    The client sends `fields` along with the file to `url` and then calls `/images/complete_upload` with the returned
+    `image_name`.
+    """
+    if not allowed_file(upload.filename):
+        raise HTTPException(status_code=400)
+    try:
+        await es.get_point(point_id)
+    except NotFoundError:
+        raise HTTPException(status_code=404, detail="Point not found")
+    image_name = '.'.join((uuid4().hex, upload.filename.rsplit('.', 1)[1].lower()))
+    content_type = mimetypes.guess_type(image_name)[0]
+    post = await run(presigned_upload, '/'.join((point_id, image_name)), content_type, config.UPLOAD_URL_EXPIRES)
+    return {"url": post['url'], "fields": post['fields'], "image_name": image_name,
+            "expires_in": config.UPLOAD_URL_EXPIRES}
+
+
+@images.post('/images/complete_upload/{point_id}/{image_name}', dependencies=[Depends(require_s3)])
+async def complete_upload(point_id: str, image_name: str, response: Response,
+                          es: dict = Depends(AsyncElasticsearch.connection), user: dict = Depends(require_auth)):
+    """Attaches an image stored through `/images/upload_url` to the point once it is in the bucket
+    """
+    if not UPLOAD_NAME.match(image_name) or not allowed_file(image_name):
+        raise HTTPException(status_code=400)
+    path = '/'.join((point_id, image_name))
+    stored = await run(stored_object, path)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if stored['ContentLength'] > config.MAX_CONTENT_LENGTH or \
+            stored.get('ContentType') != mimetypes.guess_type(image_name)[0]:
+        raise HTTPException(status_code=400, detail="Upload does not match the presigned policy")
+    if await run_in_threadpool(claim_image, point_id, image_name):
         try:
-            shutil.rmtree(os.path.join(store_property, path))
-        except FileNotFoundError:
-            pass
-    elif config.STORE_PROPERTY.startswith('s3://'):
-        # TODO delete S3 directory
-        pass
-
-
-def delete_image_file(point_id, image_name):
-    store_property = config.STORE_PROPERTY.split('//', 1)[1]
-    file_name, file_extension = image_name.rsplit('.', 1)
-
-    if config.STORE_PROPERTY.startswith('file://'):
-        os.remove(os.path.join(store_property, point_id, image_name))
-        os.remove(os.path.join(store_property, point_id, file_name + '_m.' + file_extension))
-    elif config.STORE_PROPERTY.startswith('s3://'):
-        # TODO delete S3 images
-        pass
-
+            resize_status = await run_in_threadpool(resize.submit, path)
+        except resize.ResizerBusy:
+            await run_in_threadpool(release_image, point_id, image_name)
+            raise HTTPException(status_code=503, detail="Too many images waiting to be resized",
+                                headers={"Retry-After": "5"})
+    else:
+        resize_status = await run_in_threadpool(resize.status, path)
+    if resize_status is not None:
+        response.headers['X-Resize-Status'] = resize_status
+    try:
+        return await es.add_image(point_id, image_name, user['sub'])
+    except KeyError:
+        raise HTTPException(status_code=400)
 
-def create_image_directory(path):
-    store_property = config.STORE_PROPERTY.split('//', 1)[1]
 
-    if config.STORE_PROPERTY.startswith('file://'):
-        try:
-            os.mkdir(os.path.join(store_property, path))
-        except FileExistsError:
-            pass
-    elif config.STORE_PROPERTY.startswith('s3://'):
-        try:
-            s3_client = boto3.client('s3')
-            s3_client.put_object(Bucket=store_property, Key=(path + '/'))
-        except ClientError:
-            raise
+@images.get('/image_status/{point_id}/{image_name}')
+async def image_status(point_id: str, image_name: str):
+    """Status of the resize job of an image uploaded within the last day
+    """
+    status = await run_in_threadpool(resize.status, os.path.join(point_id, image_name))
+    if status is None:
+        raise HTTPException(status_code=404)
+    return {"status": status}
 
 
-def upload_file(file_object, filename):
-    store_property = config.STORE_PROPERTY.split('//', 1)[1]
-
-    if config.STORE_PROPERTY.startswith('file://'):
-        with open(os.path.join(store_property, filename), 'wb') as write_file:
-            write_file.write(file_object.file.read())
-    elif config.STORE_PROPERTY.startswith('s3://'):
-        try:
-            s3_client = boto3.client('s3')
-            s3_client.upload_fileobj(file_object, store_property, filename,
-                                     ExtraArgs={'ACL': 'public-read', 'ContentType': file_object.mimetype})
-        except ClientError:
-            raise
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
 
 
-def get_new_file_name(image_file):
-    timestamp = datetime.datetime.utcnow().strftime("%s.%f")
-    file_name = os.path.join(timestamp + '_' + image_file.filename).encode()
+def get_new_file_name(image_file, digest):
     file_extension = image_file.filename.rsplit('.', 1)[1].lower()
-    timestamped_filename = '.'.join((hashlib.md5(file_name).hexdigest(), file_extension))
-    return secure_filename(timestamped_filename)
+    return secure_filename('.'.join((digest, file_extension)))
@@ -0,0 +1,135 @@
+""" Buffered writer of audit log entries
+
+`Elasticsearch.save_log` hands entries to the running sink instead of indexing each one in the request. A background
+thread sends them with the bulk API once `flush_size` entries are waiting or `flush_interval` seconds passed. Log ids
+are generated before queueing, so a retried entry overwrites itself instead of being duplicated. Entries failing with a
+transient error go back to the front of the queue and are retried until they are written, the flushes backing off
+exponentially from `flush_interval` up to `max_backoff` seconds while Elasticsearch keeps failing. At most `max_queued`
+entries are kept, the oldest ones are dropped and logged when more arrive. `stop` flushes whatever is still queued,
+retrying for half of its timeout. Without a running sink `put` returns False and the caller indexes synchronously,
+which is what tests rely on.
+"""
+import threading
+import time
+from collections import deque
+
+from elasticsearch import helpers
+
+from .logger import logger
+
+
+_sink = None
+
+
+class LogSink:
+    def __init__(self, es, flush_size=500, flush_interval=1.0, max_queued=10000, max_backoff=60.0):
+        self.es = es
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.max_backoff = max_backoff
+        self._entries = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._delay = 0
+        self._give_up_at = None
+
+    def put(self, index, log_id, document):
+        with self._condition:
+            self._entries.append({"_index": index, "_id": log_id, "_source": document})
+            self._trim()
+            if len(self._entries) >= self.flush_size:
+                self._condition.notify()
+
+    def _trim(self):
+        while len(self._entries) > self.max_queued:
+            action = self._entries.popleft()
+            logger.error('log queue full, dropping log entry %s of %s', action['_id'], action['_index'])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        with self._condition:
+            self._stopped = True
+            # retries stop halfway, leaving time for the last flush and for logging what could not be written
+            self._give_up_at = time.monotonic() + timeout / 2
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _take(self):
+        with self._condition:
+            if self._delay:
+                # backing off, entries piling up meanwhile do not cut the wait short
+                until = time.monotonic() + self._delay
+                while True:
+                    remaining = min(until, self._give_up_at or until) - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            elif not self._stopped and len(self._entries) < self.flush_size:
+                self._condition.wait(self.flush_interval)
+            entries = [self._entries.popleft() for _ in range(min(self.flush_size, len(self._entries)))]
+            return entries, self._stopped
+
+    def _run(self):
+        while True:
+            entries, stopped = self._take()
+            retry = self.flush(entries) if entries else []
+            if retry and stopped and time.monotonic() >= self._give_up_at:
+                for action in retry:
+                    logger.error('dropping log entry %s of %s at shutdown', action['_id'], action['_index'])
+                retry = []
+            with self._condition:
+                self._entries.extendleft(reversed(retry))
+                self._trim()
+                self._delay = min(self.max_backoff, self._delay * 2 or self.flush_interval) if retry else 0
+                if stopped and not self._entries:
+                    return
+
+    def flush(self, entries):
+        """Indexes `entries` with a single bulk request, returns the ones that failed transiently
+        """
+        try:
+            _, errors = helpers.bulk(self.es, entries, raise_on_error=False)
+        except Exception:
+            logger.exception('bulk indexing of %d log entries failed', len(entries))
+            return list(entries)
+        failed = {item['_id']: item.get('status', 500) for error in errors for item in error.values()}
+        retry = []
+        for action in entries:
+            status = failed.get(action['_id'])
+            if status is None:
+                continue
+            if status == 429 or status >= 500:
+                retry.append(action)
+            else:
+                logger.error('dropping log entry %s of %s, bulk status %s', action['_id'], action['_index'], status)
+        return retry
+
+
+def put(index, log_id, document):
+    """Queues a log entry, returns False if no sink is running and the caller has to index it itself
+    """
+    if _sink is None:
+        return False
+    _sink.put(index, log_id, document)
+    return True
+
+
+def start(es, flush_size=500, flush_interval=1.0, max_queued=10000):
+    global _sink
+    _sink = LogSink(es, flush_size=flush_size, flush_interval=flush_interval, max_queued=max_queued)
+    _sink.start()
+
+
+def stop():
+    """Flushes the queued entries and stops the sink, later entries are indexed synchronously
+    """
+    global _sink
+    sink, _sink = _sink, None
+    if sink is not None:
+        sink.stop()
@@ -1,19 +1,25 @@
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.staticfiles import StaticFiles
 
+from . import log_sink, resize, snapshot, storage, tile_cache
+from .config import DefaultConfig
+from .elastic import AsyncElasticsearch, Elasticsearch
 from .image import images
 from .logs import logs
 from .points import points
+from .static import GZipMiddleware, ImageFiles
+from .tiles import tiles
+from .uploads import ContentSizeLimitMiddleware
 from .user_management import user_mgmt
 
 app = FastAPI()
 app.include_router(images)
 app.include_router(logs)
 app.include_router(points)
+app.include_router(tiles)
 app.include_router(user_mgmt)
-app.mount("/images", StaticFiles(directory="/images"), name="images")
+app.mount("/images", ImageFiles(directory="/images"), name="images")
 
 origins = [
     "http://localhost",
@@ -27,7 +33,56 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(GZipMiddleware)
+app.add_middleware(GZipMiddleware, exclude_paths=('/images/',))
+# room for the multipart framing around an image of MAX_CONTENT_LENGTH bytes
+app.add_middleware(ContentSizeLimitMiddleware, max_size=DefaultConfig().MAX_CONTENT_LENGTH + 64 * 1024,
+                   paths=('/add_image/',))
+
+
+@app.on_event('startup')
+async def open_elasticsearch():
+    AsyncElasticsearch.open()
+
+
+@app.on_event('shutdown')
+async def close_elasticsearch():
+    await run_in_threadpool(log_sink.stop)
+    await run_in_threadpool(storage.stop)
+    await run_in_threadpool(resize.stop)
+    await AsyncElasticsearch.close()
+    Elasticsearch.close()
+
+
+@app.on_event('startup')
+async def start_log_sink():
+    config = DefaultConfig()
+    if config.LOG_FLUSH_INTERVAL > 0:
+        log_sink.start(Elasticsearch.connection().es, flush_size=config.LOG_FLUSH_SIZE,
+                       flush_interval=config.LOG_FLUSH_INTERVAL, max_queued=config.LOG_QUEUE_SIZE)
+
+
+@app.on_event('startup')
+async def start_resizer():
+    resize.start(DefaultConfig())
+
+
+@app.on_event('startup')
+async def start_snapshot():
+    snapshot.start(DefaultConfig())
+
+
+@app.on_event('shutdown')
+async def stop_snapshot():
+    snapshot.stop()
+
+
+@app.on_event('startup')
+async def start_tile_cache():
+    config = DefaultConfig()
+    if config.TILE_CACHE_ZOOM is not None:
+        tile_cache.start(config.TILE_CACHE_ZOOM, ttl=config.TILE_CACHE_TTL)
+        if tile_cache.invalidate not in Elasticsearch.listeners:
+            Elasticsearch.listeners.append(tile_cache.invalidate)
 
 
 @app.get('/healthz')
@@ -0,0 +1,115 @@
+""" Minimal Mapbox Vector Tile encoder for point layers
+
+Only what the map point layer needs is implemented: a single layer of POINT features with string, bool and number
+attributes. See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import math
+import struct
+
+EXTENT = 4096
+MEDIA_TYPE = 'application/vnd.mapbox-vector-tile'
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+_POINT = 1
+_MOVE_TO = 1
+
+
+def tile_bounds(z, x, y):
+    """Returns (west, south, east, north) of a web mercator tile in degrees
+    """
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def _tile_coordinates(lat, lon, z):
+    n = 2 ** z
+    lat_rad = math.radians(max(min(float(lat), 85.0511287798), -85.0511287798))
+    tile_x = (float(lon) + 180.0) / 360.0 * n
+    tile_y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return tile_x, tile_y
+
+
+def tile_index(lat, lon, z):
+    """Returns (x, y) of the zoom `z` tile containing the coordinate
+    """
+    tile_x, tile_y = _tile_coordinates(lat, lon, z)
+    last = 2 ** z - 1
+    return min(max(int(math.floor(tile_x)), 0), last), min(max(int(math.floor(tile_y)), 0), last)
+
+
+def tile_pixel(lat, lon, z, x, y, extent=EXTENT):
+    """Projects a coordinate to integer tile coordinates, origin in the top left corner
+    """
+    tile_x, tile_y = _tile_coordinates(lat, lon, z)
+    return int(round((tile_x - x) * extent)), int(round((tile_y - y) * extent))
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, data):
+    return _key(field, _LENGTH_DELIMITED) + _varint(len(data)) + data
+
+
+def _packed_field(field, values):
+    return _bytes_field(field, b''.join(_varint(value) for value in values))
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _key(7, _VARINT) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, _VARINT) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, _FIXED64) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode())
+
+
+def encode_layer(name, features, z, x, y, extent=EXTENT):
+    """Encodes `features`, an iterable of (lat, lon, properties) tuples, as a one layer tile
+
+    Properties set to None are skipped.
+    """
+    keys, values = {}, {}
+    encoded_features = []
+    for lat, lon, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        px, py = tile_pixel(lat, lon, z, x, y, extent=extent)
+        geometry = [(_MOVE_TO & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)]
+        feature = _packed_field(2, tags) + _key(3, _VARINT) + _varint(_POINT) + _packed_field(4, geometry)
+        encoded_features.append(_bytes_field(2, feature))
+    layer = [_key(15, _VARINT) + _varint(2), _bytes_field(1, name.encode())]
+    layer.extend(encoded_features)
+    layer.extend(_bytes_field(3, key.encode()) for key in keys)
+    layer.extend(_bytes_field(4, _value(value)) for _, value in values)
+    layer.append(_key(5, _VARINT) + _varint(extent))
+    return _bytes_field(3, b''.join(layer))
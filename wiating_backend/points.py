@@ -1,49 +1,124 @@
 from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException
+from elasticsearch import NotFoundError
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from pydantic.typing import Literal  # typing.Literal on 3.8+, typing_extensions on 3.7
 
+from . import snapshot
 from .auth import allow_auth, require_auth, require_moderator
-from .elastic import BasePoint, Elasticsearch, Location, NotDefined
-from .image import delete_image_directory
+from .config import DefaultConfig
+from .elastic import AsyncElasticsearch, BasePoint, Location, NotDefined, cluster_precision
 from .logger import logger
+from .storage import delete_image_directory, run
 
 
 points = APIRouter()
+config = DefaultConfig()
+
+# an import of a wrong file fails on every line, report only the first ones
+IMPORT_MAX_ERRORS = 100
+
+# `view` values the point queries accept, see `elastic.MARKER_VIEW`
+View = Optional[Literal['marker']]
+
+
+def limit_page_size(size):
+    return None if size is None else max(1, min(size, config.PAGE_MAX_SIZE))
+
+
+async def paged(search, cursor=None, **kwargs):
+    """Runs a cursor paged `search`, mapping a malformed cursor to 400 and one whose point in time expired to 410
+    """
+    try:
+        return await search(cursor=cursor, keep_alive=config.PIT_KEEP_ALIVE, **kwargs)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except NotFoundError:
+        if not cursor:
+            raise
+        raise HTTPException(status_code=410, detail="Cursor expired, start over without it")
 
 
 @points.post('/get_points')
-def get_points(top_right: Location, bottom_left: Location, point_type: Optional[List[str]] = None,
-               es: dict = Depends(Elasticsearch.connection), user: dict = Depends(allow_auth)):
-    if user is not None and user.get('is_moderator'):
-        return es.get_points(top_right, bottom_left, point_type, is_moderator=True)
-    return es.get_points(top_right, bottom_left, point_type)
+async def get_points(top_right: Location, bottom_left: Location, point_type: Optional[List[str]] = None,
+                     zoom: Optional[int] = Body(None), precision: Optional[int] = Body(None),
+                     view: View = Body(None), page_size: Optional[int] = Body(None),
+                     cursor: Optional[str] = Body(None), es: dict = Depends(AsyncElasticsearch.connection),
+                     user: dict = Depends(allow_auth)):
+    """
+    Returns points inside the bounding box. If `precision` is set, or `zoom` is at most `CLUSTER_MAX_ZOOM`, it returns
+    `clusters` with centroid, count and per-type counts instead of `points`.
+    With `view` set to `marker` every point only carries id, name, location, type and flags. Use `/get_point/{id}`
+    for the full document.
+    With `page_size` set, at most that many points are returned along with a `cursor`. Send the same query with that
+    `cursor` to get the next page, the last page has `cursor` null.
+    """
+    is_moderator = user is not None and bool(user.get('is_moderator'))
+    grid_precision = cluster_precision(zoom=zoom, precision=precision, max_zoom=config.CLUSTER_MAX_ZOOM,
+                                       offset=config.CLUSTER_PRECISION_OFFSET)
+    if grid_precision is not None:
+        return await es.get_clusters(top_right, bottom_left, grid_precision, point_type, is_moderator=is_moderator)
+    if page_size is not None or cursor is not None:
+        return await paged(es.get_points, top_right=top_right, bottom_left=bottom_left, point_type=point_type,
+                           is_moderator=is_moderator, view=view, page_size=limit_page_size(page_size), cursor=cursor)
+    if is_moderator:
+        return await es.get_points(top_right, bottom_left, point_type, is_moderator=True,
+                                   tile_zoom=config.TILE_CACHE_ZOOM, max_tiles=config.TILE_CACHE_MAX_TILES, view=view)
+    if view is None:
+        cached = snapshot.points_json(top_right, bottom_left, point_type, limit=9000)
+        if cached is not None:
+            return Response(content=cached, media_type='application/json')
+    return await es.get_points(top_right, bottom_left, point_type, tile_zoom=config.TILE_CACHE_ZOOM,
+                               max_tiles=config.TILE_CACHE_MAX_TILES, view=view)
 
 
 @points.get('/get_point/{point_id}')
-def get_point(point_id: str, es: dict = Depends(Elasticsearch.connection), user: dict = Depends(allow_auth)):
+async def get_point(point_id: str, es: dict = Depends(AsyncElasticsearch.connection),
+                    user: dict = Depends(allow_auth)):
     if user is not None and user.get('is_moderator'):
-        return es.get_point(point_id=point_id, is_moderator=True)
-    return es.get_point(point_id=point_id)
+        return await es.get_point(point_id=point_id, is_moderator=True)
+    return await es.get_point(point_id=point_id)
+
+
+class PointIds(BaseModel):
+    ids: List[str]
+
+
+@points.post('/get_points_by_ids')
+async def get_points_by_ids(point_ids: PointIds, es: dict = Depends(AsyncElasticsearch.connection),
+                            user: dict = Depends(allow_auth)):
+    """
+    Returns the points with the given ids, in the order requested, and the ids of those which do not exist in
+    `missing`. At most `MAX_POINT_IDS` ids are accepted.
+    """
+    ids = list(dict.fromkeys(point_ids.ids))
+    if len(ids) > config.MAX_POINT_IDS:
+        raise HTTPException(status_code=400, detail="At most {} ids allowed".format(config.MAX_POINT_IDS))
+    is_moderator = user is not None and bool(user.get('is_moderator'))
+    return await es.get_points_by_ids(ids, is_moderator=is_moderator)
 
 
 @points.post('/add_point')
-def add_point(point: BasePoint, es: dict = Depends(Elasticsearch.connection), user: dict = Depends(require_auth)):
-    return es.add_point(name=point.name, description=point.description, directions=point.directions,
-                        lat=point.location.lat, lon=point.location.lon, type=point.type,
-                        water_exists=point.water_exists, water_comment=point.water_comment,
-                        fire_exists=point.fire_exists, fire_comment=point.fire_comment,
-                        is_disabled=point.is_disabled, user_sub=user['sub'], is_moderator=user['is_moderator'])
+async def add_point(point: BasePoint, es: dict = Depends(AsyncElasticsearch.connection),
+                    user: dict = Depends(require_auth)):
+    return await es.add_point(name=point.name, description=point.description, directions=point.directions,
+                              lat=point.location.lat, lon=point.location.lon, type=point.type,
+                              water_exists=point.water_exists, water_comment=point.water_comment,
+                              fire_exists=point.fire_exists, fire_comment=point.fire_comment,
+                              is_disabled=point.is_disabled, user_sub=user['sub'],
+                              is_moderator=user['is_moderator'])
 
 
 @points.put('/modify_point/{point_id}')
-def modify_point(point_id: str, point: BasePoint, es: dict = Depends(Elasticsearch.connection),
-                 user: dict = Depends(require_auth)):
+async def modify_point(point_id: str, point: BasePoint, es: dict = Depends(AsyncElasticsearch.connection),
+                       user: dict = Depends(require_auth)):
     logger.info('modify_point')
     sub = user['sub']
     is_moderator = user['is_moderator']
     if is_moderator:
-        return es.modify_point(point_id=point_id,
+        return await es.modify_point(point_id=point_id,
                 name=point.name if point.name is not None else NotDefined(),
                 description=point.description if point.description is not None else NotDefined(),
                 directions=point.directions if point.directions is not None else NotDefined(),
@@ -58,12 +133,13 @@ def modify_point(point_id: str, point: BasePoint, es: dict = Depends(Elasticsear
                 unpublished=point.unpublished if point.unpublished is not None else NotDefined(),
                 user_sub=sub, is_moderator=is_moderator)
     else:
-        return es.modify_point(point_id=point_id, name=point.name, description=point.description,
-                               directions=point.directions, lat=str(point.location.lat), lon=str(point.location.lon),
-                               point_type=point.type, water_exists=point.water_exists,
-                               water_comment=point.water_comment, fire_exists=point.fire_exists,
-                               fire_comment=point.fire_comment, is_disabled=point.is_disabled, unpublished=None,
-                               user_sub=sub, is_moderator=is_moderator)
+        return await es.modify_point(point_id=point_id, name=point.name, description=point.description,
+                                     directions=point.directions, lat=str(point.location.lat),
+                                     lon=str(point.location.lon), point_type=point.type,
+                                     water_exists=point.water_exists, water_comment=point.water_comment,
+                                     fire_exists=point.fire_exists, fire_comment=point.fire_comment,
+                                     is_disabled=point.is_disabled, unpublished=None, user_sub=sub,
+                                     is_moderator=is_moderator)
 
 
 class SearchQuery(BaseModel):
@@ -75,41 +151,92 @@ class SearchQuery(BaseModel):
     fire: Optional[bool]
     is_disabled: Optional[bool]
     report_reason: Optional[bool]
+    view: View = None
+    page_size: Optional[int] = None
+    cursor: Optional[str] = None
 
 
 @points.post('/search_points')
-def search_points(search_query: SearchQuery, es: dict = Depends(Elasticsearch.connection)):
+async def search_points(search_query: SearchQuery, es: dict = Depends(AsyncElasticsearch.connection)):
     """
     It takes search parameters from JSON data.
     Result contains items with non-empty `report_reason` only if `report_reason` is set True, if False it returns items
     without `report_reason`, if not set returns both.
+    With `view` set to `marker` it returns only id, name, location, type and flags of every point.
+    With `page_size` or `cursor` set, results are paged like in `/get_points`.
     :return:
     """
-    return es.search_points(phrase=search_query.phrase, point_type=search_query.point_type,
-                            top_right=search_query.top_right, bottom_left=search_query.bottom_left,
-                            water=search_query.water, fire=search_query.fire, is_disabled=search_query.is_disabled,
-                            report_reason=search_query.report_reason)
+    if search_query.page_size is not None or search_query.cursor is not None:
+        return await paged(es.search_points, phrase=search_query.phrase, point_type=search_query.point_type,
+                           top_right=search_query.top_right, bottom_left=search_query.bottom_left,
+                           water=search_query.water, fire=search_query.fire, is_disabled=search_query.is_disabled,
+                           report_reason=search_query.report_reason, view=search_query.view,
+                           page_size=limit_page_size(search_query.page_size), cursor=search_query.cursor)
+    return await es.search_points(phrase=search_query.phrase, point_type=search_query.point_type,
+                                  top_right=search_query.top_right, bottom_left=search_query.bottom_left,
+                                  water=search_query.water, fire=search_query.fire,
+                                  is_disabled=search_query.is_disabled, report_reason=search_query.report_reason,
+                                  view=search_query.view)
 
 
 @points.delete('/delete_point/{point_id}')
-def delete_point(point_id: str, es: dict = Depends(Elasticsearch.connection), user: dict = Depends(require_moderator)):
-    es.delete_point(point_id=point_id)
-    delete_image_directory(point_id)
+async def delete_point(point_id: str, es: dict = Depends(AsyncElasticsearch.connection),
+                       user: dict = Depends(require_moderator)):
+    await es.delete_point(point_id=point_id)
+    await run(delete_image_directory, point_id)
     return {"status": "deleted"}
 
 
+async def ndjson_lines(chunks):
+    """Splits a stream of byte chunks into lines
+    """
+    rest = b''
+    async for chunk in chunks:
+        *lines, rest = (rest + chunk).split(b'\n')
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+@points.get('/export/points.ndjson', dependencies=[Depends(require_moderator)])
+async def export_points(es: dict = Depends(AsyncElasticsearch.connection)):
+    """
+    Streams every point, one JSON document with its `id` per line, in the format `/import/points` takes.
+    """
+    return StreamingResponse(es.export_points(keep_alive=config.PIT_KEEP_ALIVE), media_type='application/x-ndjson')
+
+
+@points.post('/import/points', dependencies=[Depends(require_moderator)])
+async def import_points(request: Request, es: dict = Depends(AsyncElasticsearch.connection)):
+    """
+    Indexes the NDJSON request body, one point per line. Lines with an `id` replace the point with that id.
+    Returns the total of indexed points, failed lines and chunks, and the errors by line number of the first
+    `IMPORT_MAX_ERRORS` failed lines, with `errors_truncated` set if there were more.
+    """
+    result = {"indexed": 0, "failed": 0, "chunks": 0, "errors": [], "errors_truncated": False}
+    async for report in es.import_points(ndjson_lines(request.stream())):
+        result['chunks'] += 1
+        result['indexed'] += report['indexed']
+        result['failed'] += len(report['errors'])
+        result['errors'].extend(report['errors'][:IMPORT_MAX_ERRORS - len(result['errors'])])
+    result['errors_truncated'] = result['failed'] > len(result['errors'])
+    return result
+
+
 class Report(BaseModel):
     report_reason: Union[None, str]
 
 
 @points.post('/report/{point_id}')
-def report(point_id: str, report: Report, es: dict = Depends(Elasticsearch.connection), user: dict = Depends(require_auth)):
+async def report(point_id: str, report: Report, es: dict = Depends(AsyncElasticsearch.connection),
+                 user: dict = Depends(require_auth)):
     try:
         if user.get('is_moderator'):
-            if es.report_moderator(point_id, report.report_reason):
+            if await es.report_moderator(point_id, report.report_reason):
                 return
         else:
-            if es.report_regular(point_id, report.report_reason):
+            if await es.report_regular(point_id, report.report_reason):
                 return
         raise HTTPException(status_code=503)
     except AttributeError:
@@ -117,5 +244,5 @@ def report(point_id: str, report: Report, es: dict = Depends(Elasticsearch.conne
 
 
 @points.get('/get_unpublished', dependencies=[Depends(require_moderator)])
-def get_unpublished(size: int = 25, offset: int = 0, es: dict = Depends(Elasticsearch.connection)):
-    return es.get_unpublished(size=size, offset=offset)
+async def get_unpublished(size: int = 25, offset: int = 0, es: dict = Depends(AsyncElasticsearch.connection)):
+    return await es.get_unpublished(size=size, offset=offset)
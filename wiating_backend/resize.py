@@ -0,0 +1,169 @@
+""" Thumbnail generation behind `RESIZE_BACKEND`
+
+`celery` hands every new image to the image_resizer task, as before. `local` needs no broker: it resizes images in a
+pool of `RESIZE_WORKERS` processes, storing one variant per entry of `RESIZE_SIZES`, so `m:800` writes
+`<name>_m.<ext>` scaled to fit 800x800. At most `RESIZE_QUEUE_SIZE` local jobs wait or run at a time. `submit` waits
+up to `RESIZE_SUBMIT_TIMEOUT` seconds for a free slot and then raises ResizerBusy. Job status is kept in Redis under
+`images:resize:<path>` for a day, so any worker can report it.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from multiprocessing import get_context
+
+import boto3
+
+from .cache import redis_client
+from .logger import logger
+
+
+STATUS_KEY = 'images:resize:'
+STATUS_TTL = 24 * 3600
+
+QUEUED = 'queued'
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_resizer = None
+_worker_s3 = None
+
+
+class ResizerBusy(Exception):
+    pass
+
+
+def variant_name(path, suffix):
+    name, extension = path.rsplit('.', 1)
+    return '{}_{}.{}'.format(name, suffix, extension)
+
+
+def _set_status(path, status):
+    redis_client().set(STATUS_KEY + path, status, ex=STATUS_TTL)
+
+
+def status(path):
+    """Status of the resize job of the image at `path`, None if there was none in the last day
+    """
+    value = redis_client().get(STATUS_KEY + path)
+    return None if value is None else value.decode()
+
+
+def _s3():
+    # runs in the pool's processes, which must not share the parent's client
+    global _worker_s3
+    if _worker_s3 is None:
+        _worker_s3 = boto3.session.Session().client('s3')
+    return _worker_s3
+
+
+def _read(store_property, path):
+    location = store_property.split('//', 1)[1]
+    if store_property.startswith('s3://'):
+        return _s3().get_object(Bucket=location, Key=path)['Body'].read()
+    with open(os.path.join(location, path), 'rb') as image_file:
+        return image_file.read()
+
+
+def _write(store_property, path, data, content_type):
+    location = store_property.split('//', 1)[1]
+    if store_property.startswith('s3://'):
+        _s3().put_object(Bucket=location, Key=path, Body=data, ACL='public-read', ContentType=content_type)
+        return
+    full_path = os.path.join(location, path)
+    with open(full_path + '.part', 'wb') as image_file:
+        image_file.write(data)
+    os.replace(full_path + '.part', full_path)
+
+
+def resize_file(store_property, path, sizes):
+    """Writes every variant of the image at `path`, runs in a pool process
+    """
+    from PIL import Image, ImageOps
+
+    source = Image.open(BytesIO(_read(store_property, path)))
+    image_format = source.format
+    # phones store the orientation as a tag, thumbnails should not depend on viewers honouring it
+    source = ImageOps.exif_transpose(source)
+    for suffix, size in sizes.items():
+        variant = source.copy()
+        variant.thumbnail((size, size))
+        output = BytesIO()
+        variant.save(output, format=image_format)
+        _write(store_property, variant_name(path, suffix), output.getvalue(), Image.MIME.get(image_format))
+
+
+class CeleryResizer:
+    def submit(self, path):
+        from image_resizer import resize_image
+
+        resize_image.delay(path)
+        _set_status(path, QUEUED)
+        return QUEUED
+
+    def stop(self):
+        pass
+
+
+class LocalResizer:
+    def __init__(self, store_property, sizes, workers=None, queue_size=64, submit_timeout=5):
+        self.store_property = store_property
+        self.sizes = dict(sizes)
+        self.submit_timeout = submit_timeout
+        # forking a process running threads is unsafe, start the workers fresh
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        self._slots = threading.BoundedSemaphore(queue_size)
+
+    def submit(self, path):
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            raise ResizerBusy('resize queue is full')
+        try:
+            _set_status(path, PENDING)
+            future = self.executor.submit(resize_file, self.store_property, path, self.sizes)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(partial(self._done, path))
+        return PENDING
+
+    def _done(self, path, future):
+        self._slots.release()
+        try:
+            future.result()
+            job_status = DONE
+        except Exception:
+            logger.exception('resizing %s failed', path)
+            job_status = FAILED
+        try:
+            _set_status(path, job_status)
+        except Exception:
+            logger.exception('storing the resize status of %s failed', path)
+
+    def stop(self):
+        self.executor.shutdown(wait=True)
+
+
+def start(config):
+    global _resizer
+    if config.RESIZE_BACKEND == 'local':
+        _resizer = LocalResizer(config.STORE_PROPERTY, config.RESIZE_SIZES, workers=config.RESIZE_WORKERS,
+                                queue_size=config.RESIZE_QUEUE_SIZE, submit_timeout=config.RESIZE_SUBMIT_TIMEOUT)
+    else:
+        _resizer = CeleryResizer()
+
+
+def stop():
+    """Waits for the running resize jobs and stops the backend
+    """
+    global _resizer
+    resizer, _resizer = _resizer, None
+    if resizer is not None:
+        resizer.stop()
+
+
+def submit(path):
+    """Schedules the variants of the image at `path`, returns the job status
+    """
+    return (_resizer or CeleryResizer()).submit(path)
@@ -0,0 +1,300 @@
+""" Columnar snapshot of published points, memory-mapped by every worker
+
+A snapshot is a directory of NumPy arrays sorted by a 1x1 degree grid cell: float32 `lat`/`lon`, a `type` code, a
+`flags` bitset and `offsets` into `blob.bin`, which holds every point already serialized the way `get_points` returns
+it. The `current` file in the snapshot path names the live directory, so a rebuild is swapped in atomically.
+
+Point writes call `mark_dirty`, which bumps a generation counter and remembers the point id in Redis. One worker at a
+time (guarded by a Redis lock) rebuilds the snapshot, refetching only the dirty points, and falls back to a full scan
+of the index every `SNAPSHOT_FULL_INTERVAL` seconds.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+from elasticsearch import helpers
+from fastapi.concurrency import run_in_threadpool
+
+from .cache import redis_client
+from .elastic import Elasticsearch, point_from_hit
+from .logger import logger
+
+
+GENERATION_KEY = 'points:snapshot:generation'
+DIRTY_KEY = 'points:snapshot:dirty'
+PROCESSING_KEY = 'points:snapshot:processing'
+LOCK_KEY = 'points:snapshot:lock'
+POINTER = 'current'
+
+GRID_ROWS = 180
+GRID_COLUMNS = 360
+
+WATER = 1
+FIRE = 2
+DISABLED = 4
+
+PUBLISHED_QUERY = {"query": {"bool": {"must_not": [{"term": {"unpublished": True}}]}}}
+
+_reader = None
+_task = None
+
+
+def _grid_row(lat):
+    return min(max(int(np.floor(lat)) + 90, 0), GRID_ROWS - 1)
+
+
+def _grid_column(lon):
+    return min(max(int(np.floor(lon)) + 180, 0), GRID_COLUMNS - 1)
+
+
+def _row(hit):
+    point = point_from_hit(hit, with_id=True)
+    flags = (WATER if point['water_exists'] else 0) | (FIRE if point['fire_exists'] else 0) | \
+        (DISABLED if point['is_disabled'] else 0)
+    blob = json.dumps(point, separators=(',', ':'), ensure_ascii=False).encode()
+    return hit['_id'], float(point['location']['lat']), float(point['location']['lon']), point['type'], flags, blob
+
+
+def _save(directory, name, array):
+    np.save(os.path.join(directory, name + '.npy'), array)
+
+
+def write_snapshot(path, rows, generation, full_built_at=None):
+    """Writes `rows` as a new snapshot directory and makes it the current one
+    """
+    rows = sorted(rows, key=lambda row: _grid_row(row[1]) * GRID_COLUMNS + _grid_column(row[2]))
+    types = sorted({row[3] for row in rows if row[3] is not None})
+    type_codes = {ptype: code for code, ptype in enumerate(types, start=1)}
+
+    name = uuid.uuid4().hex
+    directory = os.path.join(path, name)
+    os.makedirs(directory)
+    cells = np.array([_grid_row(row[1]) * GRID_COLUMNS + _grid_column(row[2]) for row in rows], dtype=np.int32)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row[5]) for row in rows])
+    _save(directory, 'ids', np.array([row[0] for row in rows], dtype=str))
+    _save(directory, 'lat', np.array([row[1] for row in rows], dtype=np.float32))
+    _save(directory, 'lon', np.array([row[2] for row in rows], dtype=np.float32))
+    _save(directory, 'type', np.array([type_codes.get(row[3], 0) for row in rows], dtype=np.uint8))
+    _save(directory, 'flags', np.array([row[4] for row in rows], dtype=np.uint8))
+    _save(directory, 'offsets', offsets)
+    _save(directory, 'cells', np.searchsorted(cells, np.arange(GRID_ROWS * GRID_COLUMNS + 1)).astype(np.int64))
+    with open(os.path.join(directory, 'blob.bin'), 'wb') as blob_file:
+        for row in rows:
+            blob_file.write(row[5])
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({"generation": generation, "types": types, "count": len(rows),
+                   "full_built_at": time.time() if full_built_at is None else full_built_at}, meta_file)
+
+    pointer = os.path.join(path, POINTER)
+    previous = _read_pointer(path)
+    with open(pointer + '.tmp', 'w') as pointer_file:
+        pointer_file.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    # readers may still map the previous snapshot, keep it until the next swap
+    for entry in os.listdir(path):
+        if entry not in (name, previous) and os.path.isdir(os.path.join(path, entry)):
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+    return name
+
+
+def _read_pointer(path):
+    try:
+        with open(os.path.join(path, POINTER)) as pointer_file:
+            return pointer_file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _load(directory, name, count):
+    if count == 0:
+        return np.load(os.path.join(directory, name + '.npy'))
+    return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+
+class Snapshot:
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self.generation = meta['generation']
+        self.types = meta['types']
+        self.full_built_at = meta['full_built_at']
+        count = meta['count']
+        self.ids = _load(directory, 'ids', count)
+        self.lat = _load(directory, 'lat', count)
+        self.lon = _load(directory, 'lon', count)
+        self.type = _load(directory, 'type', count)
+        self.flags = _load(directory, 'flags', count)
+        self.offsets = _load(directory, 'offsets', count)
+        self.cells = np.load(os.path.join(directory, 'cells.npy'), mmap_mode='r')
+        if self.offsets[-1] == 0:
+            self.blob = np.zeros(0, dtype=np.uint8)
+        else:
+            self.blob = np.memmap(os.path.join(directory, 'blob.bin'), dtype=np.uint8, mode='r')
+
+    @classmethod
+    def open(cls, path):
+        name = _read_pointer(path)
+        if name is None:
+            return None
+        return cls(os.path.join(path, name))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def rows(self):
+        for i in range(len(self)):
+            code = int(self.type[i])
+            yield (str(self.ids[i]), float(self.lat[i]), float(self.lon[i]),
+                   self.types[code - 1] if code else None, int(self.flags[i]), self._blob(i))
+
+    def _blob(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def select(self, top_right, bottom_left, point_type=None, limit=None):
+        """Indices of points inside the bounding box, optionally limited to the given types
+        """
+        south, north = float(bottom_left.lat), float(top_right.lat)
+        west, east = float(bottom_left.lon), float(top_right.lon)
+        lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        parts = []
+        for grid_row in range(_grid_row(south), _grid_row(north) + 1):
+            for lo, hi in lon_ranges:
+                start = self.cells[grid_row * GRID_COLUMNS + _grid_column(lo)]
+                stop = self.cells[grid_row * GRID_COLUMNS + _grid_column(hi) + 1]
+                if stop > start:
+                    parts.append(np.arange(start, stop))
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.concatenate(parts)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        mask = (lat >= south) & (lat <= north)
+        if west <= east:
+            mask &= (lon >= west) & (lon <= east)
+        else:
+            mask &= (lon >= west) | (lon <= east)
+        if point_type not in [None, []]:
+            codes = [self.types.index(ptype) + 1 for ptype in point_type if ptype in self.types]
+            mask &= np.isin(self.type[candidates], codes)
+        return candidates[mask][:limit]
+
+    def points_json(self, top_right, bottom_left, point_type=None, limit=None):
+        """Same JSON document `Elasticsearch.get_points` returns for anonymous users
+        """
+        indices = self.select(top_right, bottom_left, point_type=point_type, limit=limit)
+        return b'{"points":[' + b','.join(self._blob(i) for i in indices) + b']}'
+
+
+class SnapshotReader:
+    """Keeps the current snapshot mapped, checking for a newer one at most every `check_interval` seconds
+    """
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.snapshot = None
+        self._name = None
+        self._checked_at = 0
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            name = _read_pointer(self.path)
+            if name is not None and name != self._name:
+                self.snapshot = Snapshot(os.path.join(self.path, name))
+                self._name = name
+        return self.snapshot
+
+
+def mark_dirty(point_ids, locations=()):
+    """Elasticsearch listener scheduling `point_ids` for the next incremental rebuild
+    """
+    pipe = redis_client().pipeline()
+    pipe.sadd(DIRTY_KEY, *point_ids)
+    pipe.incr(GENERATION_KEY)
+    pipe.execute()
+
+
+def refresh(es, path, redis=None, full_interval=3600):
+    """Brings the snapshot in `path` up to date, returns True if a new one was written
+    """
+    redis = redis_client() if redis is None else redis
+    generation = int(redis.get(GENERATION_KEY) or 0)
+    current = Snapshot.open(path)
+    full = current is None or time.time() - current.full_built_at >= full_interval
+    if not full and current.generation == generation:
+        return False
+
+    pipe = redis.pipeline()
+    pipe.sunionstore(PROCESSING_KEY, [PROCESSING_KEY, DIRTY_KEY])
+    pipe.delete(DIRTY_KEY)
+    pipe.execute()
+    try:
+        dirty = {member.decode() for member in redis.smembers(PROCESSING_KEY)}
+        if full:
+            rows = [_row(hit) for hit in helpers.scan(es.es, index=es.index, query=PUBLISHED_QUERY)]
+            write_snapshot(path, rows, generation)
+        else:
+            rows = [row for row in current.rows() if row[0] not in dirty]
+            if dirty:
+                response = es.es.mget(index=es.index, body={"ids": sorted(dirty)})
+                rows.extend(_row(doc) for doc in response['docs']
+                            if doc.get('found') and not doc['_source'].get('unpublished'))
+            write_snapshot(path, rows, generation, full_built_at=current.full_built_at)
+    except Exception:
+        redis.sunionstore(DIRTY_KEY, [DIRTY_KEY, PROCESSING_KEY])
+        raise
+    redis.delete(PROCESSING_KEY)
+    return True
+
+
+async def refresh_forever(es, path, interval=5, full_interval=3600):
+    redis = redis_client()
+    while True:
+        try:
+            if await run_in_threadpool(redis.set, LOCK_KEY, 1, nx=True, ex=600):
+                try:
+                    await run_in_threadpool(refresh, es, path, redis=redis, full_interval=full_interval)
+                finally:
+                    await run_in_threadpool(redis.delete, LOCK_KEY)
+        except Exception:
+            logger.exception('points snapshot refresh failed')
+        await asyncio.sleep(interval)
+
+
+def start(config):
+    """Starts serving and rebuilding the snapshot if `SNAPSHOT_PATH` is configured
+    """
+    global _reader, _task
+    if not config.SNAPSHOT_PATH:
+        return
+    os.makedirs(config.SNAPSHOT_PATH, exist_ok=True)
+    if mark_dirty not in Elasticsearch.listeners:
+        Elasticsearch.listeners.append(mark_dirty)
+    _reader = SnapshotReader(config.SNAPSHOT_PATH)
+    _task = asyncio.get_event_loop().create_task(
+        refresh_forever(Elasticsearch.connection(), config.SNAPSHOT_PATH, interval=config.SNAPSHOT_INTERVAL,
+                        full_interval=config.SNAPSHOT_FULL_INTERVAL))
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+def points_json(top_right, bottom_left, point_type=None, limit=None):
+    """Anonymous `get_points` response served from the snapshot, or None when there is no snapshot to serve from
+    """
+    if _reader is None:
+        return None
+    snapshot = _reader.current()
+    if snapshot is None:
+        return None
+    return snapshot.points_json(top_right, bottom_left, point_type=point_type, limit=limit)
@@ -0,0 +1,125 @@
+""" Serving of uploaded images
+
+An image name is never reused for other content, so image responses may be cached for a year as immutable, with a
+strong ETag derived from the path. `ImageFiles` answers conditional requests with 304 and single byte ranges with 206,
+and hands the file to the server through the ASGI zero-copy extension when the server offers it. Otherwise the file is
+streamed in `ImageResponse.chunk_size` reads. Images are compressed already, so `GZipMiddleware` takes paths to skip.
+"""
+import hashlib
+import os
+
+import aiofiles
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware as StarletteGZipMiddleware
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Inclusive (start, end) of a single `bytes=` range, None if the header should be ignored
+
+    Raises RangeNotSatisfiable when the range lies outside a file of `size` bytes.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    start, separator, end = ranges.strip().partition('-')
+    if not separator or not (start + end).isdigit():
+        return None
+    if start == '':
+        if int(end) == 0:
+            raise RangeNotSatisfiable()
+        return max(size - int(end), 0), size - 1
+    start, end = int(start), int(end) if end else None
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end is None:
+        return start, size - 1
+    return start, min(end, size - 1)
+
+
+class ImageResponse(FileResponse):
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, stat_result, method, etag, byte_range=None):
+        super().__init__(path, status_code=206 if byte_range else 200, stat_result=stat_result, method=method,
+                         headers={"etag": etag, "cache-control": CACHE_CONTROL, "accept-ranges": "bytes"})
+        size = stat_result.st_size
+        if byte_range:
+            self.offset, self.count = byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.headers['content-range'] = 'bytes {}-{}/{}'.format(byte_range[0], byte_range[1], size)
+            self.headers['content-length'] = str(self.count)
+        else:
+            self.offset, self.count = 0, size
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif 'http.response.zerocopy' in (scope.get('extensions') or {}):
+            with open(self.path, 'rb') as file:
+                await send({"type": "http.response.zerocopy", "file": file, "offset": self.offset,
+                            "count": self.count, "more_body": False})
+        else:
+            async with aiofiles.open(self.path, mode='rb') as file:
+                await file.seek(self.offset)
+                remaining = self.count
+                more_body = True
+                while more_body:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    remaining -= len(chunk)
+                    more_body = remaining > 0 and len(chunk) > 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+class ImageFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code=status_code)
+        request_headers = Headers(scope=scope)
+        name = os.path.relpath(full_path, self.directory) if self.directory else str(full_path)
+        etag = '"{}"'.format(hashlib.md5(name.encode()).hexdigest())
+
+        response = ImageResponse(full_path, stat_result, scope['method'], etag)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        if 'range' in request_headers and request_headers.get('if-range', etag) == etag:
+            try:
+                byte_range = parse_range(request_headers['range'], stat_result.st_size)
+            except RangeNotSatisfiable:
+                return Response(status_code=416, headers={"content-range": "bytes */{}".format(stat_result.st_size)})
+            if byte_range is not None:
+                return ImageResponse(full_path, stat_result, scope['method'], etag, byte_range=byte_range)
+        return response
+
+    def is_not_modified(self, response_headers, request_headers):
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is None:
+            return super().is_not_modified(response_headers, request_headers)
+        # If-None-Match takes precedence over If-Modified-Since and may list several, possibly weak, tags
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        etag = response_headers['etag']
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+class GZipMiddleware(StarletteGZipMiddleware):
+    """Starlette's GZipMiddleware leaving responses under `exclude_paths` alone
+    """
+    def __init__(self, app, minimum_size=500, exclude_paths=()):
+        super().__init__(app, minimum_size=minimum_size)
+        self.exclude_paths = tuple(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
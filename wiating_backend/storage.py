@@ -0,0 +1,220 @@
+""" Image store behind `STORE_PROPERTY`, either a `file://` directory or an `s3://` bucket
+
+All calls block, routes hand them to `run`, which uses a dedicated pool of `STORAGE_WORKERS` threads so slow
+storage can not starve the default threadpool. The S3 client is created once per process and shared by those
+threads, its connection pool sized to match.
+
+Images are stored under the SHA-256 of their content, hashed from the local spool file before anything is written. A
+Redis set per point, `images:stored:<point_id>`, indexes the names already in the store, so `image_stored` tells an
+upload of new bytes from a re-upload of a stored image, which is not written again. A name is claimed only once its
+bytes are in place. The index is per point because
+images live in the point's directory and go away with it, the same bytes on two points are two files.
+"""
+import asyncio
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import uuid4
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .cache import redis_client
+from .config import DefaultConfig
+from .logger import logger
+from .resize import variant_name
+from .uploads import CHUNK_SIZE, LimitedReader
+
+
+config = DefaultConfig()
+
+# delete_objects accepts at most this many keys per call
+DELETE_BATCH_SIZE = 1000
+STORED_KEY = 'images:stored:'
+
+_s3 = None
+_s3_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def s3_client():
+    """The S3 client shared by the process, boto3 clients are thread-safe once created
+    """
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                _s3 = boto3.session.Session().client(
+                    's3', config=Config(max_pool_connections=config.STORAGE_WORKERS))
+    return _s3
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.STORAGE_WORKERS, thread_name_prefix='storage')
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking storage call on the storage executor
+    """
+    return await asyncio.get_event_loop().run_in_executor(executor(), partial(func, *args, **kwargs))
+
+
+def stop():
+    """Waits for the running storage calls and shuts the executor down
+    """
+    global _executor
+    with _executor_lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _store():
+    return config.STORE_PROPERTY.split('//', 1)[1]
+
+
+def presigned_upload(key, content_type, expires_in):
+    """Presigned POST letting a client store one image of `content_type` at `key` straight in the bucket
+
+    Unlike a presigned PUT, the POST policy also caps the size at `MAX_CONTENT_LENGTH`.
+    """
+    fields = {"acl": "public-read", "Content-Type": content_type}
+    conditions = [{"acl": "public-read"}, {"Content-Type": content_type},
+                  ["content-length-range", 1, config.MAX_CONTENT_LENGTH]]
+    return s3_client().generate_presigned_post(Bucket=_store(), Key=key, Fields=fields, Conditions=conditions,
+                                               ExpiresIn=expires_in)
+
+
+def stored_object(key):
+    """Metadata of the object at `key`, None if there is none
+    """
+    try:
+        return s3_client().head_object(Bucket=_store(), Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def delete_objects(bucket, keys):
+    """Deletes `keys` with as few requests as possible, logging the keys S3 failed to delete
+    """
+    keys = list(keys)
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        response = s3_client().delete_objects(
+            Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.error('deleting s3://%s/%s failed: %s', bucket, error.get('Key'), error.get('Message'))
+
+
+def delete_prefix(bucket, prefix):
+    """Deletes every object under `prefix`, one list and one delete request per 1000 keys
+    """
+    paginator = s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys = [item['Key'] for item in page.get('Contents', [])]
+        if keys:
+            delete_objects(bucket, keys)
+
+
+def image_stored(point_id, image_name):
+    return bool(redis_client().sismember(STORED_KEY + point_id, image_name))
+
+
+def claim_image(point_id, image_name):
+    """Records `image_name`, already in the store, as stored for the point
+
+    Returns False if it already was, because a concurrent upload of the same bytes claimed it first.
+    """
+    return bool(redis_client().sadd(STORED_KEY + point_id, image_name))
+
+
+def release_image(point_id, image_name):
+    redis_client().srem(STORED_KEY + point_id, image_name)
+
+
+def delete_image_directory(path):
+    store_property = _store()
+
+    if config.STORE_PROPERTY.startswith('file://'):
+        try:
+            shutil.rmtree(os.path.join(store_property, path))
+        except FileNotFoundError:
+            pass
+    elif config.STORE_PROPERTY.startswith('s3://'):
+        delete_prefix(store_property, path + '/')
+    redis_client().delete(STORED_KEY + path)
+
+
+def delete_image_file(point_id, image_name):
+    store_property = _store()
+    # a variant is missing while its resize job is pending or after it failed
+    variants = [variant_name(image_name, suffix) for suffix in config.RESIZE_SIZES]
+
+    if config.STORE_PROPERTY.startswith('file://'):
+        os.remove(os.path.join(store_property, point_id, image_name))
+        for variant in variants:
+            try:
+                os.remove(os.path.join(store_property, point_id, variant))
+            except FileNotFoundError:
+                pass
+    elif config.STORE_PROPERTY.startswith('s3://'):
+        delete_objects(store_property, ['/'.join((point_id, name)) for name in [image_name] + variants])
+    release_image(point_id, image_name)
+
+
+def create_image_directory(path):
+    store_property = _store()
+
+    if config.STORE_PROPERTY.startswith('file://'):
+        try:
+            os.mkdir(os.path.join(store_property, path))
+        except FileExistsError:
+            pass
+    elif config.STORE_PROPERTY.startswith('s3://'):
+        try:
+            s3_client().put_object(Bucket=store_property, Key=(path + '/'))
+        except ClientError:
+            raise
+
+
+def upload_file(file_object, filename):
+    """Copies the upload to the store in chunks of `CHUNK_SIZE`
+
+    Raises FileTooLarge past `MAX_CONTENT_LENGTH` bytes, leaving nothing behind in the store.
+    """
+    store_property = _store()
+    file_object.file.seek(0)
+    reader = LimitedReader(file_object.file, config.MAX_CONTENT_LENGTH)
+
+    if config.STORE_PROPERTY.startswith('file://'):
+        path = os.path.join(store_property, filename)
+        # concurrent uploads of the same bytes write the same name, each through its own part file
+        part = '{}.{}.part'.format(path, uuid4().hex)
+        try:
+            with open(part, 'wb') as write_file:
+                shutil.copyfileobj(reader, write_file, CHUNK_SIZE)
+            os.replace(part, path)
+        except BaseException:
+            try:
+                os.remove(part)
+            except FileNotFoundError:
+                pass
+            raise
+    elif config.STORE_PROPERTY.startswith('s3://'):
+        try:
+            # upload_fileobj switches to a multipart upload above its threshold and aborts it if reading fails
+            s3_client().upload_fileobj(reader, store_property, filename,
+                                       ExtraArgs={'ACL': 'public-read', 'ContentType': file_object.content_type})
+        except ClientError:
+            raise
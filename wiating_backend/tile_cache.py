@@ -0,0 +1,177 @@
+""" Redis cache of `get_points` results split into fixed web mercator tiles
+
+A viewport is decomposed into the tiles covering it at `TILE_CACHE_ZOOM`. Cached tiles are read from Redis, the
+missing ones are fetched from Elasticsearch with a single query over their joint bounding box, and the stitched result
+is clipped to the requested bounding box. Entries are keyed by tile, type filter, moderator flag, view and a per-tile
+version which `invalidate` bumps whenever a point inside the tile is written. Search is near real-time, so the version
+is bumped a second time after `refresh_delay` seconds to drop entries filled before the write became searchable.
+Those second bumps are made by a single `DelayedBumps` thread, which bumps a tile written several times meanwhile
+only once.
+"""
+import heapq
+import json
+import threading
+import time
+
+from . import mvt
+from .cache import redis_client
+from .logger import logger
+
+
+VERSION_KEY = 'points:tiles:version:{z}:{x}:{y}'
+ENTRY_KEY = 'points:tiles:{z}:{x}:{y}:{version}:{moderator}:{view}:{types}'
+
+_zoom = None
+_ttl = 3600
+_refresh_delay = 2.0
+_delayed = None
+
+
+def tiles_for_bbox(top_right, bottom_left, zoom, max_tiles=None):
+    """Tiles at `zoom` covering the bounding box
+
+    The list is empty if the bounding box crosses the antimeridian or spans more than `max_tiles` tiles, which is
+    decided from the tile index bounds before any tile is listed.
+    """
+    left, top = mvt.tile_index(top_right.lat, bottom_left.lon, zoom)
+    right, bottom = mvt.tile_index(bottom_left.lat, top_right.lon, zoom)
+    count = max(right - left + 1, 0) * max(bottom - top + 1, 0)
+    if max_tiles is not None and count > max_tiles:
+        return []
+    return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+
+def bbox_of_tiles(tiles, zoom):
+    """Returns (west, south, east, north) of the smallest bounding box containing every tile
+    """
+    west, south, _, _ = mvt.tile_bounds(zoom, min(x for x, _ in tiles), max(y for _, y in tiles))
+    _, _, east, north = mvt.tile_bounds(zoom, max(x for x, _ in tiles), min(y for _, y in tiles))
+    return west, south, east, north
+
+
+def bucket(points, tiles, zoom):
+    """Groups serialized points by the tile containing them, every tile in `tiles` gets a (possibly empty) list
+    """
+    buckets = {tile: [] for tile in tiles}
+    for point in points:
+        tile = mvt.tile_index(point['location']['lat'], point['location']['lon'], zoom)
+        if tile in buckets:
+            buckets[tile].append(point)
+    return buckets
+
+
+def clip(buckets, top_right, bottom_left):
+    south, north = float(bottom_left.lat), float(top_right.lat)
+    west, east = float(bottom_left.lon), float(top_right.lon)
+    return [point for points in buckets for point in points
+            if south <= float(point['location']['lat']) <= north and west <= float(point['location']['lon']) <= east]
+
+
+def _types(point_type):
+    return ','.join(sorted(point_type)) if point_type else '*'
+
+
+def lookup(tiles, zoom, point_type=None, is_moderator=False, view=None, redis=None):
+    """Returns (cached, missing, versions): cached tiles with their points, tiles to fetch and every tile's version
+    """
+    redis = redis_client() if redis is None else redis
+    versions = redis.mget([VERSION_KEY.format(z=zoom, x=x, y=y) for x, y in tiles])
+    versions = {tile: int(version or 0) for tile, version in zip(tiles, versions)}
+    keys = [ENTRY_KEY.format(z=zoom, x=x, y=y, version=versions[(x, y)], moderator=int(is_moderator),
+                             view=view or 'full', types=_types(point_type)) for x, y in tiles]
+    cached, missing = {}, []
+    for tile, entry in zip(tiles, redis.mget(keys)):
+        if entry is None:
+            missing.append(tile)
+        else:
+            cached[tile] = json.loads(entry)
+    return cached, missing, versions
+
+
+def store(buckets, versions, zoom, point_type=None, is_moderator=False, view=None, redis=None):
+    redis = redis_client() if redis is None else redis
+    pipe = redis.pipeline(transaction=False)
+    for (x, y), points in buckets.items():
+        key = ENTRY_KEY.format(z=zoom, x=x, y=y, version=versions[(x, y)], moderator=int(is_moderator),
+                               view=view or 'full', types=_types(point_type))
+        pipe.set(key, json.dumps(points, separators=(',', ':')), ex=_ttl)
+    pipe.execute()
+
+
+def _bump(tiles, redis=None):
+    redis = redis_client() if redis is None else redis
+    pipe = redis.pipeline(transaction=False)
+    for x, y in tiles:
+        pipe.incr(VERSION_KEY.format(z=_zoom, x=x, y=y))
+    pipe.execute()
+
+
+class DelayedBumps:
+    """Bumps tiles once `delay` seconds passed since they were last added, from one long-lived thread
+    """
+    def __init__(self, delay, bump):
+        self.delay = delay
+        self.bump = bump
+        self._due = {}
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, tiles):
+        due = time.monotonic() + self.delay
+        with self._condition:
+            for tile in tiles:
+                # a pending tile keeps its heap entry and is pushed back when that entry comes up early
+                if tile not in self._due:
+                    heapq.heappush(self._heap, (due, tile))
+                self._due[tile] = due
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tile-cache-bumps', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._due)
+
+    def _take(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = []
+                while self._heap and self._heap[0][0] <= now:
+                    due, tile = heapq.heappop(self._heap)
+                    if self._due[tile] > due:
+                        heapq.heappush(self._heap, (self._due[tile], tile))
+                    else:
+                        del self._due[tile]
+                        ready.append(tile)
+                if ready:
+                    return ready
+                self._condition.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            tiles = self._take()
+            try:
+                self.bump(tiles)
+            except Exception:
+                logger.exception('bumping %d tile cache versions failed', len(tiles))
+
+
+def invalidate(point_ids, locations, redis=None):
+    """Elasticsearch listener bumping the version of every tile the written points were or are in
+    """
+    if _zoom is None or not locations:
+        return
+    tiles = {mvt.tile_index(lat, lon, _zoom) for lat, lon in locations}
+    _bump(tiles, redis=redis)
+    _delayed.add(tiles)
+
+
+def start(zoom, ttl=3600, refresh_delay=2.0):
+    """Sets the zoom whose tiles `invalidate` bumps and how long entries live
+    """
+    global _zoom, _ttl, _refresh_delay, _delayed
+    _zoom, _ttl, _refresh_delay = zoom, ttl, refresh_delay
+    _delayed = DelayedBumps(refresh_delay, _bump)
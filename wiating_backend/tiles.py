@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+
+from . import mvt
+from .config import DefaultConfig
+from .elastic import AsyncElasticsearch
+
+
+tiles = APIRouter()
+config = DefaultConfig()
+
+
+@tiles.get('/tiles/{z}/{x}/{y}.mvt')
+async def get_tile(z: int, x: int, y: int, es: dict = Depends(AsyncElasticsearch.connection)):
+    """
+    Published points of a web mercator tile as a Mapbox Vector Tile with a single `points` layer. Every feature carries
+    `id`, `type`, `name`, `water_exists` and `fire_exists`. Tiles are the same for every user, so they are cacheable.
+    """
+    if not 0 <= z <= 24 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    tile = await es.get_tile(z, x, y, size=config.TILE_MAX_POINTS)
+    return Response(content=tile, media_type=mvt.MEDIA_TYPE,
+                    headers={'Cache-Control': 'public, max-age={}'.format(config.TILE_MAX_AGE)})
@@ -0,0 +1,113 @@
+""" Local verification of Auth0 access tokens
+
+With `AUTH_LOCAL_JWT` enabled `check_permissions` verifies RS256 access tokens against the tenant's JSON Web Key Set
+instead of calling the userinfo endpoint. The key set is fetched on first use and refreshed on a background thread
+every `refresh_interval` seconds while the current keys keep being served. A token signed with a key id that is not in
+the set forces a refresh, at most once every `min_refresh_interval` seconds, so a key rotation is picked up at once
+without letting garbage tokens hammer Auth0. Tokens that are not JWTs, or a key set that can not be fetched, raise
+`NotVerifiable` and the caller falls back to userinfo.
+"""
+import threading
+import time
+
+import requests
+from authlib.jose import JsonWebKey, JsonWebToken
+from authlib.jose.errors import DecodeError, JoseError
+
+from .logger import logger
+
+
+_jwt = JsonWebToken(['RS256'])
+_key_sets = {}
+
+
+class NotVerifiable(Exception):
+    """The token can not be verified locally, ask Auth0 instead"""
+
+
+class KeySet:
+    def __init__(self, url, refresh_interval=3600, min_refresh_interval=30, timeout=5):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def get(self):
+        if self._keys is None:
+            return self.refresh()
+        if time.monotonic() - self._fetched_at >= self.refresh_interval:
+            self._refresh_in_background()
+        return self._keys
+
+    def refresh(self):
+        """Fetches the key set now, unless that already happened less than `min_refresh_interval` seconds ago
+        """
+        with self._lock:
+            if self._keys is not None and time.monotonic() - self._fetched_at < self.min_refresh_interval:
+                return self._keys
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            self._keys = JsonWebKey.import_key_set(response.json())
+            self._fetched_at = time.monotonic()
+            return self._keys
+
+    def _refresh_in_background(self):
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('refreshing the JSON Web Key Set from %s failed', self.url)
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
+
+
+def key_set(config):
+    """The process wide key set of the configured tenant
+    """
+    url = config.AUTH0_BASE_URL + '/.well-known/jwks.json'
+    keys = _key_sets.get(url)
+    if keys is None:
+        keys = _key_sets.setdefault(url, KeySet(url, refresh_interval=config.AUTH_JWKS_REFRESH_INTERVAL))
+    return keys
+
+
+def _decode(token, jwks, options):
+    try:
+        return _jwt.decode(token, jwks, claims_options=options)
+    except DecodeError as e:
+        raise NotVerifiable('not a JSON Web Token') from e
+
+
+def verify(token, keys, issuer, audience):
+    """Returns the claims of a valid token, raises `JoseError` for an invalid one
+    """
+    # an essential claim missing from the token fails validation with MissingClaimError, a JoseError
+    options = {"iss": {"essential": True, "value": issuer}, "aud": {"essential": True, "value": audience},
+               "exp": {"essential": True}, "sub": {"essential": True}}
+    try:
+        jwks = keys.get()
+    except (requests.RequestException, ValueError) as e:
+        raise NotVerifiable('JSON Web Key Set unavailable') from e
+    try:
+        claims = _decode(token, jwks, options)
+    except ValueError:
+        # authlib's way of saying the key id is unknown, the tenant may have rotated its keys
+        try:
+            jwks = keys.refresh()
+        except (requests.RequestException, ValueError) as e:
+            raise NotVerifiable('JSON Web Key Set unavailable') from e
+        try:
+            claims = _decode(token, jwks, options)
+        except ValueError:
+            raise JoseError('invalid_token', 'Token signed with an unknown key')
+    claims.validate()
+    return claims
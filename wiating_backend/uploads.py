@@ -0,0 +1,111 @@
+""" Size bounded streaming of uploaded files
+
+Starlette spools multipart uploads to a temporary file, so an upload only costs memory while it is copied to the
+store. `LimitedReader` hands the spooled file out in `CHUNK_SIZE` pieces, hashing them on the way and raising
+`FileTooLarge` as soon as more than `limit` bytes were read. `content_hash` reads it the same way to name the image
+before anything is stored. `ContentSizeLimitMiddleware` rejects oversized request
+bodies with 413 before they are even spooled, from the Content-Length header or while the body streams in, in which
+case the app sees the client disconnect.
+"""
+import hashlib
+import json
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+class LimitedReader:
+    """File-like view of an upload that hashes what is read and fails past `limit` bytes
+    """
+    def __init__(self, file, limit):
+        self.file = file
+        self.limit = limit
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=CHUNK_SIZE):
+        chunk = self.file.read(CHUNK_SIZE if size is None or size < 0 else size)
+        self.size += len(chunk)
+        if self.size > self.limit:
+            raise FileTooLarge('upload larger than {} bytes'.format(self.limit))
+        self.sha256.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def content_hash(file, limit):
+    """SHA-256 hex digest of a spooled upload, read in chunks of `CHUNK_SIZE`
+
+    Raises FileTooLarge past `limit` bytes. Leaves the file at its start.
+    """
+    file.seek(0)
+    reader = LimitedReader(file, limit)
+    while reader.read(CHUNK_SIZE):
+        pass
+    file.seek(0)
+    return reader.hexdigest()
+
+
+class ContentSizeLimitMiddleware:
+    """Answers 413 to requests under `paths` whose body is larger than `max_size` bytes
+    """
+    def __init__(self, app, max_size, paths=('/',)):
+        self.app = app
+        self.max_size = max_size
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_size:
+            await self._too_large(send)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:
+                    if response_started:
+                        raise FileTooLarge('request body larger than {} bytes'.format(self.max_size))
+                    # FastAPI turns any error raised while it parses a form into a 400, so answer here and let the
+                    # app see a client that went away
+                    rejected = True
+                    await self._too_large(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = response_started or message['type'] == 'http.response.start'
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def _too_large(self, send):
+        body = json.dumps({"detail": "Request Entity Too Large"}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                                (b'connection', b'close')]})
+        await send({"type": "http.response.body", "body": body})
@@ -1,7 +1,14 @@
+import asyncio
+import threading
+import time
+from typing import List
+
 from auth0.v3 import Auth0Error
 from auth0.v3.management import Auth0
 from auth0.v3.authentication import GetToken
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
 
 from .auth import require_moderator
 from .config import DefaultConfig
@@ -11,24 +18,87 @@ from .config import DefaultConfig
 user_mgmt = APIRouter()
 config = DefaultConfig()
 
+# fetch a new management token this many seconds before the current one expires
+TOKEN_EXPIRY_MARGIN = 60
+
+_client = None
+_client_expires_at = 0
+_client_lock = threading.Lock()
+
 
 def get_token():
+    """Client credentials exchange, returns the management API token and its lifetime in seconds
+    """
     gt = GetToken(config.AUTH0_DOMAIN)
     token = gt.client_credentials(config.AUTH0_CLIENT_ID,
                                   config.AUTH0_CLIENT_SECRET,
                                   'https://{}/api/v2/'.format(config.AUTH0_DOMAIN))
     mgmt_api_token = token['access_token']
-    return mgmt_api_token
+    return mgmt_api_token, token.get('expires_in', 86400)
+
+
+def management_client():
+    """The management client shared by the process, rebuilt with a new token shortly before the old one expires
+    """
+    global _client, _client_expires_at
+    with _client_lock:
+        if _client is None or time.monotonic() >= _client_expires_at:
+            mgmt_api_token, expires_in = get_token()
+            _client = Auth0(config.AUTH0_DOMAIN, mgmt_api_token)
+            _client_expires_at = time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN
+        return _client
+
+
+def _discard_client(client):
+    global _client
+    with _client_lock:
+        if _client is client:
+            _client = None
+
+
+def block_user(user_id):
+    client = management_client()
+    try:
+        client.users.update(user_id, {"blocked": True})
+    except Auth0Error as e:
+        # the token may have been revoked before it expired, retry once with a new one
+        if e.status_code != 401:
+            raise
+        _discard_client(client)
+        management_client().users.update(user_id, {"blocked": True})
+
+
+class UserIds(BaseModel):
+    ids: List[str]
 
 
 @user_mgmt.post('/ban_user/{ban_user_id}', dependencies=[Depends(require_moderator)])
 def ban_user(ban_user_id: str):
-    ban_user_id = ban_user_id
-    mgmt_api_token = get_token()
-    auth0 = Auth0(config.AUTH0_DOMAIN, mgmt_api_token)
-    body = {"blocked": True}
     try:
-        auth0.users.update(ban_user_id, body)
+        block_user(ban_user_id)
     except Auth0Error:
         raise HTTPException(status_code=403)
     return {"status": "success"}
+
+
+@user_mgmt.post('/ban_users', dependencies=[Depends(require_moderator)])
+async def ban_users(user_ids: UserIds):
+    """Bans every listed user, at most `BAN_CONCURRENCY` at a time
+
+    Users Auth0 refused to block are listed in `failed` with the reason, the others in `banned`.
+    """
+    ids = list(dict.fromkeys(user_ids.ids))
+    if len(ids) > config.MAX_BAN_USERS:
+        raise HTTPException(status_code=400, detail="At most {} ids allowed".format(config.MAX_BAN_USERS))
+    semaphore = asyncio.Semaphore(config.BAN_CONCURRENCY)
+
+    async def ban(user_id):
+        async with semaphore:
+            try:
+                await run_in_threadpool(block_user, user_id)
+            except Auth0Error as e:
+                return {"id": user_id, "error": e.message}
+
+    results = await asyncio.gather(*(ban(user_id) for user_id in ids))
+    return {"banned": [user_id for user_id, error in zip(ids, results) if error is None],
+            "failed": [error for error in results if error is not None]}